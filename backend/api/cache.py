@@ -0,0 +1,221 @@
+"""
+Cache delle risposte del catalogo alloggi e GET condizionali.
+
+Le risposte JSON di lista e dettaglio vengono salvate già serializzate,
+con una chiave che include la versione corrente del catalogo: ogni
+modifica ad Alloggio o FotoAlloggio incrementa la versione e rende
+irraggiungibili le voci precedenti, che scadono da sole.
+
+I ViewSet possono inoltre emettere ETag e Last-Modified calcolati senza
+serializzare nulla e rispondere 304 alle richieste condizionali.
+
+Versione del catalogo e risposte salvate valgono per tutti i processi solo
+se la cache è condivisa (Redis): con la cache in memoria locale ogni worker
+ne avrebbe una copia propria, che le modifiche gestite dagli altri worker
+non invaliderebbero. In quel caso la cache delle risposte è disattivata.
+"""
+
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+CHIAVE_VERSIONE_CATALOGO = 'catalogo:versione'
+CHIAVE_MODIFICA_CATALOGO = 'catalogo:modificato'
+
+# Durata massima delle risposte in cache, anche senza modifiche al catalogo
+TIMEOUT_RISPOSTE_CATALOGO = 60 * 10
+
+
+def cache_condivisa():
+    """
+    Indica se la cache di default è condivisa tra i processi, cioè se un
+    valore invalidato da un worker lo è anche per tutti gli altri.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def versione_catalogo():
+    """Ritorna la versione corrente del catalogo, inizializzandola se assente."""
+    versione = cache.get(CHIAVE_VERSIONE_CATALOGO)
+    if versione is None:
+        # Valore iniziale legato al tempo, così una versione persa dalla
+        # cache non torna mai a coincidere con una già usata
+        adesso = time.time()
+        cache.add(CHIAVE_VERSIONE_CATALOGO, int(adesso * 1000), timeout=None)
+        cache.add(CHIAVE_MODIFICA_CATALOGO, adesso, timeout=None)
+        versione = cache.get(CHIAVE_VERSIONE_CATALOGO)
+    return versione
+
+
+def ultima_modifica_catalogo():
+    """Ritorna il momento dell'ultima modifica nota del catalogo."""
+    modificato = cache.get(CHIAVE_MODIFICA_CATALOGO)
+    if modificato is None:
+        versione_catalogo()
+        modificato = cache.get(CHIAVE_MODIFICA_CATALOGO, time.time())
+    return datetime.fromtimestamp(modificato, tz=dt_timezone.utc)
+
+
+def incrementa_versione_catalogo():
+    """Invalida tutte le risposte del catalogo in cache."""
+    try:
+        cache.incr(CHIAVE_VERSIONE_CATALOGO)
+    except ValueError:
+        versione_catalogo()
+    cache.set(CHIAVE_MODIFICA_CATALOGO, time.time(), timeout=None)
+
+
+class CatalogoCacheMixin:
+    """
+    Mixin per ViewSet che salva in cache le risposte JSON di list e retrieve.
+
+    Un hit restituisce direttamente i byte salvati, senza query né
+    serializzazione. Le richieste con parametri elencati in
+    `parametri_non_cacheabili` (dipendenti da dati diversi dal catalogo)
+    non vengono messe in cache, né alcuna richiesta se la cache non è
+    condivisa tra i processi.
+    """
+    parametri_non_cacheabili = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.risposta_in_cache(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.risposta_in_cache(request, super().retrieve, *args, **kwargs)
+
+    def chiave_cache(self, request):
+        """Chiave della risposta: versione del catalogo, URL completo e formato."""
+        uri = request.build_absolute_uri()
+        impronta = hashlib.md5(uri.encode()).hexdigest()
+        return f'catalogo:{versione_catalogo()}:{request.accepted_renderer.format}:{impronta}'
+
+    def risposta_in_cache(self, request, vista, *args, **kwargs):
+        if (not cache_condivisa()
+                or request.accepted_renderer.format != 'json'
+                or any(p in request.query_params for p in self.parametri_non_cacheabili)):
+            return vista(request, *args, **kwargs)
+
+        chiave = self.chiave_cache(request)
+        salvata = cache.get(chiave)
+        if salvata is not None:
+            contenuto, content_type = salvata
+            return HttpResponse(contenuto, content_type=content_type)
+
+        response = vista(request, *args, **kwargs)
+        if response.status_code == 200:
+            def salva(risposta):
+                cache.set(
+                    chiave,
+                    (risposta.content, risposta['Content-Type']),
+                    TIMEOUT_RISPOSTE_CATALOGO
+                )
+            response.add_post_render_callback(salva)
+        return response
+
+
+class NonModificato(Exception):
+    """Interrompe la richiesta restituendo la risposta 304 già pronta."""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+class GetCondizionaleMixin:
+    """
+    Mixin per ViewSet che aggiunge ETag e Last-Modified a list e retrieve
+    e risponde 304 a If-None-Match / If-Modified-Since.
+
+    I validatori vengono calcolati prima della view con una sola query di
+    aggregazione (numero di righe e max(updated_at)), quindi una risposta
+    304 non esegue né la query della pagina né la serializzazione.
+
+    Le risposte che includono dati di righe collegate elencano le relazioni
+    in `relazioni_validatori` (o le ritornano da get_relazioni_validatori):
+    numero e max(updated_at) delle righe collegate entrano nella stessa
+    aggregazione, così anche una loro modifica (o eliminazione) cambia i
+    validatori.
+
+    `cache_control` sono le direttive aggiunte alle risposte validate; le
+    risposte con dati personali vi includono private.
+    """
+    etag = None
+    last_modified = None
+    relazioni_validatori = ()
+    cache_control = {'no_cache': True}
+
+    def get_relazioni_validatori(self):
+        """Relazioni i cui dati sono inclusi nella risposta dell'azione corrente."""
+        return self.relazioni_validatori
+
+    def validatori(self, request):
+        """
+        Ritorna (seme dell'ETag, data dell'ultima modifica) per la richiesta,
+        oppure None se la risposta non può essere validata.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        # Con le join sulle relazioni le righe si moltiplicano: conteggi distinti
+        relazioni = self.get_relazioni_validatori()
+        aggregati = {'totale': Count('pk', distinct=bool(relazioni)), 'ultimo': Max('updated_at')}
+        for n, relazione in enumerate(relazioni):
+            aggregati[f'totale_{n}'] = Count(f'{relazione}__pk', distinct=True)
+            aggregati[f'ultimo_{n}'] = Max(f'{relazione}__updated_at')
+        dati = queryset.order_by().aggregate(**aggregati)
+
+        seme = ':'.join(str(dati[chiave]) for chiave in aggregati)
+        ultimo = max(
+            (dati[chiave] for chiave in aggregati if chiave.startswith('ultimo') and dati[chiave]),
+            default=None,
+        )
+        return seme, ultimo
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD') or self.action not in ('list', 'retrieve'):
+            return
+
+        validatori = self.validatori(request)
+        if validatori is None:
+            return
+        seme, ultimo = validatori
+
+        # La rappresentazione dipende anche da URL (pagina, filtri, host) e formato
+        impronta = hashlib.md5(
+            f'{seme}:{request.build_absolute_uri()}:{request.accepted_renderer.format}'.encode()
+        ).hexdigest()
+        # ETag debole: alcune risposte includono un timestamp di generazione
+        self.etag = 'W/' + quote_etag(impronta)
+        self.last_modified = int(ultimo.timestamp()) if ultimo else None
+
+        response = get_conditional_response(
+            request._request, etag=self.etag, last_modified=self.last_modified
+        )
+        if response is not None:
+            raise NonModificato(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NonModificato):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.etag and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            if self.last_modified:
+                response['Last-Modified'] = http_date(self.last_modified)
+            # Le cache possono conservare la risposta ma devono rivalidarla
+            if not response.has_header('Cache-Control'):
+                patch_cache_control(response, **self.cache_control)
+        return response
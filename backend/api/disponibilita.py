@@ -0,0 +1,332 @@
+"""
+Funzioni di supporto per il calcolo dell'occupazione degli alloggi.
+Lavorano su intervalli di date semiaperti [check_in, check_out):
+la notte del giorno di check-out non è occupata.
+"""
+
+import calendar
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.backends.postgresql.psycopg_any import DateRange
+from django.db.models import F, Func, Q
+from django.utils import timezone
+
+from .cache import cache_condivisa
+from .models import Alloggio, PeriodoSoggiorno, Prenotazione
+
+# Notti coperte dalla bitmap di occupazione in cache (circa 18 mesi)
+ORIZZONTE_OCCUPAZIONE = 548
+
+# La bitmap viene comunque ricostruita ogni giorno, quando cambia la data iniziale
+TIMEOUT_OCCUPAZIONE = 60 * 60 * 24
+
+# Giorni esplorati prima e dopo il periodo richiesto per suggerire alternative
+ORIZZONTE_SUGGERIMENTI = 90
+
+# Scostamento massimo di prezzo per considerare due alloggi confrontabili
+TOLLERANZA_PREZZO_ALTERNATIVE = Decimal('0.30')
+
+MAX_ALLOGGI_ALTERNATIVI = 3
+
+
+def intervalli_occupati(alloggio, da, a):
+    """
+    Ritorna gli intervalli occupati dell'alloggio tra `da` e `a` (escluso).
+
+    Esegue una sola query ordinata per check_in e fonde in un unico
+    passaggio le prenotazioni sovrapposte o adiacenti. Gli intervalli
+    ritornati sono tuple (inizio, fine) già limitate al periodo richiesto.
+    """
+    prenotazioni = (
+        Prenotazione.sovrapposte(da, a)
+        .filter(alloggio=alloggio)
+        .order_by('check_in')
+        .values_list('check_in', 'check_out')
+    )
+
+    intervalli = []
+    for inizio, fine in prenotazioni:
+        inizio, fine = max(inizio, da), min(fine, a)
+        if intervalli and inizio <= intervalli[-1][1]:
+            if fine > intervalli[-1][1]:
+                intervalli[-1] = (intervalli[-1][0], fine)
+        else:
+            intervalli.append((inizio, fine))
+    return intervalli
+
+
+def mesi_nel_periodo(da, a):
+    """Genera il primo giorno di ogni mese compreso tra `da` e `a` (inclusi)."""
+    mese = da.replace(day=1)
+    while mese <= a:
+        yield mese
+        giorni = calendar.monthrange(mese.year, mese.month)[1]
+        mese = mese + timedelta(days=giorni)
+
+
+def calendario_mensile(alloggio, primo_mese, ultimo_mese):
+    """
+    Costruisce il calendario delle notti occupate per un intervallo di mesi.
+
+    Per ogni mese ritorna una bitmap testuale con un carattere per notte
+    ('1' occupata, '0' libera) e il numero di notti libere.
+    """
+    da = primo_mese.replace(day=1)
+    giorni_ultimo = calendar.monthrange(ultimo_mese.year, ultimo_mese.month)[1]
+    a = ultimo_mese.replace(day=giorni_ultimo) + timedelta(days=1)
+
+    intervalli = intervalli_occupati(alloggio, da, a)
+
+    notti = bytearray(b'0' * (a - da).days)
+    for inizio, fine in intervalli:
+        notti[(inizio - da).days:(fine - da).days] = b'1' * (fine - inizio).days
+
+    mesi = []
+    for mese in mesi_nel_periodo(da, ultimo_mese):
+        offset = (mese - da).days
+        giorni = calendar.monthrange(mese.year, mese.month)[1]
+        bitmap = notti[offset:offset + giorni].decode()
+        mesi.append({
+            'mese': mese.strftime('%Y-%m'),
+            'giorni': giorni,
+            'occupate': bitmap,
+            'notti_libere': bitmap.count('0'),
+        })
+
+    return {
+        'da': da,
+        'a': a,
+        'intervalli_occupati': [
+            {'check_in': inizio, 'check_out': fine} for inizio, fine in intervalli
+        ],
+        'mesi': mesi,
+    }
+
+
+def _chiavi_occupazione(alloggio_id):
+    """Ritorna le chiavi di cache (generazione, bitmap) di un alloggio."""
+    return (
+        f'occupazione:{alloggio_id}:generazione',
+        f'occupazione:{alloggio_id}:bitmap',
+    )
+
+
+def costruisci_occupazione(alloggio_id, inizio):
+    """
+    Costruisce la bitmap di occupazione dell'alloggio a partire da `inizio`.
+    Il bit i-esimo è acceso se la notte inizio + i giorni è occupata.
+    """
+    fine = inizio + timedelta(days=ORIZZONTE_OCCUPAZIONE)
+    bitmap = bytearray((ORIZZONTE_OCCUPAZIONE + 7) // 8)
+    for check_in, check_out in intervalli_occupati(alloggio_id, inizio, fine):
+        for notte in range((check_in - inizio).days, (check_out - inizio).days):
+            bitmap[notte >> 3] |= 1 << (notte & 7)
+    return bytes(bitmap)
+
+
+def occupazione_alloggio(alloggio_id):
+    """
+    Ritorna (inizio, bitmap) dell'alloggio, leggendola dalla cache.
+
+    La bitmap salvata è valida solo se appartiene alla generazione corrente
+    (incrementata a ogni modifica delle prenotazioni) e parte da oggi;
+    altrimenti viene ricostruita con una sola query e rimessa in cache.
+    """
+    chiave_generazione, chiave_bitmap = _chiavi_occupazione(alloggio_id)
+    valori = cache.get_many([chiave_generazione, chiave_bitmap])
+    generazione = valori.get(chiave_generazione, 0)
+    salvata = valori.get(chiave_bitmap)
+    oggi = timezone.localdate()
+
+    if salvata and salvata['generazione'] == generazione and salvata['inizio'] == oggi:
+        return salvata['inizio'], salvata['bitmap']
+
+    bitmap = costruisci_occupazione(alloggio_id, oggi)
+    cache.set(chiave_bitmap, {
+        'generazione': generazione,
+        'inizio': oggi,
+        'bitmap': bitmap,
+    }, TIMEOUT_OCCUPAZIONE)
+    return oggi, bitmap
+
+
+def invalida_occupazione(alloggio_id):
+    """Invalida la bitmap di occupazione dell'alloggio dopo una modifica."""
+    chiave_generazione, chiave_bitmap = _chiavi_occupazione(alloggio_id)
+    cache.add(chiave_generazione, 0, timeout=None)
+    try:
+        cache.incr(chiave_generazione)
+    except ValueError:
+        # Chiave scaduta o rimossa tra add e incr
+        cache.set(chiave_generazione, 1, timeout=None)
+    cache.delete(chiave_bitmap)
+
+
+def notti_libere(alloggio_id, check_in, check_out):
+    """
+    Verifica sulla bitmap in cache che tutte le notti del periodo siano libere.
+    Ritorna None se il periodo esce dall'orizzonte coperto dalla bitmap o se
+    la cache non è condivisa, e la verifica va fatta sul database.
+    """
+    if not cache_condivisa():
+        return None
+    inizio, bitmap = occupazione_alloggio(alloggio_id)
+    prima, ultima = (check_in - inizio).days, (check_out - inizio).days
+    if prima < 0 or ultima > ORIZZONTE_OCCUPAZIONE:
+        return None
+    return not any(bitmap[notte >> 3] & (1 << (notte & 7)) for notte in range(prima, ultima))
+
+
+def verifica_disponibilita(alloggio, check_in, check_out):
+    """
+    Verifica la disponibilità dell'alloggio usando la bitmap in cache,
+    con ricaduta su Prenotazione.check_disponibilita fuori dall'orizzonte.
+    La scrittura della prenotazione resta comunque protetta dal vincolo
+    di esclusione sul database.
+    """
+    libero = notti_libere(alloggio.pk, check_in, check_out)
+    if libero is None:
+        return Prenotazione.check_disponibilita(alloggio, check_in, check_out)
+    return libero
+
+
+def preventivi(richieste):
+    """
+    Calcola disponibilità e prezzo per una lista di richieste
+    {alloggio_id, check_in, check_out}, nello stesso ordine.
+
+    Usa un numero fisso di query: una per gli alloggi e una sola per
+    tutte le prenotazioni in conflitto con almeno una delle richieste.
+    """
+    if not richieste:
+        return []
+
+    alloggi = Alloggio.objects.in_bulk({r['alloggio_id'] for r in richieste})
+
+    conflitti = Q()
+    for r in richieste:
+        conflitti |= Q(
+            alloggio_id=r['alloggio_id'],
+            periodo__overlap=DateRange(r['check_in'], r['check_out']),
+        )
+    occupati = {}
+    prenotazioni = (
+        Prenotazione.objects.alias(periodo=PeriodoSoggiorno('check_in', 'check_out'))
+        .filter(conflitti, stato__in=Prenotazione.STATI_ATTIVI)
+        .values_list('alloggio_id', 'check_in', 'check_out')
+    )
+    for alloggio_id, check_in, check_out in prenotazioni:
+        occupati.setdefault(alloggio_id, []).append((check_in, check_out))
+
+    risultati = []
+    for r in richieste:
+        alloggio = alloggi.get(r['alloggio_id'])
+        risultato = {
+            'alloggio_id': r['alloggio_id'],
+            'check_in': r['check_in'],
+            'check_out': r['check_out'],
+        }
+        if alloggio is None:
+            risultato.update({
+                'disponibile': False,
+                'errore': "L'alloggio specificato non esiste.",
+            })
+            risultati.append(risultato)
+            continue
+
+        numero_notti = (r['check_out'] - r['check_in']).days
+        in_conflitto = any(
+            check_in < r['check_out'] and check_out > r['check_in']
+            for check_in, check_out in occupati.get(alloggio.id, [])
+        )
+        risultato.update({
+            'disponibile': alloggio.is_available() and not in_conflitto,
+            'numero_notti': numero_notti,
+            'prezzo_notte': alloggio.prezzo_notte,
+            'prezzo_totale': alloggio.prezzo_notte * numero_notti,
+        })
+        risultati.append(risultato)
+    return risultati
+
+
+def finestre_libere_vicine(alloggio, check_in, check_out):
+    """
+    Cerca le finestre libere della stessa durata più vicine al periodo
+    richiesto, una prima e una dopo, entro ORIZZONTE_SUGGERIMENTI giorni.
+
+    Scorre una sola volta gli intervalli occupati ordinati (una query) e
+    valuta i buchi liberi tra un intervallo e il successivo.
+    Ritorna (prima, dopo): ciascuna è una tupla (check_in, check_out) o None.
+    """
+    notti = timedelta(days=(check_out - check_in).days)
+    da = max(timezone.localdate(), check_in - timedelta(days=ORIZZONTE_SUGGERIMENTI))
+    a = check_out + timedelta(days=ORIZZONTE_SUGGERIMENTI)
+
+    prima = dopo = None
+    cursore = da
+    for inizio, fine in intervalli_occupati(alloggio, da, a) + [(a, a)]:
+        # Buco libero [cursore, inizio): gli arrivi possibili vanno da
+        # cursore a inizio - notti
+        ultimo_arrivo = inizio - notti
+        if cursore <= ultimo_arrivo:
+            arrivo = min(ultimo_arrivo, check_in - timedelta(days=1))
+            if arrivo >= cursore:
+                prima = (arrivo, arrivo + notti)
+            arrivo = max(cursore, check_in + timedelta(days=1))
+            if arrivo <= ultimo_arrivo:
+                dopo = (arrivo, arrivo + notti)
+                break
+        cursore = max(cursore, fine)
+
+    return prima, dopo
+
+
+def alloggi_alternativi(alloggio, check_in, check_out):
+    """
+    Ritorna gli alloggi confrontabili liberi nelle stesse date: stessa
+    capienza o superiore e prezzo entro la tolleranza, ordinati per
+    differenza di prezzo.
+    """
+    prezzo = alloggio.prezzo_notte
+    return list(
+        Alloggio.objects.liberi(check_in, check_out)
+        .per_ospiti(alloggio.numero_ospiti_max)
+        .exclude(pk=alloggio.pk)
+        .filter(
+            prezzo_notte__gte=prezzo * (1 - TOLLERANZA_PREZZO_ALTERNATIVE),
+            prezzo_notte__lte=prezzo * (1 + TOLLERANZA_PREZZO_ALTERNATIVE),
+        )
+        .annotate(differenza_prezzo=Func(F('prezzo_notte') - prezzo, function='ABS'))
+        .order_by('differenza_prezzo', 'nome')[:MAX_ALLOGGI_ALTERNATIVI]
+    )
+
+
+def suggerimenti(alloggio, check_in, check_out):
+    """Costruisce i suggerimenti per un periodo non disponibile."""
+    numero_notti = (check_out - check_in).days
+
+    def periodo(finestra):
+        if finestra is None:
+            return None
+        return {'check_in': finestra[0], 'check_out': finestra[1]}
+
+    # Se l'alloggio non è prenotabile non ha senso proporre altre date
+    prima, dopo = (None, None)
+    if alloggio.is_available():
+        prima, dopo = finestre_libere_vicine(alloggio, check_in, check_out)
+
+    return {
+        'date_precedenti': periodo(prima),
+        'date_successive': periodo(dopo),
+        'alloggi_alternativi': [
+            {
+                'id': alternativo.id,
+                'nome': alternativo.nome,
+                'prezzo_notte': alternativo.prezzo_notte,
+                'prezzo_totale': alternativo.prezzo_notte * numero_notti,
+            }
+            for alternativo in alloggi_alternativi(alloggio, check_in, check_out)
+        ],
+    }
@@ -0,0 +1,116 @@
+import operator
+from functools import reduce
+
+import django_filters
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+from .models import Alloggio, Prenotazione
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    """Filtro su una lista di valori separati da virgola (es. ?stato=PENDENTE,PAGATA)."""
+
+
+class AlloggioFilter(django_filters.FilterSet):
+    """
+    Filtri della lista alloggi. Le combinazioni più usate (fascia di prezzo,
+    capienza) sono coperte dagli indici composti del modello.
+    """
+    prezzo_min = django_filters.NumberFilter(field_name='prezzo_notte', lookup_expr='gte')
+    prezzo_max = django_filters.NumberFilter(field_name='prezzo_notte', lookup_expr='lte')
+    ospiti = django_filters.NumberFilter(method='filtra_ospiti', min_value=1, max_value=20)
+    camere_min = django_filters.NumberFilter(field_name='numero_camere', lookup_expr='gte')
+    bagni_min = django_filters.NumberFilter(field_name='numero_bagni', lookup_expr='gte')
+    disponibile = django_filters.CharFilter(method='filtra_disponibile')
+
+    class Meta:
+        model = Alloggio
+        fields = ['disponibile']
+
+    def filtra_ospiti(self, queryset, name, value):
+        return queryset.per_ospiti(value)
+
+    def filtra_disponibile(self, queryset, name, value):
+        """
+        Come il filtro scritto a mano che sostituisce: solo 'true' (senza
+        distinzione di maiuscole) seleziona gli alloggi disponibili, ogni
+        altro valore quelli non disponibili, senza errori di validazione.
+        """
+        return queryset.filter(disponibile=value.lower() == 'true')
+
+
+class PrenotazioneFilter(django_filters.FilterSet):
+    """
+    Filtri della lista prenotazioni: alloggio, stato (anche più stati separati
+    da virgola), intervallo di date e ospite.
+    """
+    stato = CharInFilter(field_name='stato', lookup_expr='in')
+    data_da = django_filters.DateFilter(field_name='check_in', lookup_expr='gte')
+    data_a = django_filters.DateFilter(field_name='check_out', lookup_expr='lte')
+    ospite = django_filters.CharFilter(method='filtra_ospite')
+
+    class Meta:
+        model = Prenotazione
+        fields = ['alloggio', 'stato', 'check_in', 'check_out']
+
+    def filtra_ospite(self, queryset, name, value):
+        """Contenimento su nome/email, o similarità ordinata con ?modalita=simile."""
+        if self.data.get('modalita') == 'simile':
+            return queryset.simili_ospite(value)
+        return queryset.cerca_ospite(value)
+
+
+class OrdinamentoFilter(OrderingFilter):
+    """
+    OrderingFilter che, senza ?ordering=, conserva l'ordinamento già scelto
+    dal queryset (rilevanza della ricerca, similarità dell'ospite) invece di
+    sostituirlo con quello di default della vista.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if queryset.query.order_by and not request.query_params.get(self.ordering_param):
+            return queryset
+        return super().filter_queryset(request, queryset, view)
+
+
+class RicercaTrigrammiFilter(SearchFilter):
+    """
+    SearchFilter per ?search= che resta sugli indici trigram della tabella.
+
+    I campi locali di `search_fields` producono UPPER(campo) LIKE UPPER(...),
+    coperto dagli indici GIN gin_trgm_ops. I campi su una foreign key
+    (es. alloggio__nome) diventano `alloggio__in=<sottoquery>`: l'OR resta
+    sulla sola tabella principale e il planner può combinare gli indici
+    con un BitmapOr invece di fare il join e filtrare ogni riga.
+    """
+
+    def condizione(self, queryset, orm_lookup, termine):
+        """Costruisce il Q per un singolo lookup e termine di ricerca."""
+        relazione, _, resto = orm_lookup.partition(LOOKUP_SEP)
+        campo = queryset.model._meta.get_field(relazione)
+        if campo.many_to_one and LOOKUP_SEP in resto:
+            correlati = campo.related_model._default_manager.filter(**{resto: termine})
+            return models.Q(**{f'{relazione}__in': correlati.values('pk')})
+        return models.Q(**{orm_lookup: termine})
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+
+        if not search_fields or not search_terms:
+            return queryset
+
+        orm_lookups = [
+            self.construct_search(str(search_field))
+            for search_field in search_fields
+        ]
+        condizioni = [
+            reduce(operator.or_, [
+                self.condizione(queryset, orm_lookup, termine)
+                for orm_lookup in orm_lookups
+            ])
+            for termine in search_terms
+        ]
+        return queryset.filter(reduce(operator.and_, condizioni))
@@ -0,0 +1,353 @@
+"""
+Varianti ridimensionate delle foto degli alloggi.
+
+Ogni foto caricata ha una miniatura a ritaglio fisso per le card delle liste
+e versioni a larghezza fissa per gli attributi srcset del frontend, in JPEG
+e nei formati più compatti supportati da Pillow (WebP, AVIF). Le varianti
+generate sono registrate in FotoAlloggio.varianti, così i serializer
+costruiscono gli URL senza accedere allo storage.
+
+I file elaborati sono salvati sotto CARTELLA_CONTENUTI con il nome dato
+dallo SHA-256 dei byte: foto identiche condividono gli stessi file (vedi
+ContenutoImmagine) e ogni URL punta sempre allo stesso contenuto.
+"""
+import base64
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+try:
+    # Encoder AVIF per le versioni di Pillow senza supporto nativo
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Nome variante -> (larghezza, altezza); con altezza None la variante
+# mantiene le proporzioni, altrimenti l'immagine è ritagliata al centro.
+# Una variante a larghezza fissa non più piccola dell'immagine principale
+# non ha un file proprio: è registrata con 'principale' e ne usa i file.
+VARIANTI = {
+    '300x200': (300, 200),
+    '800w': (800, None),
+    '1920w': (1920, None),
+}
+
+MINIATURA = '300x200'
+
+# Varianti elencate nello srcset, dalla più piccola
+VARIANTI_SRCSET = ('800w', '1920w')
+
+QUALITA_JPEG = 85
+
+# Riquadro entro cui è ridotta l'immagine principale
+DIMENSIONE_MASSIMA = (1920, 1080)
+
+# Tag EXIF dell'orientamento e valori che scambiano larghezza e altezza
+ORIENTAMENTO_EXIF = 0x0112
+ORIENTAMENTI_RUOTATI = (5, 6, 7, 8)
+
+# Pixel oltre i quali un'immagine è rifiutata leggendo la sola intestazione,
+# prima di decodificarla: 60 MP coprono le fotocamere in commercio.
+PIXEL_MASSIMI = 60_000_000
+
+# La decodifica ridotta si ferma ad almeno il doppio della dimensione finale,
+# così il ricampionamento LANCZOS conserva la qualità (come Image.thumbnail).
+MARGINE_RIDUZIONE = 2.0
+
+# Lato massimo del segnaposto (LQIP) incluso nelle liste: ~150 byte in WebP
+LATO_SEGNAPOSTO = 24
+
+# Cartella dei file elaborati, indirizzati per contenuto
+CARTELLA_CONTENUTI = 'contenuti'
+
+# Formato -> (formato Pillow, estensione, content type, opzioni di encoding).
+# Il JPEG è il fallback universale; gli altri sono prodotti solo se Pillow
+# sa codificarli.
+FORMATI = {
+    'avif': ('AVIF', 'avif', 'image/avif', {'quality': 60}),
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': QUALITA_JPEG, 'optimize': True}),
+}
+
+Image.init()
+
+# Formati alternativi disponibili, dal più compatto
+FORMATI_ALTERNATIVI = tuple(
+    formato for formato in ('avif', 'webp') if FORMATI[formato][0] in Image.SAVE
+)
+
+
+def converti_rgb(img):
+    """Converte l'immagine in RGB, appiattendo la trasparenza su fondo bianco."""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        rgb_img.paste(img, mask=img.split()[-1])
+        return rgb_img
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+@contextmanager
+def file_codificato(img, formato='jpeg'):
+    """
+    Codifica l'immagine nel formato indicato in un file temporaneo su disco
+    e lo fornisce come File per lo storage, che lo legge a blocchi: i byte
+    codificati non vengono mai copiati in memoria.
+    """
+    formato_pillow, _, _, opzioni = FORMATI[formato]
+    with tempfile.TemporaryFile() as tmp:
+        img.save(tmp, format=formato_pillow, **opzioni)
+        tmp.seek(0)
+        yield File(tmp)
+
+
+def genera_segnaposto(img):
+    """
+    Ritorna il segnaposto dell'immagine: una versione di LATO_SEGNAPOSTO
+    pixel come data URI, da mostrare sfocato finché la foto non è caricata.
+    """
+    piccola = img.copy()
+    piccola.thumbnail((LATO_SEGNAPOSTO, LATO_SEGNAPOSTO), Image.Resampling.BOX)
+    formato = 'webp' if 'webp' in FORMATI_ALTERNATIVI else 'jpeg'
+    output = BytesIO()
+    piccola.save(output, format=FORMATI[formato][0], quality=40)
+    return f"data:{FORMATI[formato][2]};base64,{base64.b64encode(output.getvalue()).decode('ascii')}"
+
+
+def segnaposto_file(percorso):
+    """
+    Calcola (larghezza, altezza, segnaposto) dell'immagine elaborata in
+    `percorso`, decodificandola alla risoluzione minima (backfill).
+    """
+    with default_storage.open(percorso, 'rb') as file:
+        img = apri_immagine(file)
+        dimensioni = img.size
+        img.draft('RGB', (LATO_SEGNAPOSTO * 2, LATO_SEGNAPOSTO * 2))
+        return (*dimensioni, genera_segnaposto(converti_rgb(img)))
+
+
+def percorso_contenuto(digest, estensione):
+    """Percorso del file con hash `digest`, ripartito in sottocartelle."""
+    return f'{CARTELLA_CONTENUTI}/{digest[:2]}/{digest[2:4]}/{digest}.{estensione}'
+
+
+def salva_codificata(img, formato='jpeg'):
+    """
+    Salva nello storage l'immagine codificata, indirizzata per contenuto,
+    e ritorna il percorso; se il file esiste già ne acquisisce un riferimento.
+    """
+    # Import locale: models importa questo modulo
+    from .models import ContenutoImmagine
+
+    with file_codificato(img, formato) as file:
+        return ContenutoImmagine.objects.acquisisci(file, FORMATI[formato][1])
+
+
+def verifica_pixel(img):
+    """
+    Solleva DecompressionBombError se l'immagine supera PIXEL_MASSIMI.
+    Usa solo le dimensioni dichiarate nell'intestazione.
+    """
+    larghezza, altezza = img.size
+    if larghezza * altezza > PIXEL_MASSIMI:
+        raise Image.DecompressionBombError(
+            f"Immagine troppo grande: {larghezza}x{altezza} pixel "
+            f"(massimo {PIXEL_MASSIMI // 1_000_000} megapixel)."
+        )
+
+
+def apri_immagine(file):
+    """Apre l'immagine senza decodificarla, rifiutando quelle troppo grandi."""
+    img = Image.open(file)
+    verifica_pixel(img)
+    return img
+
+
+def prepara_immagine(file, dimensioni=DIMENSIONE_MASSIMA):
+    """
+    Decodifica l'immagine ridotta entro `dimensioni` e in RGB, e ritorna
+    (immagine, dimensioni originali).
+
+    La riduzione avviene prima della decodifica completa: per i JPEG il
+    decoder lavora in modalità draft (scala 1/2, 1/4 o 1/8 durante la
+    decompressione), per gli altri formati reduce() precede il
+    ricampionamento, quindi la memoria dipende dalla dimensione finale più
+    che da quella caricata.
+
+    L'orientamento EXIF è applicato dopo la riduzione, sull'immagine già
+    piccola; dimensioni originali e limiti si riferiscono all'immagine
+    orientata, come per le varianti generate dal file salvato.
+    """
+    img = apri_immagine(file)
+    originali = img.size
+    if img.getexif().get(ORIENTAMENTO_EXIF) in ORIENTAMENTI_RUOTATI:
+        # Il lato lungo del file sarà in verticale dopo la rotazione
+        originali, dimensioni = originali[::-1], tuple(dimensioni)[::-1]
+    if img.mode in ('1', 'P'):
+        # Il ridimensionamento di immagini a palette degrada a NEAREST
+        img = converti_rgb(img)
+    img.thumbnail(dimensioni, Image.Resampling.LANCZOS, reducing_gap=MARGINE_RIDUZIONE)
+    # Le immagini già entro i limiti non sono state decodificate da thumbnail
+    img.load()
+    return converti_rgb(ImageOps.exif_transpose(img)), originali
+
+
+def salva_formati_alternativi(img, formati=FORMATI_ALTERNATIVI):
+    """
+    Salva le versioni dell'immagine nei `formati` alternativi e ritorna
+    {formato: percorso}.
+    """
+    return {formato: salva_codificata(img, formato) for formato in formati}
+
+
+def formato_preferito(accept, disponibili):
+    """
+    Sceglie il formato da servire in base all'header Accept del client tra
+    quelli `disponibili`, dal più compatto; in mancanza il JPEG.
+    """
+    accettati = set()
+    for voce in (accept or '').split(','):
+        tipo, _, parametri = voce.strip().partition(';')
+        if parametri.replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accettati.add(tipo.strip().lower())
+    for formato in FORMATI_ALTERNATIVI:
+        if formato in disponibili and FORMATI[formato][2] in accettati:
+            return formato
+    return 'jpeg'
+
+
+def ridimensiona(img, larghezza, altezza=None):
+    """
+    Ridimensiona `img` per la variante indicata, senza mai ingrandirla.
+    Con `altezza` ritaglia al centro alle dimensioni esatte.
+    """
+    if altezza:
+        return ImageOps.fit(img, (larghezza, altezza), Image.Resampling.LANCZOS)
+    if img.width <= larghezza:
+        return img
+    return img.resize(
+        (larghezza, max(1, round(img.height * larghezza / img.width))),
+        Image.Resampling.LANCZOS,
+    )
+
+
+def elabora_immagine(foto):
+    """
+    Elabora l'immagine caricata della foto: registra le dimensioni originali,
+    la decodifica ridotta entro DIMENSIONE_MASSIMA e sostituisce il file
+    caricato con il JPEG ottimizzato, poi calcola dimensioni finali e
+    segnaposto e genera formati alternativi e varianti. Aggiorna i campi
+    della foto senza salvare il modello.
+    """
+    caricata = foto.immagine.name
+    with foto.immagine.open('rb') as file:
+        img, (foto.larghezza_originale, foto.altezza_originale) = prepara_immagine(file)
+
+    foto.larghezza, foto.altezza = img.size
+    foto.segnaposto = genera_segnaposto(img)
+    foto.immagine.name = salva_codificata(img)
+    default_storage.delete(caricata)
+
+    foto.formati = salva_formati_alternativi(img)
+    foto.varianti = {}
+    genera_varianti(foto, sorgente=img)
+
+
+def genera_varianti(foto, sorgente=None, nomi=None):
+    """
+    Genera e salva le varianti mancanti della foto, o i formati alternativi
+    mancanti di quelle esistenti.
+
+    `sorgente` è l'immagine già decodificata, se disponibile (upload);
+    altrimenti il file viene riaperto dallo storage. Aggiorna e ritorna
+    foto.varianti senza salvare il modello.
+    """
+    mancanti = [nome for nome in (nomi or VARIANTI) if variante_incompleta(foto, nome)]
+    if not mancanti or not foto.immagine:
+        return foto.varianti
+
+    if sorgente is None:
+        with foto.immagine.open('rb') as file:
+            sorgente = converti_rgb(ImageOps.exif_transpose(apri_immagine(file)))
+            sorgente.load()
+
+    # Assegnato subito: in caso di errore a metà la foto riferisce comunque
+    # i file già salvati, che saranno rilasciati alla sua eliminazione
+    foto.varianti = varianti = dict(foto.varianti)
+    for nome in mancanti:
+        larghezza, altezza = VARIANTI[nome]
+        info = varianti.get(nome)
+        if info is None and altezza is None and sorgente.width <= larghezza:
+            varianti[nome] = {'principale': True, 'larghezza': sorgente.width, 'altezza': sorgente.height}
+            continue
+        img = ridimensiona(sorgente, larghezza, altezza)
+        if info is None:
+            info = {'percorso': salva_codificata(img), 'larghezza': img.width, 'altezza': img.height, 'formati': {}}
+            varianti[nome] = info
+        formati = dict(info.get('formati', {}))
+        formati.update(salva_formati_alternativi(
+            img, [f for f in FORMATI_ALTERNATIVI if f not in formati]
+        ))
+        varianti[nome] = {**info, 'formati': formati}
+    return varianti
+
+
+def genera_formati(foto):
+    """
+    Genera i formati alternativi mancanti dell'immagine principale, per le
+    foto caricate prima della loro introduzione. Aggiorna e ritorna
+    foto.formati senza salvare il modello.
+    """
+    mancanti = [f for f in FORMATI_ALTERNATIVI if f not in foto.formati]
+    if not mancanti or not foto.immagine:
+        return foto.formati
+    with foto.immagine.open('rb') as file:
+        img = converti_rgb(apri_immagine(file))
+        img.load()
+    foto.formati = {**foto.formati, **salva_formati_alternativi(img, mancanti)}
+    return foto.formati
+
+
+def variante_incompleta(foto, nome=None):
+    """
+    True se la variante `nome` (None = immagine principale) manca o le
+    manca uno dei formati alternativi.
+    """
+    if nome is None:
+        return bool(set(FORMATI_ALTERNATIVI) - set(foto.formati))
+    info = foto.varianti.get(nome)
+    if info is not None and info.get('principale'):
+        return False
+    return info is None or bool(set(FORMATI_ALTERNATIVI) - set(info.get('formati', {})))
+
+
+def percorsi_foto(foto):
+    """Tutti i file generati per la foto: formati dell'immagine e varianti."""
+    percorsi = list(foto.formati.values())
+    for info in foto.varianti.values():
+        if info.get('principale'):
+            continue
+        percorsi.append(info['percorso'])
+        percorsi.extend(info.get('formati', {}).values())
+    return percorsi
+
+
+def rilascia_file_foto(foto):
+    """
+    Rilascia i file della foto: immagine, formati e varianti. Quelli
+    condivisi restano finché un'altra foto li riferisce.
+    """
+    from .models import ContenutoImmagine
+
+    percorsi = percorsi_foto(foto)
+    if foto.immagine:
+        percorsi.append(foto.immagine.name)
+    ContenutoImmagine.objects.rilascia(percorsi)
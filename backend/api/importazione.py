@@ -0,0 +1,381 @@
+"""
+Importazione delle foto degli alloggi da URL remoti e da upload multipli.
+
+Ogni immagine è scaricata una sola volta, in streaming su un file
+temporaneo e con un limite rigido di dimensione; gli import multipli usano
+un pool di thread limitato e una sessione HTTP condivisa, che riusa le
+connessioni verso lo stesso host. I file scaricati entrano nella stessa
+pipeline degli upload (vedi api.tasks.elabora_foto).
+
+Le verifiche (HEAD) degli URL delle foto remote sono condivise tra i
+processi tramite la cache di Django, esiti negativi compresi, così un host
+lento blocca al più una richiesta per intervallo di validità.
+
+Con IMMAGINI_COPIA_REMOTE le foto remote hanno una copia locale, elaborata
+come gli upload e aggiornata con richieste condizionali (ETag e
+Last-Modified): finché la nuova copia non è pronta resta servita quella
+precedente.
+
+Gli upload multipli creano tutte le righe con un solo bulk_create e
+affidano l'elaborazione, CPU-bound, ai processi del worker Celery, che la
+eseguono in parallelo su tutti i core invece che nel thread della richiesta.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit, urlunsplit
+
+import requests
+from celery import group
+from django.core.cache import cache
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from .cache import incrementa_versione_catalogo
+from .immagini import elabora_immagine, percorsi_foto, rilascia_file_foto
+from .models import Alloggio, ContenutoImmagine, FotoAlloggio
+
+logger = logging.getLogger(__name__)
+
+# Limite dei file scaricati, uguale a quello degli upload
+DIMENSIONE_MASSIMA_DOWNLOAD = 10 * 1024 * 1024
+
+# Download contemporanei di un import multiplo
+CONCORRENZA_DOWNLOAD = 8
+
+# Timeout di connessione e di lettura, in secondi
+TIMEOUT_DOWNLOAD = (5, 10)
+
+BLOCCO_DOWNLOAD = 64 * 1024
+
+# Validità in cache delle verifiche degli URL: gli esiti negativi durano
+# meno, così un host tornato raggiungibile è riconosciuto presto
+TTL_VERIFICA = 60 * 60
+TTL_VERIFICA_ERRORE = 60 * 5
+
+TIMEOUT_VERIFICA = (3, 5)
+
+# Estensione dei file scaricati in base al content type
+ESTENSIONI = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+}
+
+
+class ErroreDownload(Exception):
+    """Download di un'immagine remota non riuscito o rifiutato."""
+
+
+def crea_sessione(connessioni=CONCORRENZA_DOWNLOAD):
+    """Sessione HTTP con un pool di `connessioni` per host, condivisibile tra thread."""
+    sessione = requests.Session()
+    adattatore = HTTPAdapter(pool_connections=connessioni, pool_maxsize=connessioni)
+    sessione.mount('http://', adattatore)
+    sessione.mount('https://', adattatore)
+    return sessione
+
+
+def nome_file(url, content_type):
+    """Nome del file scaricato: quello dell'URL se ha un'estensione d'immagine."""
+    nome = os.path.basename(unquote(urlsplit(url).path))
+    if os.path.splitext(nome)[1].lower().lstrip('.') in ('jpg', 'jpeg', 'png', 'webp', 'gif'):
+        return nome
+    return f"immagine.{ESTENSIONI.get(content_type, 'jpg')}"
+
+
+def scarica_immagine(url, sessione=None, limite=DIMENSIONE_MASSIMA_DOWNLOAD, intestazioni=None):
+    """
+    Scarica l'immagine di `url` con una sola richiesta in streaming e
+    ritorna un File su disco temporaneo, da chiudere dopo l'uso; i suoi
+    attributi etag e last_modified riportano gli header della risposta.
+
+    Con `intestazioni` condizionali (If-None-Match, If-Modified-Since)
+    ritorna None se il server risponde 304 Not Modified.
+
+    Solleva ErroreDownload se la richiesta fallisce, se il contenuto non è
+    un'immagine o se supera `limite` byte: il trasferimento è interrotto
+    appena il limite è superato, anche senza Content-Length.
+    """
+    sessione = sessione or requests
+    try:
+        with sessione.get(url, stream=True, timeout=TIMEOUT_DOWNLOAD, headers=intestazioni) as risposta:
+            if risposta.status_code == 304:
+                return None
+            risposta.raise_for_status()
+            content_type = risposta.headers.get('content-type', '').split(';')[0].strip().lower()
+            if not content_type.startswith('image/'):
+                raise ErroreDownload("L'URL non punta a un'immagine valida.")
+            dichiarata = risposta.headers.get('content-length', '')
+            if dichiarata.isdigit() and int(dichiarata) > limite:
+                raise ErroreDownload(f"L'immagine è troppo grande (max {limite // (1024 * 1024)}MB).")
+
+            file = tempfile.TemporaryFile()
+            try:
+                scaricati = 0
+                for blocco in risposta.iter_content(BLOCCO_DOWNLOAD):
+                    scaricati += len(blocco)
+                    if scaricati > limite:
+                        raise ErroreDownload(f"L'immagine è troppo grande (max {limite // (1024 * 1024)}MB).")
+                    file.write(blocco)
+            except BaseException:
+                file.close()
+                raise
+            etag = risposta.headers.get('etag', '')
+            last_modified = risposta.headers.get('last-modified', '')
+    except requests.RequestException as e:
+        raise ErroreDownload(f"Impossibile scaricare l'immagine: {e}") from e
+
+    file.seek(0)
+    scaricata = File(file, name=nome_file(url, content_type))
+    scaricata.etag, scaricata.last_modified = etag, last_modified
+    return scaricata
+
+
+def normalizza_url(url):
+    """
+    Forma canonica dell'URL per la cache: schema e host minuscoli, senza
+    porta di default né frammento.
+    """
+    parti = urlsplit(url.strip())
+    schema = parti.scheme.lower()
+    host = (parti.hostname or '').lower()
+    if parti.port and (schema, parti.port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{parti.port}'
+    return urlunsplit((schema, host, parti.path or '/', parti.query, ''))
+
+
+def chiave_verifica(url):
+    """Chiave di cache della verifica di `url`."""
+    return 'verifica-url:' + hashlib.sha256(normalizza_url(url).encode()).hexdigest()
+
+
+def verifica_url(url, sessione=None, forza=False):
+    """
+    Verifica con una HEAD che `url` risponda con un'immagine e ritorna
+    {'status', 'content_type', 'dimensione', 'errore', 'verificato_il'}.
+
+    L'esito è letto dalla cache condivisa se presente e non `forza`; un
+    errore di rete ha status None e il messaggio in 'errore'.
+    """
+    chiave = chiave_verifica(url)
+    if not forza:
+        esito = cache.get(chiave)
+        if esito is not None:
+            return esito
+
+    esito = {'status': None, 'content_type': '', 'dimensione': None, 'errore': '', 'verificato_il': time.time()}
+    try:
+        risposta = (sessione or requests).head(url, timeout=TIMEOUT_VERIFICA, allow_redirects=True)
+    except requests.RequestException as e:
+        logger.info("Verifica di %s non riuscita: %s", url, e)
+        esito['errore'] = str(e)
+    else:
+        dimensione = risposta.headers.get('content-length', '')
+        esito.update(
+            status=risposta.status_code,
+            content_type=risposta.headers.get('content-type', '').split(';')[0].strip().lower(),
+            dimensione=int(dimensione) if dimensione.isdigit() else None,
+        )
+
+    valida = esito['status'] is not None and esito['status'] < 400
+    cache.set(chiave, esito, TTL_VERIFICA if valida else TTL_VERIFICA_ERRORE)
+    return esito
+
+
+def errore_verifica(esito):
+    """
+    Messaggio d'errore per un URL che non punta a un'immagine, o None.
+    Un host irraggiungibile non è considerato un errore dell'URL.
+    """
+    if esito['status'] is None:
+        return None
+    if esito['status'] >= 400:
+        return f"L'URL risponde con errore HTTP {esito['status']}."
+    if not esito['content_type'].startswith('image/'):
+        return "L'URL deve puntare a un'immagine valida."
+    return None
+
+
+def verifica_url_parallela(urls, concorrenza=CONCORRENZA_DOWNLOAD, forza=True):
+    """
+    Verifica in parallelo gli `urls` (una volta per URL normalizzato) e
+    ritorna {url: esito}, aggiornando la cache.
+    """
+    unici = {normalizza_url(url): url for url in urls}
+    with crea_sessione(concorrenza) as sessione, ThreadPoolExecutor(max_workers=concorrenza) as pool:
+        esiti = dict(zip(unici, pool.map(lambda url: verifica_url(url, sessione, forza), unici.values())))
+    return {url: esiti[normalizza_url(url)] for url in urls}
+
+
+def prossimo_ordine(alloggio):
+    """Primo valore di `ordine` libero dopo le foto esistenti dell'alloggio."""
+    massimo = alloggio.foto.aggregate(massimo=Max('ordine'))['massimo']
+    return 0 if massimo is None else massimo + 1
+
+
+def blocca_ordine(alloggio):
+    """
+    Blocca la riga dell'alloggio fino al commit e ritorna prossimo_ordine.
+    Serializza gli inserimenti concorrenti di foto, che altrimenti
+    assegnerebbero gli stessi valori di ordine; va chiamata in una transazione.
+    """
+    Alloggio.objects.select_for_update().filter(pk=alloggio.pk).first()
+    return prossimo_ordine(alloggio)
+
+
+def crea_foto_caricate(alloggio, immagini, **campi):
+    """
+    Crea con un solo bulk_create le foto dei file `immagini` (già validati)
+    in coda alle esistenti dell'alloggio e ne accoda al commit l'elaborazione,
+    un task per foto. Ritorna le foto create, nell'ordine dei file.
+    """
+    # Import locale: tasks importa questo modulo
+    from .tasks import elabora_foto
+
+    with transaction.atomic():
+        ordine = blocca_ordine(alloggio)
+        foto = FotoAlloggio.objects.bulk_create([
+            FotoAlloggio(
+                alloggio=alloggio, immagine=immagine, ordine=ordine + n,
+                stato=FotoAlloggio.STATO_IN_ATTESA, **campi
+            )
+            for n, immagine in enumerate(immagini)
+        ])
+        # bulk_create non passa da save() né dai segnali post_save
+        ids = [singola.pk for singola in foto]
+        transaction.on_commit(lambda: group(elabora_foto.s(foto_id) for foto_id in ids).delay())
+        incrementa_versione_catalogo()
+        transaction.on_commit(incrementa_versione_catalogo)
+    return foto
+
+
+def importa_foto(alloggio, urls, concorrenza=CONCORRENZA_DOWNLOAD, **campi):
+    """
+    Scarica in parallelo le immagini di `urls` e crea per ognuna una foto
+    dell'alloggio, in coda alle esistenti e accodata all'elaborazione.
+
+    I download avvengono nel pool di thread; al termine le foto sono create
+    nel thread chiamante, nell'ordine degli URL, in una transazione che
+    tiene il lock sull'alloggio (vedi blocca_ordine). Ritorna un risultato
+    per URL: {'url', 'id', 'stato'} oppure {'url', 'errore'}.
+    """
+    futuri = []
+    try:
+        with crea_sessione(concorrenza) as sessione, ThreadPoolExecutor(max_workers=concorrenza) as pool:
+            try:
+                futuri = [pool.submit(scarica_immagine, url, sessione) for url in urls]
+                scaricati = []
+                for url, futuro in zip(urls, futuri):
+                    try:
+                        scaricati.append((url, futuro.result(), None))
+                    except ErroreDownload as e:
+                        scaricati.append((url, None, str(e)))
+            finally:
+                # Dopo un errore i download ancora in coda non partono
+                pool.shutdown(cancel_futures=True)
+
+        risultati, create = [], []
+        with transaction.atomic():
+            ordine = blocca_ordine(alloggio)
+            for url, file, errore in scaricati:
+                if errore:
+                    risultati.append({'url': url, 'errore': errore})
+                    continue
+                with file:
+                    foto = FotoAlloggio.objects.create(alloggio=alloggio, immagine=file, ordine=ordine, **campi)
+                ordine += 1
+                risultati.append({'url': url, 'id': foto.pk})
+                create.append(foto)
+        # L'elaborazione è accodata al commit (o già eseguita, in eager)
+        stati = dict(FotoAlloggio.objects.filter(pk__in=[f.pk for f in create]).values_list('id', 'stato'))
+        for risultato in risultati:
+            if 'id' in risultato:
+                risultato['stato'] = stati.get(risultato['id'])
+        return risultati
+    finally:
+        # Chiude i file temporanei non consumati, anche se un'eccezione ha
+        # interrotto il ciclo
+        for futuro in futuri:
+            if futuro.done() and not futuro.cancelled() and futuro.exception() is None and futuro.result():
+                futuro.result().close()
+
+
+COPIA_AGGIORNATA = 'aggiornata'
+COPIA_NON_MODIFICATA = 'non modificata'
+COPIA_NON_RIUSCITA = 'non riuscita'
+
+
+def aggiorna_copia_locale(foto, forza=False):
+    """
+    Crea o aggiorna la copia locale della foto remota e ritorna l'esito
+    (COPIA_AGGIORNATA, COPIA_NON_MODIFICATA o COPIA_NON_RIUSCITA).
+
+    Una copia esistente è riscaricata solo se il server non risponde 304
+    alla richiesta condizionale, salvo `forza`. La nuova immagine è
+    elaborata a parte e sostituisce la precedente in un solo salvataggio;
+    i file della copia precedente sono poi rilasciati.
+    """
+    url = foto.url
+    intestazioni = {}
+    if foto.is_copia_locale() and foto.copia_di == url and not forza:
+        if foto.copia_etag:
+            intestazioni['If-None-Match'] = foto.copia_etag
+        if foto.copia_last_modified:
+            intestazioni['If-Modified-Since'] = foto.copia_last_modified
+
+    try:
+        scaricata = scarica_immagine(url, intestazioni=intestazioni)
+    except ErroreDownload as e:
+        logger.warning("Copia locale della foto %s da %s non riuscita: %s", foto.pk, url, e)
+        return COPIA_NON_RIUSCITA
+    if scaricata is None:
+        FotoAlloggio.objects.filter(pk=foto.pk).update(copia_aggiornata_il=timezone.now())
+        return COPIA_NON_MODIFICATA
+
+    # Elaborazione su un'istanza separata: la foto salvata resta intatta
+    # se il download non è un'immagine valida
+    copia = FotoAlloggio(pk=foto.pk, alloggio=foto.alloggio)
+    with scaricata:
+        copia.immagine.save(scaricata.name, scaricata, save=False)
+    try:
+        elabora_immagine(copia)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Elaborazione della copia locale della foto %s non riuscita: %s", foto.pk, e)
+        rilascia_file_foto(copia)
+        return COPIA_NON_RIUSCITA
+
+    with transaction.atomic():
+        attuale = FotoAlloggio.objects.select_for_update().filter(pk=foto.pk).first()
+        if attuale is None or attuale.url != url:
+            # Foto eliminata o URL cambiato durante il download
+            rilascia_file_foto(copia)
+            return COPIA_NON_RIUSCITA
+        precedenti = [attuale.immagine.name, *percorsi_foto(attuale)] if attuale.immagine else []
+        attuale.immagine = copia.immagine.name
+        attuale.larghezza_originale = copia.larghezza_originale
+        attuale.altezza_originale = copia.altezza_originale
+        attuale.larghezza, attuale.altezza = copia.larghezza, copia.altezza
+        attuale.segnaposto = copia.segnaposto
+        attuale.formati, attuale.varianti = copia.formati, copia.varianti
+        attuale.stato, attuale.errore_elaborazione = FotoAlloggio.STATO_PRONTA, ''
+        attuale.copia_di = url
+        attuale.copia_etag, attuale.copia_last_modified = scaricata.etag, scaricata.last_modified
+        attuale.copia_aggiornata_il = timezone.now()
+        attuale.save(update_fields=[
+            'immagine', 'larghezza_originale', 'altezza_originale', 'larghezza', 'altezza',
+            'segnaposto', 'formati', 'varianti',
+            'stato', 'errore_elaborazione', 'copia_di', 'copia_etag', 'copia_last_modified',
+            'copia_aggiornata_il', 'updated_at',
+        ])
+        ContenutoImmagine.objects.rilascia(precedenti)
+    foto.refresh_from_db()
+    return COPIA_AGGIORNATA
@@ -0,0 +1,63 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from api.importazione import aggiorna_copia_locale
+from api.models import FotoAlloggio
+from api.tasks import copia_foto_remota
+
+
+class Command(BaseCommand):
+    """Crea o aggiorna le copie locali delle foto remote"""
+
+    help = 'Accoda (o esegue) il download condizionale delle foto indicate solo con un URL'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--alloggio',
+            type=int,
+            help="Solo le foto di questo alloggio"
+        )
+        parser.add_argument(
+            '--ore',
+            type=int,
+            default=0,
+            help='Salta le copie verificate nelle ultime N ore (default: 0, tutte)'
+        )
+        parser.add_argument(
+            '--forza',
+            action='store_true',
+            help='Scarica di nuovo anche le immagini non modificate'
+        )
+        parser.add_argument(
+            '--sincrono',
+            action='store_true',
+            help='Esegue le copie in questo processo invece di accodarle al worker'
+        )
+
+    def handle(self, *args, **options):
+        foto = FotoAlloggio.objects.exclude(url='').select_related('alloggio')
+        if options['alloggio']:
+            foto = foto.filter(alloggio_id=options['alloggio'])
+        if options['ore']:
+            limite = timezone.now() - timedelta(hours=options['ore'])
+            foto = foto.filter(Q(copia_aggiornata_il__isnull=True) | Q(copia_aggiornata_il__lt=limite))
+        foto = foto.order_by('id')
+
+        if not options['sincrono']:
+            accodate = 0
+            for foto_id in foto.values_list('id', flat=True).iterator():
+                copia_foto_remota.delay(foto_id, options['forza'])
+                accodate += 1
+            self.stdout.write(self.style.SUCCESS(f'{accodate} foto remote accodate.'))
+            return
+
+        esiti = {}
+        for singola in foto.iterator():
+            esito = aggiorna_copia_locale(singola, options['forza'])
+            esiti[esito] = esiti.get(esito, 0) + 1
+            self.stdout.write(f'Foto {singola.pk} {singola.url}: {esito}')
+        riepilogo = ', '.join(f'{n} {esito}' for esito, n in sorted(esiti.items())) or 'nessuna foto'
+        self.stdout.write(self.style.SUCCESS(f'Copie locali: {riepilogo}.'))
@@ -0,0 +1,111 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from api.immagini import DIMENSIONE_MASSIMA, QUALITA_JPEG, converti_rgb, file_codificato, prepara_immagine
+
+
+def rss_picco_kb():
+    """Picco di memoria residente del processo corrente, in KB (Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def elabora_completa(percorso):
+    """Pipeline precedente: decodifica completa e output in BytesIO copiato."""
+    with open(percorso, 'rb') as file:
+        img = Image.open(file)
+        img.load()
+        img = converti_rgb(img)
+    if img.width > DIMENSIONE_MASSIMA[0] or img.height > DIMENSIONE_MASSIMA[1]:
+        img.thumbnail(DIMENSIONE_MASSIMA, Image.Resampling.LANCZOS)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=QUALITA_JPEG, optimize=True)
+    output.seek(0)
+    return len(output.read())
+
+
+def elabora_ridotta(percorso):
+    """Pipeline attuale: decodifica ridotta e output in streaming su file."""
+    with open(percorso, 'rb') as file:
+        img, _ = prepara_immagine(file)
+    with file_codificato(img) as codificato:
+        return sum(len(blocco) for blocco in codificato.chunks())
+
+
+PIPELINE = {
+    'completa': elabora_completa,
+    'ridotta': elabora_ridotta,
+}
+
+
+def misura(nome, percorso, coda):
+    """Eseguito in un processo figlio: misura l'incremento del picco di RSS."""
+    base = rss_picco_kb()
+    inizio = time.perf_counter()
+    byte = PIPELINE[nome](percorso)
+    coda.put((rss_picco_kb() - base, time.perf_counter() - inizio, byte))
+
+
+class Command(BaseCommand):
+    """Misura il picco di memoria per upload delle pipeline di elaborazione immagini"""
+
+    help = 'Confronta il picco di RSS per upload tra decodifica completa e ridotta'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixel',
+            type=int,
+            default=40,
+            help='Dimensione della foto di prova in megapixel (default: 40)'
+        )
+        parser.add_argument(
+            '--immagine',
+            help='Usa questo file invece di una foto sintetica'
+        )
+
+    def handle(self, *args, **options):
+        percorso = options['immagine']
+        temporaneo = None
+        if not percorso:
+            temporaneo = percorso = self.crea_foto_prova(options['megapixel'])
+
+        try:
+            with Image.open(percorso) as img:
+                self.stdout.write(f'Immagine {img.width}x{img.height} {img.format}, '
+                                  f'{os.path.getsize(percorso) / 1024 / 1024:.1f} MB')
+            # Ogni misura in un processo separato, perché ru_maxrss non cala mai
+            contesto = multiprocessing.get_context('fork')
+            for nome in PIPELINE:
+                coda = contesto.Queue()
+                processo = contesto.Process(target=misura, args=(nome, percorso, coda))
+                processo.start()
+                rss, durata, byte = coda.get()
+                processo.join()
+                self.stdout.write(
+                    f'{nome:>9}: picco RSS +{rss / 1024:.1f} MB, {durata:.2f} s, '
+                    f'JPEG {byte / 1024:.0f} KB'
+                )
+        finally:
+            if temporaneo:
+                os.remove(temporaneo)
+
+    def crea_foto_prova(self, megapixel):
+        """Genera un JPEG 3:2 con gradienti, simile a una foto da fotocamera."""
+        larghezza = int((megapixel * 1_000_000 * 3 / 2) ** 0.5)
+        altezza = larghezza * 2 // 3
+        gradiente = Image.linear_gradient('L')
+        img = Image.merge('RGB', (
+            gradiente.resize((larghezza, altezza)),
+            gradiente.rotate(90).resize((larghezza, altezza)),
+            Image.radial_gradient('L').resize((larghezza, altezza)),
+        ))
+        file, percorso = tempfile.mkstemp(suffix='.jpg')
+        with os.fdopen(file, 'wb') as output:
+            img.save(output, format='JPEG', quality=90)
+        return percorso
@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import incrementa_versione_catalogo
+from api.immagini import segnaposto_file
+from api.models import FotoAlloggio
+
+
+def calcola(voce):
+    """Eseguito nei processi del pool: (id, percorso) -> (id, risultato o errore)."""
+    foto_id, percorso = voce
+    try:
+        return foto_id, segnaposto_file(percorso), None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return foto_id, None, str(e)
+
+
+class Command(BaseCommand):
+    """Calcola segnaposto e dimensioni delle foto elaborate prima della loro introduzione"""
+
+    help = 'Genera in parallelo i segnaposto (LQIP) mancanti delle foto'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tutte',
+            action='store_true',
+            help='Ricalcola anche le foto che hanno già un segnaposto'
+        )
+        parser.add_argument(
+            '--processi',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Processi di elaborazione (default: numero di CPU)'
+        )
+        parser.add_argument(
+            '--lotto',
+            type=int,
+            default=200,
+            help='Foto salvate per query (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        foto = FotoAlloggio.objects.filter(stato=FotoAlloggio.STATO_PRONTA).exclude(immagine__in=['', None])
+        if not options['tutte']:
+            foto = foto.filter(segnaposto='')
+        voci = list(foto.order_by('id').values_list('id', 'immagine'))
+        if not voci:
+            self.stdout.write('Nessuna foto da aggiornare.')
+            return
+
+        # I processi figli leggono solo i file; le scritture restano qui.
+        # Le connessioni al database sono chiuse prima del fork perché i figli
+        # non ereditino il socket del padre: qui sono riaperte alla prima query
+        connections.close_all()
+        aggiornate, errori, lotto = 0, 0, []
+        contesto = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=max(1, options['processi']), mp_context=contesto) as pool:
+            for foto_id, risultato, errore in pool.map(calcola, voci, chunksize=8):
+                if errore:
+                    errori += 1
+                    self.stdout.write(self.style.ERROR(f'Foto {foto_id}: {errore}'))
+                    continue
+                larghezza, altezza, segnaposto = risultato
+                lotto.append(FotoAlloggio(
+                    pk=foto_id, larghezza=larghezza, altezza=altezza, segnaposto=segnaposto,
+                    updated_at=timezone.now(),
+                ))
+                if len(lotto) >= options['lotto']:
+                    aggiornate += self.salva(lotto)
+                    lotto = []
+        aggiornate += self.salva(lotto)
+
+        # bulk_update non invia segnali: invalida qui le risposte del catalogo
+        incrementa_versione_catalogo()
+        self.stdout.write(self.style.SUCCESS(f'{aggiornate} foto aggiornate, {errori} errori.'))
+
+    def salva(self, lotto):
+        # bulk_update non applica auto_now: updated_at, letto dai validatori
+        # HTTP, è impostato sugli oggetti del lotto
+        FotoAlloggio.objects.bulk_update(lotto, ['larghezza', 'altezza', 'segnaposto', 'updated_at'])
+        return len(lotto)
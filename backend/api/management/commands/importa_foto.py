@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importazione import CONCORRENZA_DOWNLOAD, importa_foto
+from api.models import Alloggio, FotoAlloggio
+
+
+class Command(BaseCommand):
+    """Importa in un alloggio le foto scaricate da una lista di URL"""
+
+    help = 'Scarica in parallelo le immagini dagli URL e le aggiunge alle foto di un alloggio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('alloggio', type=int, help="ID dell'alloggio")
+        parser.add_argument('urls', nargs='*', help='URL delle immagini')
+        parser.add_argument(
+            '--file',
+            help='File con un URL per riga (le righe vuote e quelle con # sono ignorate)'
+        )
+        parser.add_argument(
+            '--tipo',
+            default='altro',
+            choices=[scelta for scelta, _ in FotoAlloggio.TIPO_IMMAGINE_CHOICES],
+            help='Tipo delle foto importate (default: altro)'
+        )
+        parser.add_argument(
+            '--concorrenza',
+            type=int,
+            default=CONCORRENZA_DOWNLOAD,
+            help=f'Download contemporanei (default: {CONCORRENZA_DOWNLOAD})'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            alloggio = Alloggio.objects.get(pk=options['alloggio'])
+        except Alloggio.DoesNotExist:
+            raise CommandError(f"Alloggio {options['alloggio']} inesistente.")
+
+        urls = list(options['urls'])
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as file:
+                urls.extend(
+                    riga.strip() for riga in file
+                    if riga.strip() and not riga.lstrip().startswith('#')
+                )
+        if not urls:
+            raise CommandError('Nessun URL da importare.')
+
+        risultati = importa_foto(
+            alloggio, urls, concorrenza=max(1, options['concorrenza']), tipo=options['tipo']
+        )
+        importate = 0
+        for risultato in risultati:
+            if 'errore' in risultato:
+                self.stdout.write(self.style.ERROR(f"{risultato['url']}: {risultato['errore']}"))
+            else:
+                importate += 1
+                self.stdout.write(f"{risultato['url']}: foto {risultato['id']} ({risultato['stato']})")
+        self.stdout.write(self.style.SUCCESS(
+            f'{importate} foto importate su {len(risultati)} URL in "{alloggio.nome}".'
+        ))
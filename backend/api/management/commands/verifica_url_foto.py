@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from api.importazione import CONCORRENZA_DOWNLOAD, errore_verifica, verifica_url_parallela
+from api.models import FotoAlloggio
+
+
+class Command(BaseCommand):
+    """Verifica in parallelo gli URL delle foto remote e aggiorna la cache delle verifiche"""
+
+    help = 'Verifica che gli URL delle foto remote rispondano ancora con un\'immagine'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--alloggio',
+            type=int,
+            help="Verifica solo le foto di questo alloggio"
+        )
+        parser.add_argument(
+            '--concorrenza',
+            type=int,
+            default=CONCORRENZA_DOWNLOAD,
+            help=f'Verifiche contemporanee (default: {CONCORRENZA_DOWNLOAD})'
+        )
+
+    def handle(self, *args, **options):
+        foto = FotoAlloggio.objects.exclude(url='').filter(immagine__in=['', None])
+        if options['alloggio']:
+            foto = foto.filter(alloggio_id=options['alloggio'])
+        foto = list(foto.order_by('alloggio_id', 'ordine', 'id').values_list('id', 'url'))
+        if not foto:
+            self.stdout.write('Nessuna foto remota da verificare.')
+            return
+
+        esiti = verifica_url_parallela(
+            [url for _, url in foto], concorrenza=max(1, options['concorrenza'])
+        )
+        non_valide = irraggiungibili = 0
+        for foto_id, url in foto:
+            esito = esiti[url]
+            errore = errore_verifica(esito)
+            if errore:
+                non_valide += 1
+                self.stdout.write(self.style.ERROR(f'Foto {foto_id} {url}: {errore}'))
+            elif esito['status'] is None:
+                irraggiungibili += 1
+                self.stdout.write(self.style.WARNING(f"Foto {foto_id} {url}: host irraggiungibile ({esito['errore']})"))
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(foto)} foto verificate: {non_valide} non valide, {irraggiungibili} irraggiungibili.'
+        ))
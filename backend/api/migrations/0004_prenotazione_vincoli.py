@@ -0,0 +1,83 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:18
+
+import api.models
+import django.contrib.postgres.constraints
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+# Copia degli stati attivi al momento della migrazione
+STATI_ATTIVI = ['PENDENTE', 'CONFERMATA', 'PAGATA']
+
+# Conflitti elencati al massimo nel messaggio di errore
+MAX_CONFLITTI_ELENCATI = 50
+
+
+def verifica_dati_esistenti(apps, schema_editor):
+    """
+    Le prenotazioni già salvate non sono mai state controllate: se violano i
+    vincoli, AddConstraint fallirebbe con un errore del database senza dire
+    quali righe correggere. Qui la migrazione si ferma con l'elenco degli id
+    da sistemare (date invertite, prenotazioni attive sovrapposte) senza
+    modificare i dati, perché la scelta della prenotazione da annullare
+    spetta a chi gestisce gli alloggi.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        # Prima le date invertite: daterange() fallirebbe sulle stesse righe
+        cursor.execute(
+            'SELECT id FROM prenotazioni WHERE check_out <= check_in ORDER BY id LIMIT %s',
+            [MAX_CONFLITTI_ELENCATI],
+        )
+        invertite = [riga[0] for riga in cursor.fetchall()]
+        if invertite:
+            raise RuntimeError(
+                'Prenotazioni con check_out non successivo al check_in (id): '
+                f'{", ".join(map(str, invertite))}. Correggerle prima di applicare la migrazione.'
+            )
+
+        cursor.execute(
+            """
+            SELECT a.alloggio_id, a.id, b.id
+            FROM prenotazioni a
+            JOIN prenotazioni b
+              ON b.alloggio_id = a.alloggio_id
+             AND b.id > a.id
+             AND daterange(b.check_in, b.check_out) && daterange(a.check_in, a.check_out)
+            WHERE a.stato = ANY(%s) AND b.stato = ANY(%s)
+            ORDER BY a.alloggio_id, a.id, b.id
+            LIMIT %s
+            """,
+            [STATI_ATTIVI, STATI_ATTIVI, MAX_CONFLITTI_ELENCATI],
+        )
+        sovrapposte = cursor.fetchall()
+        if sovrapposte:
+            elenco = '\n'.join(
+                f'  alloggio {alloggio}: prenotazioni {prima} e {seconda}'
+                for alloggio, prima, seconda in sovrapposte
+            )
+            raise RuntimeError(
+                'Prenotazioni attive sovrapposte sullo stesso alloggio:\n'
+                f'{elenco}\n'
+                'Annullarne una per coppia (stato CANCELLATA) prima di applicare la migrazione.'
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_prenotazione'),
+    ]
+
+    operations = [
+        # Necessaria per usare l'uguaglianza su alloggio_id in un indice GiST
+        BtreeGistExtension(),
+        migrations.RunPython(verifica_dati_esistenti, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='prenotazione',
+            constraint=models.CheckConstraint(check=models.Q(('check_out__gt', models.F('check_in'))), name='prenotazione_check_out_dopo_check_in'),
+        ),
+        migrations.AddConstraint(
+            model_name='prenotazione',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('stato__in', ['PENDENTE', 'CONFERMATA', 'PAGATA'])), expressions=[('alloggio', '='), (api.models.PeriodoSoggiorno('check_in', 'check_out'), '&&')], name='prenotazione_no_sovrapposizioni', violation_error_message="L'alloggio non è disponibile per le date selezionate."),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_prenotazione_vincoli'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prenotazione',
+            index=models.Index(fields=['-created_at', 'id'], name='prenotazione_created_id_idx'),
+        ),
+    ]
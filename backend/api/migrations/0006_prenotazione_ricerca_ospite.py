@@ -0,0 +1,26 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:29
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_prenotazione_indice_paginazione'),
+    ]
+
+    operations = [
+        # Fornisce l'operator class gin_trgm_ops e l'operatore %
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='prenotazione',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('ospite_nome'), name='gin_trgm_ops'), name='prenotazione_nome_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prenotazione',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('ospite_email'), name='gin_trgm_ops'), name='prenotazione_email_trgm_idx'),
+        ),
+    ]
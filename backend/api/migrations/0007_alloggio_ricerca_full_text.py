@@ -0,0 +1,53 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:30
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Pesi: nome (A), posizione e servizi (B), descrizione (C). La configurazione
+# 'italian' deve coincidere con CONFIGURAZIONE_RICERCA in api.models.
+CREA_TRIGGER = """
+CREATE FUNCTION alloggi_vettore_ricerca() RETURNS trigger AS $$
+BEGIN
+    NEW.vettore_ricerca :=
+        setweight(to_tsvector('italian', coalesce(NEW.nome, '')), 'A') ||
+        setweight(to_tsvector('italian', coalesce(NEW.posizione, '')), 'B') ||
+        setweight(jsonb_to_tsvector('italian', coalesce(NEW.servizi, '[]'::jsonb), '["string"]'), 'B') ||
+        setweight(to_tsvector('italian', coalesce(NEW.descrizione, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER alloggi_vettore_ricerca
+    BEFORE INSERT OR UPDATE ON alloggi
+    FOR EACH ROW EXECUTE FUNCTION alloggi_vettore_ricerca();
+
+-- Popola il vettore degli alloggi esistenti
+UPDATE alloggi SET vettore_ricerca = NULL;
+"""
+
+ELIMINA_TRIGGER = """
+DROP TRIGGER IF EXISTS alloggi_vettore_ricerca ON alloggi;
+DROP FUNCTION IF EXISTS alloggi_vettore_ricerca();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_prenotazione_ricerca_ospite'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alloggio',
+            name='vettore_ricerca',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREA_TRIGGER, ELIMINA_TRIGGER),
+        migrations.AddIndex(
+            model_name='alloggio',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['vettore_ricerca'], name='alloggio_ricerca_idx'),
+        ),
+    ]
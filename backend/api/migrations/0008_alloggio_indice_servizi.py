@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:31
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_alloggio_ricerca_full_text'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alloggio',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['servizi'], name='alloggio_servizi_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
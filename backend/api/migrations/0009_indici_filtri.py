@@ -0,0 +1,33 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_alloggio_indice_servizi'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alloggio',
+            index=models.Index(fields=['prezzo_notte', 'numero_ospiti_max'], name='alloggio_prezzo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alloggio',
+            index=models.Index(fields=['numero_ospiti_max', 'numero_camere', 'numero_bagni'], name='alloggio_capienza_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prenotazione',
+            index=models.Index(fields=['stato', 'check_in'], name='prenotazione_stato_ci_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prenotazione',
+            index=models.Index(fields=['alloggio', 'stato', 'check_in'], name='prenotazione_all_stato_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prenotazione',
+            index=models.Index(fields=['check_in', 'check_out'], name='prenotazione_periodo_idx'),
+        ),
+    ]
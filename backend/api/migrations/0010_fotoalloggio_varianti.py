@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_indici_filtri'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='varianti',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_fotoalloggio_varianti'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='formati',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_fotoalloggio_formati'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='errore_elaborazione',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='stato',
+            field=models.CharField(choices=[('IN_ATTESA', 'In attesa di elaborazione'), ('IN_ELABORAZIONE', 'In elaborazione'), ('PRONTA', 'Pronta'), ('ERRORE', 'Errore di elaborazione')], default='PRONTA', editable=False, max_length=15),
+        ),
+    ]
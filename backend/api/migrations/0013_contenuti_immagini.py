@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_fotoalloggio_stato_elaborazione'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContenutoImmagine',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('percorso', models.CharField(max_length=255, unique=True)),
+                ('dimensione', models.PositiveIntegerField(help_text='Dimensione del file in byte')),
+                ('riferimenti', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Contenuto Immagine',
+                'verbose_name_plural': 'Contenuti Immagini',
+                'db_table': 'contenuti_immagini',
+            },
+        ),
+    ]
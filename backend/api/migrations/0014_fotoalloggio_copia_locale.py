@@ -0,0 +1,33 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_contenuti_immagini'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='copia_aggiornata_il',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='copia_di',
+            field=models.URLField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='copia_etag',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='copia_last_modified',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
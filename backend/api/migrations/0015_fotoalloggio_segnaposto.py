@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-17 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_fotoalloggio_copia_locale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='altezza',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='larghezza',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='fotoalloggio',
+            name='segnaposto',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
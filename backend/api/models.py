@@ -1,13 +1,28 @@
+import hashlib
 import os
 import uuid
-from django.db import models
-from django.contrib.postgres.fields import ArrayField
+from collections import Counter
+from django.db import IntegrityError, connection, models, transaction
+from django.db.backends.postgresql.psycopg_any import DateRange
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import ArrayField, DateRangeField, RangeOperators
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+from django.db.models.functions import Greatest, Upper
 from django.core.validators import MinValueValidator, MaxValueValidator, FileExtensionValidator
 from django.core.exceptions import ValidationError
+from django.conf import settings
 from django.utils.text import slugify
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .immagini import (
+    VARIANTI,
+    genera_formati,
+    genera_varianti,
+    percorsi_foto,
+    percorso_contenuto,
+    variante_incompleta,
+)
 
 
 def validate_image_size(file):
@@ -20,7 +35,8 @@ def validate_image_size(file):
 
 def foto_alloggio_path(instance, filename):
     """
-    Genera un percorso sicuro per il salvataggio delle immagini.
+    Genera un percorso sicuro per il salvataggio delle immagini caricate,
+    in attesa di elaborazione (i file elaborati sono in ContenutoImmagine).
     Pattern: alloggi/<alloggio_id>/<uuid>.<ext>
     """
     # Estrai l'estensione del file
@@ -31,6 +47,127 @@ def foto_alloggio_path(instance, filename):
     return os.path.join('alloggi', str(instance.alloggio.id), filename)
 
 
+# Stati che occupano l'alloggio per il periodo prenotato
+STATI_PRENOTAZIONE_ATTIVI = ['PENDENTE', 'CONFERMATA', 'PAGATA']
+
+MESSAGGIO_SOVRAPPOSIZIONE = "L'alloggio non è disponibile per le date selezionate."
+
+
+# Configurazione di testo (stemming italiano) della ricerca full-text;
+# deve coincidere con quella del trigger che mantiene vettore_ricerca
+CONFIGURAZIONE_RICERCA = 'italian'
+
+
+class PeriodoSoggiorno(models.Func):
+    """
+    Espressione daterange(check_in, check_out) con estremi [).
+    Deve coincidere con quella del vincolo di esclusione sulle prenotazioni
+    perché il planner possa usarne l'indice GiST.
+    """
+    function = 'daterange'
+    output_field = DateRangeField()
+
+
+class AlloggioQuerySet(models.QuerySet):
+    """QuerySet con i filtri di ricerca sugli alloggi."""
+
+    def per_ospiti(self, numero_ospiti):
+        """Filtra gli alloggi che possono ospitare almeno `numero_ospiti` persone."""
+        return self.filter(numero_ospiti_max__gte=numero_ospiti)
+
+    def liberi(self, check_in, check_out):
+        """
+        Filtra gli alloggi prenotabili e liberi nel periodo indicato.
+
+        L'esclusione delle prenotazioni sovrapposte avviene con un
+        NOT EXISTS correlato, quindi la ricerca resta una singola query
+        indipendentemente dal numero di alloggi nel catalogo.
+        """
+        occupato = Prenotazione.sovrapposte(check_in, check_out).filter(
+            alloggio=models.OuterRef('pk')
+        )
+        return self.filter(disponibile=True).filter(~models.Exists(occupato))
+
+    def cerca(self, testo):
+        """
+        Ricerca full-text su nome, descrizione, posizione e servizi, in ordine
+        di rilevanza.
+
+        Usa la colonna `vettore_ricerca`, mantenuta da un trigger e indicizzata
+        con GIN; `testo` accetta la sintassi di websearch_to_tsquery
+        (frasi tra virgolette, -esclusione, OR).
+        """
+        query = SearchQuery(testo, config=CONFIGURAZIONE_RICERCA, search_type='websearch')
+        return self.filter(vettore_ricerca=query).annotate(
+            rilevanza=SearchRank(models.F('vettore_ricerca'), query)
+        ).order_by('-rilevanza', 'nome')
+
+    def con_servizi(self, servizi):
+        """
+        Filtra gli alloggi che offrono tutti i `servizi` indicati.
+        Il contenimento JSONB (servizi @> '[...]') è servito dall'indice GIN.
+        """
+        return self.filter(servizi__contains=list(servizi))
+
+    def facette_servizi(self):
+        """
+        Conta gli alloggi del queryset per ciascun servizio, in una sola query.
+        Ritorna un dizionario {servizio: numero di alloggi}, dal più diffuso.
+        """
+        sql, params = self.order_by().values('servizi').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT servizio, COUNT(*)
+                FROM ({sql}) AS alloggi, jsonb_array_elements_text(alloggi.servizi) AS servizio
+                WHERE jsonb_typeof(alloggi.servizi) = 'array'
+                GROUP BY servizio
+                ORDER BY COUNT(*) DESC, servizio
+                """,
+                params,
+            )
+            return dict(cursor.fetchall())
+
+
+class PrenotazioneQuerySet(models.QuerySet):
+    """QuerySet con le ricerche per ospite sulle prenotazioni."""
+
+    def cerca_ospite(self, testo):
+        """
+        Filtra le prenotazioni il cui nome o email dell'ospite contiene `testo`.
+
+        icontains produce UPPER(campo) LIKE UPPER('%testo%'), la forma servita
+        dagli indici GIN trigram su UPPER(ospite_nome) e UPPER(ospite_email)
+        anche con il carattere jolly iniziale.
+        """
+        return self.filter(
+            models.Q(ospite_nome__icontains=testo) |
+            models.Q(ospite_email__icontains=testo)
+        )
+
+    def simili_ospite(self, testo):
+        """
+        Filtra le prenotazioni con nome o email dell'ospite simili a `testo`,
+        ordinate dalla più simile.
+
+        Tollera refusi e parole in ordine diverso. L'operatore % usa gli
+        stessi indici trigram; la soglia è pg_trgm.similarity_threshold.
+        """
+        nome, email = Upper('ospite_nome'), Upper('ospite_email')
+        return self.alias(
+            nome_ospite=nome,
+            email_ospite=email,
+        ).filter(
+            models.Q(nome_ospite__trigram_similar=testo) |
+            models.Q(email_ospite__trigram_similar=testo)
+        ).annotate(
+            somiglianza_ospite=Greatest(
+                TrigramSimilarity(nome, testo),
+                TrigramSimilarity(email, testo),
+            )
+        ).order_by('-somiglianza_ospite', '-created_at')
+
+
 class Alloggio(models.Model):
     """
     Modello per rappresentare un alloggio disponibile per la prenotazione.
@@ -60,6 +197,11 @@ class Alloggio(models.Model):
     disponibile = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    # Calcolato dal trigger alloggi_vettore_ricerca ad ogni INSERT/UPDATE
+    vettore_ricerca = SearchVectorField(null=True, editable=False)
+
+    objects = AlloggioQuerySet.as_manager()
     
     class Meta:
         db_table = 'alloggi'
@@ -67,6 +209,18 @@ class Alloggio(models.Model):
         ordering = ['nome']
         verbose_name = 'Alloggio'
         verbose_name_plural = 'Alloggi'
+        indexes = [
+            GinIndex(fields=['vettore_ricerca'], name='alloggio_ricerca_idx'),
+            # jsonb_path_ops: indice più compatto, supporta solo @> (?servizi=)
+            GinIndex(fields=['servizi'], opclasses=['jsonb_path_ops'], name='alloggio_servizi_idx'),
+            # Filtri di AlloggioFilter: fascia di prezzo (con o senza ospiti)
+            # e capienza (ospiti, camere, bagni)
+            models.Index(fields=['prezzo_notte', 'numero_ospiti_max'], name='alloggio_prezzo_idx'),
+            models.Index(
+                fields=['numero_ospiti_max', 'numero_camere', 'numero_bagni'],
+                name='alloggio_capienza_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.nome} - €{self.prezzo_notte}/notte"
@@ -75,6 +229,15 @@ class Alloggio(models.Model):
         """Verifica se l'alloggio è disponibile."""
         return self.disponibile
     
+    def get_foto_principale(self):
+        """
+        Ritorna la foto principale (ordine=0) o la prima disponibile.
+        Lavora sulle foto precaricate con prefetch_related('foto'), se presenti,
+        senza eseguire query aggiuntive.
+        """
+        foto = list(self.foto.all())
+        return next((f for f in foto if f.ordine == 0), foto[0] if foto else None)
+    
     @property
     def immagine_principale(self):
         """Ritorna l'immagine principale (ordine=0) o la prima disponibile."""
@@ -89,6 +252,18 @@ class FotoAlloggio(models.Model):
     Modello per le foto associate agli alloggi.
     Supporta sia upload locali che URL esterni.
     """
+    STATO_IN_ATTESA = 'IN_ATTESA'
+    STATO_IN_ELABORAZIONE = 'IN_ELABORAZIONE'
+    STATO_PRONTA = 'PRONTA'
+    STATO_ERRORE = 'ERRORE'
+    
+    STATO_CHOICES = [
+        (STATO_IN_ATTESA, 'In attesa di elaborazione'),
+        (STATO_IN_ELABORAZIONE, 'In elaborazione'),
+        (STATO_PRONTA, 'Pronta'),
+        (STATO_ERRORE, 'Errore di elaborazione'),
+    ]
+    
     TIPO_IMMAGINE_CHOICES = [
         ('principale', 'Immagine Principale'),
         ('camera', 'Camera'),
@@ -139,6 +314,35 @@ class FotoAlloggio(models.Model):
     larghezza_originale = models.IntegerField(null=True, blank=True)
     altezza_originale = models.IntegerField(null=True, blank=True)
     
+    # Dimensioni dell'immagine elaborata e segnaposto (data URI di pochi
+    # pixel) per riservare lo spazio e mostrare un'anteprima sfocata
+    larghezza = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    altezza = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    segnaposto = models.TextField(blank=True, editable=False)
+    
+    # Varianti generate: nome -> {percorso, larghezza, altezza, formati} (vedi api.immagini)
+    varianti = models.JSONField(default=dict, blank=True, editable=False)
+    
+    # Immagine principale nei formati alternativi al JPEG: formato -> percorso
+    formati = models.JSONField(default=dict, blank=True, editable=False)
+    
+    # Elaborazione in background dell'immagine caricata (le foto con URL
+    # esterno sono subito pronte)
+    stato = models.CharField(
+        max_length=15,
+        choices=STATO_CHOICES,
+        default=STATO_PRONTA,
+        editable=False
+    )
+    errore_elaborazione = models.TextField(blank=True, editable=False)
+    
+    # Copia locale di una foto remota: `immagine` contiene l'immagine
+    # scaricata da `copia_di`, aggiornata con richieste condizionali
+    copia_di = models.URLField(max_length=500, blank=True, editable=False)
+    copia_etag = models.CharField(max_length=255, blank=True, editable=False)
+    copia_last_modified = models.CharField(max_length=64, blank=True, editable=False)
+    copia_aggiornata_il = models.DateTimeField(null=True, blank=True, editable=False)
+    
     # Timestamp
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -158,61 +362,76 @@ class FotoAlloggio(models.Model):
     def __str__(self):
         return f"Foto {self.ordine} - {self.alloggio.nome}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Ricorda l'URL letto dal database, per riconoscerne il cambio in save()."""
+        foto = super().from_db(db, field_names, values)
+        if 'url' in field_names:
+            foto._url_salvato = values[field_names.index('url')]
+        return foto
+    
     def clean(self):
         """Validazione custom del modello."""
         super().clean()
         if not self.immagine and not self.url:
             raise ValidationError("Devi fornire un'immagine o un URL.")
-        if self.immagine and self.url:
+        if self.immagine and self.url and not self.is_copia_locale():
             raise ValidationError("Puoi fornire solo un'immagine O un URL, non entrambi.")
     
     def save(self, *args, **kwargs):
-        """Override del save per processare l'immagine."""
-        # Se c'è un'immagine da processare
-        if self.immagine and not self.pk:  # Solo per nuove immagini
-            # Apri l'immagine con Pillow
-            img = Image.open(self.immagine)
-            
-            # Salva dimensioni originali
-            self.larghezza_originale = img.width
-            self.altezza_originale = img.height
-            
-            # Converti RGBA in RGB se necessario
-            if img.mode in ('RGBA', 'LA', 'P'):
-                rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                rgb_img.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = rgb_img
-            
-            # Ridimensiona se troppo grande
-            max_size = (1920, 1080)
-            if img.width > max_size[0] or img.height > max_size[1]:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # Comprimi e salva
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=85, optimize=True)
-            output.seek(0)
-            
-            # Sostituisci il file originale con quello ottimizzato
-            self.immagine = ContentFile(
-                output.read(), 
-                name=self.immagine.name.replace('.png', '.jpg').replace('.webp', '.jpg')
-            )
+        """
+        Override del save: le nuove immagini sono elaborate in background
+        dal task api.tasks.elabora_foto, accodato al commit della transazione.
+        Un file caricato al posto di quello di una foto esistente è elaborato
+        allo stesso modo; i file e i dati derivati del precedente sono scartati.
+        
+        Con IMMAGINI_COPIA_REMOTE le foto remote senza copia locale sono
+        accodate al task api.tasks.copia_foto_remota quando vengono create o
+        ne cambia l'URL; in quel caso la copia dell'URL precedente viene
+        scartata.
+        """
+        url_cambiato = self._state.adding or self.url != getattr(self, '_url_salvato', None)
+        # Un file appena assegnato non è ancora nello storage; quelli elaborati
+        # o copiati (elabora_foto, copia locale) lo sono già
+        sostituita = bool(self.immagine) and bool(self.pk) and not self.immagine._committed
+        superati = []
+        if sostituita:
+            precedente = FotoAlloggio.objects.filter(pk=self.pk).first()
+            if precedente and precedente.immagine:
+                superati = [precedente.immagine.name, *percorsi_foto(precedente)]
+            self.formati, self.varianti = {}, {}
+            self.larghezza_originale = self.altezza_originale = None
+            self.larghezza = self.altezza = None
+            self.segnaposto = ''
+            self.copia_di = self.copia_etag = self.copia_last_modified = ''
+            self.copia_aggiornata_il = None
+        
+        nuova_immagine = bool(self.immagine) and (not self.pk or sostituita)
+        if nuova_immagine:
+            self.stato = self.STATO_IN_ATTESA
+            self.errore_elaborazione = ''
+        
+        copia_superata = self.is_copia_locale() and self.copia_di != self.url
+        if copia_superata:
+            superati = [self.immagine.name, *percorsi_foto(self)]
+            self.immagine = None
+            self.formati, self.varianti = {}, {}
+            self.larghezza = self.altezza = None
+            self.segnaposto = ''
+            self.copia_di = self.copia_etag = self.copia_last_modified = ''
+            self.copia_aggiornata_il = None
         
         super().save(*args, **kwargs)
-    
-    def delete(self, *args, **kwargs):
-        """Override del delete per rimuovere il file fisico."""
-        # Salva il riferimento all'immagine prima di eliminare
-        immagine = self.immagine
-        # Chiama il delete del parent
-        super().delete(*args, **kwargs)
-        # Elimina il file fisico se esiste
-        if immagine:
-            if os.path.isfile(immagine.path):
-                os.remove(immagine.path)
+        
+        self._url_salvato = self.url
+        if superati:
+            ContenutoImmagine.objects.rilascia(superati)
+        if nuova_immagine:
+            from .tasks import elabora_foto
+            transaction.on_commit(lambda: elabora_foto.delay(self.pk))
+        elif self.url and not self.immagine and url_cambiato and settings.IMMAGINI_COPIA_REMOTE:
+            from .tasks import copia_foto_remota
+            transaction.on_commit(lambda: copia_foto_remota.delay(self.pk))
     
     def get_image_url(self):
         """Ritorna l'URL dell'immagine (locale o remoto)."""
@@ -220,12 +439,146 @@ class FotoAlloggio(models.Model):
             return self.immagine.url
         return self.url or ''
     
+    def url_variante(self, nome):
+        """URL JPEG della variante `nome` se già generata, altrimenti None."""
+        percorso = self.percorsi_formati(nome).get('jpeg')
+        return default_storage.url(percorso) if percorso else None
+    
+    def percorsi_formati(self, nome=None):
+        """
+        Ritorna {formato: percorso} della variante `nome` o, con nome None,
+        dell'immagine principale; il JPEG è sempre incluso se il file esiste.
+        """
+        info = self.varianti.get(nome) if nome else None
+        if nome is None or (info and info.get('principale')):
+            return {'jpeg': self.immagine.name, **self.formati} if self.immagine else {}
+        return {'jpeg': info['percorso'], **info.get('formati', {})} if info else {}
+    
+    def is_copia_locale(self):
+        """Verifica se l'immagine è la copia locale della foto remota."""
+        return bool(self.immagine) and bool(self.copia_di)
+    
+    def is_pronta(self):
+        """Verifica se l'immagine è elaborata e le sue varianti disponibili."""
+        return self.stato == self.STATO_PRONTA
+    
+    def completa_variante(self, nome=None):
+        """
+        Genera al primo accesso la variante `nome` (None = immagine principale)
+        e i suoi formati mancanti, per le foto caricate prima della loro
+        introduzione. Le generazioni concorrenti della stessa foto sono
+        serializzate dal lock sulla riga.
+        """
+        if not self.immagine or not self.is_pronta() or not variante_incompleta(self, nome):
+            return
+        with transaction.atomic():
+            foto = FotoAlloggio.objects.select_for_update().get(pk=self.pk)
+            if variante_incompleta(foto, nome):
+                if nome is None:
+                    genera_formati(foto)
+                else:
+                    genera_varianti(foto, nomi=[nome])
+                foto.save(update_fields=['varianti', 'formati', 'updated_at'])
+            self.varianti, self.formati = foto.varianti, foto.formati
+    
     def get_thumbnail_url(self, width=300, height=200):
         """
-        Placeholder per futura implementazione di thumbnails.
-        Per ora ritorna l'immagine originale.
+        Ritorna l'URL della miniatura, se la dimensione è una delle varianti
+        previste; le foto remote ritornano l'URL originale.
+        """
+        nome = f'{width}x{height}'
+        if nome not in VARIANTI or not self.immagine:
+            return self.get_image_url()
+        self.completa_variante(nome)
+        return self.url_variante(nome)
+
+
+class ContenutoImmagineManager(models.Manager):
+    """Salvataggio e rilascio dei file indirizzati per contenuto."""
+
+    def acquisisci(self, file, estensione):
+        """
+        Salva `file` con il nome dato dallo SHA-256 del contenuto e ritorna
+        il percorso. Se lo stesso contenuto esiste già ne incrementa i
+        riferimenti invece di scriverne una copia.
         """
-        return self.get_image_url()
+        sha = hashlib.sha256()
+        for blocco in file.chunks():
+            sha.update(blocco)
+        digest = sha.hexdigest()
+
+        with transaction.atomic():
+            # L'inserimento concorrente dello stesso hash attende il commit
+            # di questo, quindi il file è scritto una volta sola
+            contenuto, creato = self.select_for_update().get_or_create(
+                hash=digest,
+                defaults={'percorso': percorso_contenuto(digest, estensione), 'dimensione': file.size},
+            )
+            if not creato:
+                contenuto.riferimenti = models.F('riferimenti') + 1
+                contenuto.save(update_fields=['riferimenti'])
+            # Un file rimasto da una transazione annullata ha già i byte giusti
+            if not default_storage.exists(contenuto.percorso):
+                default_storage.save(contenuto.percorso, file)
+        return contenuto.percorso
+
+    def rilascia(self, percorsi):
+        """
+        Decrementa i riferimenti dei file in `percorsi` (un percorso ripetuto
+        conta più volte) ed elimina al commit quelli non più usati. I file
+        non indirizzati per contenuto, come gli upload da elaborare, sono
+        eliminati direttamente.
+        """
+        conteggi = Counter(percorso for percorso in percorsi if percorso)
+        if not conteggi:
+            return
+        da_eliminare = []
+        with transaction.atomic():
+            contenuti = self.select_for_update().filter(percorso__in=conteggi).order_by('hash')
+            for contenuto in contenuti:
+                contenuto.riferimenti -= conteggi.pop(contenuto.percorso)
+                if contenuto.riferimenti > 0:
+                    contenuto.save(update_fields=['riferimenti'])
+                else:
+                    contenuto.delete()
+                    da_eliminare.append(contenuto.percorso)
+        da_eliminare.extend(conteggi)
+
+        def elimina_file():
+            # Lo stesso contenuto può essere stato caricato di nuovo nel frattempo
+            riacquisiti = set(self.filter(percorso__in=da_eliminare).values_list('percorso', flat=True))
+            for percorso in da_eliminare:
+                if percorso not in riacquisiti:
+                    default_storage.delete(percorso)
+
+        transaction.on_commit(elimina_file)
+
+
+class ContenutoImmagine(models.Model):
+    """
+    File immagine elaborato, nominato con lo SHA-256 dei suoi byte.
+
+    Le foto che producono gli stessi byte, anche di alloggi diversi,
+    condividono il file; `riferimenti` conta gli usi e il file è eliminato
+    quando scende a zero. Il contenuto di un percorso non cambia mai, quindi
+    i suoi URL possono essere messi in cache senza scadenza.
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    percorso = models.CharField(max_length=255, unique=True)
+    dimensione = models.PositiveIntegerField(help_text="Dimensione del file in byte")
+    riferimenti = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ContenutoImmagineManager()
+
+    class Meta:
+        db_table = 'contenuti_immagini'
+        verbose_name = 'Contenuto Immagine'
+        verbose_name_plural = 'Contenuti Immagini'
+
+    def __str__(self):
+        return f"{self.percorso} ({self.riferimenti} riferimenti)"
+
 
 class Prenotazione(models.Model):
     """
@@ -241,6 +594,10 @@ class Prenotazione(models.Model):
         ('CANCELLATA', 'Cancellata'),
         ('RIFIUTATA', 'Rifiutata'),
     ]
+
+    STATI_ATTIVI = STATI_PRENOTAZIONE_ATTIVI
+
+    MESSAGGIO_SOVRAPPOSIZIONE = MESSAGGIO_SOVRAPPOSIZIONE
     
     # Relazione con l'alloggio
     alloggio = models.ForeignKey(
@@ -286,13 +643,51 @@ class Prenotazione(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PrenotazioneQuerySet.as_manager()
+    
     class Meta:
         db_table = 'prenotazioni'
         db_table_comment = 'Tabella delle prenotazioni degli alloggi'
         ordering = ['-created_at']
         verbose_name = 'Prenotazione'
         verbose_name_plural = 'Prenotazioni'
-        # RIMOSSE tutte le constraints - la validazione avviene a livello applicazione
+        indexes = [
+            # Paginazione keyset di /api/prenotazioni/
+            models.Index(fields=['-created_at', 'id'], name='prenotazione_created_id_idx'),
+            # Filtri di PrenotazioneFilter: stato e alloggio con periodo,
+            # intervallo di date (?data_da=&data_a=)
+            models.Index(fields=['stato', 'check_in'], name='prenotazione_stato_ci_idx'),
+            models.Index(fields=['alloggio', 'stato', 'check_in'], name='prenotazione_all_stato_idx'),
+            models.Index(fields=['check_in', 'check_out'], name='prenotazione_periodo_idx'),
+            # Ricerca per ospite (?ospite=, ?search=): LIKE con jolly iniziale
+            # e similarità trigram sugli stessi indici
+            GinIndex(
+                OpClass(Upper('ospite_nome'), name='gin_trgm_ops'),
+                name='prenotazione_nome_trgm_idx',
+            ),
+            GinIndex(
+                OpClass(Upper('ospite_email'), name='gin_trgm_ops'),
+                name='prenotazione_email_trgm_idx',
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(check_out__gt=models.F('check_in')),
+                name='prenotazione_check_out_dopo_check_in'
+            ),
+            # Impedisce a livello di database prenotazioni attive sovrapposte
+            # sullo stesso alloggio; l'indice GiST del vincolo serve anche
+            # le ricerche di sovrapposizione di check_disponibilita.
+            ExclusionConstraint(
+                name='prenotazione_no_sovrapposizioni',
+                expressions=[
+                    ('alloggio', RangeOperators.EQUAL),
+                    (PeriodoSoggiorno('check_in', 'check_out'), RangeOperators.OVERLAPS),
+                ],
+                condition=models.Q(stato__in=STATI_PRENOTAZIONE_ATTIVI),
+                violation_error_message=MESSAGGIO_SOVRAPPOSIZIONE,
+            ),
+        ]
     
     def __str__(self):
         return f"{self.alloggio.nome} - {self.ospite_nome} ({self.check_in} to {self.check_out})"
@@ -331,7 +726,16 @@ class Prenotazione(models.Model):
         # Esegui validazioni
         self.full_clean()
         
-        super().save(*args, **kwargs)
+        # Il vincolo di esclusione copre la finestra tra la validazione e
+        # l'insert: una prenotazione concorrente viene rifiutata dal database.
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as e:
+            diag = getattr(e.__cause__, 'diag', None)
+            if getattr(diag, 'constraint_name', None) == 'prenotazione_no_sovrapposizioni':
+                raise ValidationError(self.MESSAGGIO_SOVRAPPOSIZIONE)
+            raise
     
     def is_confermata(self):
         """Verifica se la prenotazione è confermata."""
@@ -348,6 +752,16 @@ class Prenotazione(models.Model):
         return (self.is_modificabile() and 
                 self.check_in > timezone.now().date())
     
+    @classmethod
+    def sovrapposte(cls, check_in, check_out):
+        """Ritorna le prenotazioni attive che si sovrappongono al periodo indicato."""
+        return cls.objects.alias(
+            periodo=PeriodoSoggiorno('check_in', 'check_out')
+        ).filter(
+            stato__in=cls.STATI_ATTIVI,
+            periodo__overlap=DateRange(check_in, check_out),
+        )
+
     @classmethod
     def check_disponibilita(cls, alloggio, check_in, check_out, exclude_id=None):
         """
@@ -362,15 +776,8 @@ class Prenotazione(models.Model):
         Returns:
             bool: True se disponibile, False altrimenti
         """
-        from django.db.models import Q
-        
         # Query per prenotazioni sovrapposte
-        overlapping = cls.objects.filter(
-            alloggio=alloggio,
-            stato__in=['PENDENTE', 'CONFERMATA', 'PAGATA']
-        ).filter(
-            Q(check_in__lt=check_out) & Q(check_out__gt=check_in)
-        )
+        overlapping = cls.sovrapposte(check_in, check_out).filter(alloggio=alloggio)
         
         # Escludi una prenotazione specifica (per modifiche)
         if exclude_id:
@@ -380,10 +787,6 @@ class Prenotazione(models.Model):
     
     def get_conflitti(self):
         """Ritorna le prenotazioni in conflitto con questa."""
-        return Prenotazione.objects.filter(
-            alloggio=self.alloggio,
-            stato__in=['PENDENTE', 'CONFERMATA', 'PAGATA']
-        ).filter(
-            models.Q(check_in__lt=self.check_out) & 
-            models.Q(check_out__gt=self.check_in)
-        ).exclude(id=self.id)
\ No newline at end of file
+        return Prenotazione.sovrapposte(self.check_in, self.check_out).filter(
+            alloggio=self.alloggio
+        ).exclude(id=self.id)
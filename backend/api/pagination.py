@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PrenotazioneCursorPagination(CursorPagination):
+    """
+    Paginazione keyset delle prenotazioni, dalla più recente.
+
+    Evita il COUNT(*) e gli OFFSET crescenti della paginazione a pagine:
+    ogni pagina parte dalla posizione codificata nel cursore ed è servita
+    dall'indice su (created_at DESC, id).
+    """
+    ordering = ('-created_at', 'id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
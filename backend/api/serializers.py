@@ -1,12 +1,124 @@
 from rest_framework import serializers
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.urls import reverse
+from .disponibilita import verifica_disponibilita
+from .importazione import ErroreDownload, errore_verifica, scarica_immagine, verifica_url
+from django.core.files.storage import default_storage
+from .immagini import FORMATI, FORMATI_ALTERNATIVI, MINIATURA, VARIANTI, VARIANTI_SRCSET, verifica_pixel
 from .models import Alloggio, FotoAlloggio, Prenotazione 
-import requests
-from django.core.files.base import ContentFile
+from PIL import Image
 import re
 
 
+def errori_prenotazione(errore, messaggio_conflitto):
+    """
+    Converte la ValidationError sollevata da Prenotazione.save nei messaggi
+    del serializer, sostituendo quello di sovrapposizione con `messaggio_conflitto`.
+    """
+    return [
+        messaggio_conflitto if messaggio == Prenotazione.MESSAGGIO_SOVRAPPOSIZIONE else messaggio
+        for messaggio in errore.messages
+    ]
+
+
+def url_variante(foto, nome, request):
+    """
+    URL assoluto della variante di una foto caricata: il file se già generato,
+    altrimenti l'endpoint che lo genera al primo accesso.
+    """
+    url = foto.url_variante(nome)
+    if url is None and not foto.is_pronta():
+        return ''
+    if url is None:
+        url = reverse('fotoalloggio-variante', kwargs={'pk': foto.pk, 'nome': nome})
+    return request.build_absolute_uri(url) if request else url
+
+
+def miniatura_foto(foto, request):
+    """
+    URL della miniatura per le card; le foto remote usano l'URL originale,
+    quelle ancora in elaborazione nessuno.
+    """
+    if not foto.immagine:
+        return foto.url or ''
+    return url_variante(foto, MINIATURA, request)
+
+
+def larghezza_variante(foto, nome):
+    """
+    Larghezza reale della variante, per il descrittore dello srcset: quella
+    salvata o, se non ancora generata, quella prevista senza ingrandimenti.
+    """
+    info = foto.varianti.get(nome)
+    if info:
+        return info['larghezza']
+    return min(VARIANTI[nome][0], foto.larghezza or VARIANTI[nome][0])
+
+
+def voci_srcset(voci):
+    """Unisce le coppie (url, larghezza), una per larghezza: la prima."""
+    uniche = {}
+    for url, larghezza in voci:
+        uniche.setdefault(larghezza, url)
+    return ', '.join(f'{url} {larghezza}w' for larghezza, url in uniche.items())
+
+
+def srcset_foto(foto, request):
+    """
+    Valore per l'attributo srcset ("<url> 800w, <url> 1620w"), vuoto per le
+    foto remote e per quelle ancora in elaborazione.
+    """
+    if not foto.immagine or not foto.is_pronta():
+        return ''
+    return voci_srcset(
+        (url_variante(foto, nome, request), larghezza_variante(foto, nome))
+        for nome in VARIANTI_SRCSET
+    )
+
+
+def sorgenti_foto(foto, request):
+    """
+    Sorgenti per un elemento <picture>, dal formato più compatto: per ogni
+    formato alternativo già generato per tutte le varianti, il content type,
+    lo srcset e la miniatura in quel formato.
+    """
+    if not foto.immagine or not foto.is_pronta():
+        return []
+
+    def url(percorso):
+        url = default_storage.url(percorso)
+        return request.build_absolute_uri(url) if request else url
+
+    sorgenti = []
+    for formato in FORMATI_ALTERNATIVI:
+        percorsi = {nome: foto.percorsi_formati(nome).get(formato) for nome in (MINIATURA, *VARIANTI_SRCSET)}
+        if not all(percorsi.values()):
+            continue
+        sorgenti.append({
+            'type': FORMATI[formato][2],
+            'srcset': voci_srcset(
+                (url(percorsi[nome]), foto.varianti[nome]['larghezza']) for nome in VARIANTI_SRCSET
+            ),
+            'miniatura': url(percorsi[MINIATURA]),
+        })
+    return sorgenti
+
+
+def valida_pixel_immagine(value):
+    """
+    Rifiuta all'upload le immagini oltre il limite di pixel, usando le
+    dimensioni lette dall'intestazione durante la validazione del campo.
+    """
+    img = getattr(value, 'image', None)
+    if img is not None:
+        try:
+            verifica_pixel(img)
+        except Image.DecompressionBombError as e:
+            raise serializers.ValidationError(str(e))
+    return value
+
+
 class FotoAlloggioSerializer(serializers.ModelSerializer):
     """
     Serializer per le foto degli alloggi.
@@ -28,9 +140,12 @@ class FotoAlloggioSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'immagine', 'url', 'image_url', 'descrizione', 
             'tipo', 'ordine', 'larghezza_originale', 'altezza_originale',
-            'created_at', 'updated_at'
+            'stato', 'errore_elaborazione', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'larghezza_originale', 'altezza_originale', 'stato',
+            'errore_elaborazione', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['larghezza_originale', 'altezza_originale', 'created_at', 'updated_at']
     
     def get_image_url(self, obj):
         """Ritorna l'URL dell'immagine (locale o remoto)."""
@@ -38,12 +153,19 @@ class FotoAlloggioSerializer(serializers.ModelSerializer):
         if obj.immagine and request:
             return request.build_absolute_uri(obj.immagine.url)
         return obj.url or ''
+
+    def validate_immagine(self, value):
+        """Rifiuta le immagini troppo grandi prima dell'elaborazione."""
+        return valida_pixel_immagine(value)
     
     def validate(self, data):
         """Validazione custom per assicurare che ci sia immagine O url."""
         # Se stiamo aggiornando, prendiamo i valori esistenti
         if self.instance:
-            immagine = data.get('immagine', self.instance.immagine)
+            # La copia locale di una foto remota non conta come immagine caricata
+            immagine = data.get(
+                'immagine', None if self.instance.is_copia_locale() else self.instance.immagine
+            )
             url = data.get('url', self.instance.url)
         else:
             immagine = data.get('immagine')
@@ -66,21 +188,16 @@ class FotoAlloggioSerializer(serializers.ModelSerializer):
             validator = URLValidator()
             try:
                 validator(url)
-                # Verifica che sia un URL di immagine
-                if not re.match(r'.*\.(jpg|jpeg|png|gif|webp)(\?.*)?$', url.lower()):
-                    # Se non ha estensione, proviamo a verificare il content-type
-                    try:
-                        response = requests.head(url, timeout=5, allow_redirects=True)
-                        content_type = response.headers.get('content-type', '')
-                        if not content_type.startswith('image/'):
-                            raise serializers.ValidationError(
-                                "L'URL deve puntare a un'immagine valida."
-                            )
-                    except:
-                        # Se non riusciamo a verificare, accettiamo l'URL
-                        pass
             except ValidationError:
                 raise serializers.ValidationError("URL non valido.")
+            # Senza estensione d'immagine verifichiamo il content-type; l'URL
+            # invariato di una foto esistente non viene verificato di nuovo
+            invariato = self.instance is not None and url == self.instance.url
+            if not invariato and not re.match(r'.*\.(jpg|jpeg|png|gif|webp)(\?.*)?$', url.lower()):
+                # Esito condiviso in cache; un host irraggiungibile non blocca il salvataggio
+                errore = errore_verifica(verifica_url(url))
+                if errore:
+                    raise serializers.ValidationError(errore)
         
         return data
 
@@ -88,10 +205,16 @@ class FotoAlloggioSerializer(serializers.ModelSerializer):
 class FotoAlloggioListSerializer(serializers.ModelSerializer):
     """Serializer semplificato per le liste di foto."""
     image_url = serializers.SerializerMethodField()
+    miniatura_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    sorgenti = serializers.SerializerMethodField()
     
     class Meta:
         model = FotoAlloggio
-        fields = ['id', 'image_url', 'descrizione', 'tipo', 'ordine']
+        fields = [
+            'id', 'image_url', 'miniatura_url', 'srcset', 'sorgenti', 'stato',
+            'segnaposto', 'larghezza', 'altezza', 'descrizione', 'tipo', 'ordine'
+        ]
     
     def get_image_url(self, obj):
         """Ritorna l'URL dell'immagine (locale o remoto)."""
@@ -99,6 +222,18 @@ class FotoAlloggioListSerializer(serializers.ModelSerializer):
         if obj.immagine and request:
             return request.build_absolute_uri(obj.immagine.url)
         return obj.url or ''
+    
+    def get_miniatura_url(self, obj):
+        """Ritorna l'URL della miniatura 300x200."""
+        return miniatura_foto(obj, self.context.get('request'))
+    
+    def get_srcset(self, obj):
+        """Ritorna lo srcset delle varianti a larghezza fissa."""
+        return srcset_foto(obj, self.context.get('request'))
+    
+    def get_sorgenti(self, obj):
+        """Ritorna le sorgenti WebP/AVIF per <picture>."""
+        return sorgenti_foto(obj, self.context.get('request'))
 
 
 class AlloggioListSerializer(serializers.ModelSerializer):
@@ -107,20 +242,58 @@ class AlloggioListSerializer(serializers.ModelSerializer):
     Include solo informazioni essenziali per performance.
     """
     immagine_principale = serializers.SerializerMethodField()
-    numero_foto = serializers.IntegerField(source='foto.count', read_only=True)
+    miniatura = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    sorgenti = serializers.SerializerMethodField()
+    segnaposto = serializers.SerializerMethodField()
+    numero_foto = serializers.SerializerMethodField()
     
     class Meta:
         model = Alloggio
         fields = [
             'id', 'nome', 'posizione', 'prezzo_notte', 
             'numero_ospiti_max', 'disponibile', 'immagine_principale',
-            'numero_foto'
+            'miniatura', 'srcset', 'sorgenti', 'segnaposto', 'numero_foto'
         ]
     
+    def to_representation(self, instance):
+        """Cerca la foto principale una sola volta per i campi che la usano."""
+        self.foto_principale = instance.get_foto_principale()
+        return super().to_representation(instance)
+    
+    def get_numero_foto(self, obj):
+        """Conta le foto usando quelle precaricate dalla view."""
+        return len(obj.foto.all())
+    
+    def get_miniatura(self, obj):
+        """Ritorna la miniatura 300x200 dell'immagine principale."""
+        foto = self.foto_principale
+        return miniatura_foto(foto, self.context.get('request')) if foto else None
+    
+    def get_srcset(self, obj):
+        """Ritorna lo srcset dell'immagine principale."""
+        foto = self.foto_principale
+        return srcset_foto(foto, self.context.get('request')) if foto else ''
+    
+    def get_sorgenti(self, obj):
+        """Ritorna le sorgenti WebP/AVIF dell'immagine principale."""
+        foto = self.foto_principale
+        return sorgenti_foto(foto, self.context.get('request')) if foto else []
+    
+    def get_segnaposto(self, obj):
+        """
+        Ritorna segnaposto e dimensioni dell'immagine principale, o None se
+        non ancora calcolati (foto remote o in elaborazione).
+        """
+        foto = self.foto_principale
+        if not foto or not foto.segnaposto:
+            return None
+        return {'data_uri': foto.segnaposto, 'larghezza': foto.larghezza, 'altezza': foto.altezza}
+    
     def get_immagine_principale(self, obj):
         """Ritorna l'URL dell'immagine principale."""
         request = self.context.get('request')
-        foto = obj.foto.filter(ordine=0).first() or obj.foto.first()
+        foto = self.foto_principale
         if foto:
             if foto.immagine and request:
                 return request.build_absolute_uri(foto.immagine.url)
@@ -150,7 +323,7 @@ class AlloggioDetailSerializer(serializers.ModelSerializer):
     def get_immagine_principale(self, obj):
         """Ritorna l'URL dell'immagine principale."""
         request = self.context.get('request')
-        foto = obj.foto.filter(ordine=0).first() or obj.foto.first()
+        foto = obj.get_foto_principale()
         if foto:
             if foto.immagine and request:
                 return request.build_absolute_uri(foto.immagine.url)
@@ -242,58 +415,83 @@ class FotoAlloggioUploadSerializer(serializers.ModelSerializer):
             'alloggio', 'immagine', 'url', 'url_download',
             'descrizione', 'tipo', 'ordine'
         ]
+
+    def validate_immagine(self, value):
+        """Rifiuta le immagini troppo grandi prima dell'elaborazione."""
+        return valida_pixel_immagine(value)
     
     def validate_url_download(self, value):
-        """Valida e scarica l'immagine dall'URL."""
+        """
+        Scarica l'immagine dall'URL, una sola volta e in streaming: il file
+        scaricato diventa il valore validato del campo.
+        """
         if value:
             try:
-                # Scarica l'immagine con timeout
-                response = requests.get(value, timeout=10, stream=True)
-                response.raise_for_status()
-                
-                # Verifica il content-type
-                content_type = response.headers.get('content-type', '')
-                if not content_type.startswith('image/'):
-                    raise serializers.ValidationError("L'URL non punta a un'immagine valida.")
-                
-                # Verifica la dimensione
-                content_length = response.headers.get('content-length')
-                if content_length and int(content_length) > 10 * 1024 * 1024:  # 10MB
-                    raise serializers.ValidationError("L'immagine è troppo grande (max 10MB).")
-                
-                return value
-            except requests.RequestException as e:
-                raise serializers.ValidationError(f"Impossibile scaricare l'immagine: {str(e)}")
+                return scarica_immagine(value)
+            except ErroreDownload as e:
+                raise serializers.ValidationError(str(e))
         return value
     
     def create(self, validated_data):
         """Crea la foto gestendo il download se necessario."""
-        url_download = validated_data.pop('url_download', None)
+        scaricata = validated_data.pop('url_download', None)
         
-        if url_download:
-            # Scarica e salva l'immagine
-            try:
-                response = requests.get(url_download, timeout=10)
-                response.raise_for_status()
-                
-                # Estrai il nome del file dall'URL
-                filename = url_download.split('/')[-1].split('?')[0]
-                if not filename:
-                    filename = 'downloaded_image.jpg'
-                
-                # Crea il file Django
-                validated_data['immagine'] = ContentFile(
-                    response.content,
-                    name=filename
-                )
-                # Rimuovi l'URL se stiamo salvando l'immagine localmente
-                validated_data.pop('url', None)
-            except Exception as e:
-                raise serializers.ValidationError(f"Errore nel download: {str(e)}")
+        if scaricata:
+            validated_data['immagine'] = scaricata
+            # Rimuovi l'URL se stiamo salvando l'immagine localmente
+            validated_data.pop('url', None)
+            with scaricata:
+                return super().create(validated_data)
         
         return super().create(validated_data)
 
 
+class ImportazioneFotoSerializer(serializers.Serializer):
+    """
+    Serializer per l'importazione di più foto da URL in un alloggio.
+    Gli URL sono scaricati in parallelo (vedi api.importazione).
+    """
+    MAX_URL = 50
+    
+    alloggio = serializers.PrimaryKeyRelatedField(queryset=Alloggio.objects.all())
+    urls = serializers.ListField(
+        child=serializers.URLField(max_length=500),
+        allow_empty=False,
+        max_length=MAX_URL,
+    )
+    tipo = serializers.ChoiceField(choices=FotoAlloggio.TIPO_IMMAGINE_CHOICES, default='altro')
+
+
+class CaricamentoMultiploSerializer(serializers.Serializer):
+    """
+    Serializer per il caricamento di più foto in un alloggio.
+    I singoli file sono validati a parte con ImmagineCaricataSerializer,
+    così un file non valido non blocca gli altri.
+    """
+    MAX_FILE = 40
+    
+    alloggio = serializers.PrimaryKeyRelatedField(queryset=Alloggio.objects.all())
+    immagini = serializers.ListField(
+        child=serializers.FileField(),
+        allow_empty=False,
+        max_length=MAX_FILE,
+    )
+    tipo = serializers.ChoiceField(choices=FotoAlloggio.TIPO_IMMAGINE_CHOICES, default='altro')
+
+
+class ImmagineCaricataSerializer(serializers.ModelSerializer):
+    """Valida un file di un caricamento multiplo con le regole del campo immagine."""
+    
+    class Meta:
+        model = FotoAlloggio
+        fields = ['immagine']
+        extra_kwargs = {'immagine': {'required': True, 'allow_null': False}}
+    
+    def validate_immagine(self, value):
+        """Rifiuta le immagini troppo grandi prima dell'elaborazione."""
+        return valida_pixel_immagine(value)
+
+
 class DisponibilitaSerializer(serializers.Serializer):
     """Serializer per verificare la disponibilità di un alloggio."""
     check_in = serializers.DateField(required=True)
@@ -361,6 +559,10 @@ class PrenotazioneCreateSerializer(serializers.ModelSerializer):
     Serializer per la creazione di nuove prenotazioni.
     Include validazioni specifiche per la creazione.
     """
+    MESSAGGIO_CONFLITTO = (
+        "L'alloggio non è disponibile per le date selezionate. "
+        "Ci sono già prenotazioni confermate in conflitto."
+    )
     
     class Meta:
         model = Prenotazione
@@ -416,15 +618,24 @@ class PrenotazioneCreateSerializer(serializers.ModelSerializer):
                 "L'alloggio selezionato non è attualmente disponibile."
             )
         
-        # Verifica conflitti con altre prenotazioni
-        if not Prenotazione.check_disponibilita(alloggio, check_in, check_out):
-            raise serializers.ValidationError(
-                "L'alloggio non è disponibile per le date selezionate. "
-                "Ci sono già prenotazioni confermate in conflitto."
-            )
+        # Verifica conflitti con altre prenotazioni (bitmap in cache)
+        if not verifica_disponibilita(alloggio, check_in, check_out):
+            raise serializers.ValidationError(self.MESSAGGIO_CONFLITTO)
         
         return data
     
+    def create(self, validated_data):
+        """
+        Crea la prenotazione. Un conflitto rilevato dal vincolo del database
+        (prenotazione concorrente) viene riportato come errore di validazione.
+        """
+        try:
+            return super().create(validated_data)
+        except ValidationError as e:
+            raise serializers.ValidationError(
+                errori_prenotazione(e, self.MESSAGGIO_CONFLITTO)
+            )
+    
     def validate_ospite_email(self, value):
         """Validazione email ospite."""
         from django.core.validators import validate_email
@@ -465,6 +676,7 @@ class PrenotazioneUpdateSerializer(serializers.ModelSerializer):
     Serializer per l'aggiornamento delle prenotazioni.
     Permette modifiche limitate in base allo stato.
     """
+    MESSAGGIO_CONFLITTO = "L'alloggio non è disponibile per le nuove date selezionate."
     
     class Meta:
         model = Prenotazione
@@ -492,11 +704,18 @@ class PrenotazioneUpdateSerializer(serializers.ModelSerializer):
             if not Prenotazione.check_disponibilita(
                 instance.alloggio, check_in, check_out, exclude_id=instance.id
             ):
-                raise serializers.ValidationError(
-                    "L'alloggio non è disponibile per le nuove date selezionate."
-                )
+                raise serializers.ValidationError(self.MESSAGGIO_CONFLITTO)
         
         return super().validate(data)
+    
+    def update(self, instance, validated_data):
+        """Aggiorna la prenotazione riportando i conflitti del database come errori di validazione."""
+        try:
+            return super().update(instance, validated_data)
+        except ValidationError as e:
+            raise serializers.ValidationError(
+                errori_prenotazione(e, self.MESSAGGIO_CONFLITTO)
+            )
 
 
 class DisponibilitaSerializer(serializers.Serializer):
@@ -543,4 +762,109 @@ class DisponibilitaSerializer(serializers.Serializer):
         check_in = validated_data['check_in']
         check_out = validated_data['check_out']
         
-        return Prenotazione.check_disponibilita(alloggio, check_in, check_out)
\ No newline at end of file
+        return verifica_disponibilita(alloggio, check_in, check_out)
+
+
+class RicercaAlloggiSerializer(serializers.Serializer):
+    """
+    Serializer per i parametri di ricerca sulla lista alloggi.
+    Le date vanno fornite insieme; testo libero (q) e servizi (separati
+    da virgola) sono facoltativi.
+    """
+    MAX_SERVIZI = 20
+    
+    check_in = serializers.DateField(required=False)
+    check_out = serializers.DateField(required=False)
+    q = serializers.CharField(required=False, max_length=200)
+    servizi = serializers.CharField(required=False)
+    
+    def validate_servizi(self, value):
+        """Converte 'Wi-Fi,Piscina' nella lista dei servizi richiesti."""
+        servizi = [s.strip() for s in value.split(',') if s.strip()]
+        if len(servizi) > self.MAX_SERVIZI:
+            raise serializers.ValidationError(
+                f"Si possono richiedere al massimo {self.MAX_SERVIZI} servizi."
+            )
+        return servizi
+    
+    def validate(self, data):
+        """Valida la coerenza del periodo richiesto."""
+        check_in = data.get('check_in')
+        check_out = data.get('check_out')
+        
+        if bool(check_in) != bool(check_out):
+            raise serializers.ValidationError(
+                "Parametri check_in e check_out devono essere forniti insieme."
+            )
+        
+        if check_in and check_out <= check_in:
+            raise serializers.ValidationError(
+                "La data di check-out deve essere successiva al check-in."
+            )
+        
+        return data
+
+
+class CalendarioSerializer(serializers.Serializer):
+    """
+    Serializer per i parametri del calendario di occupazione.
+    I mesi sono nel formato YYYY-MM; di default viene mostrato il mese corrente.
+    """
+    MAX_MESI = 18
+    
+    da = serializers.DateField(required=False, input_formats=['%Y-%m'])
+    a = serializers.DateField(required=False, input_formats=['%Y-%m'])
+    
+    def validate(self, data):
+        """Applica i default e limita l'ampiezza del periodo richiesto."""
+        from django.utils import timezone
+        
+        da = data.get('da') or timezone.now().date().replace(day=1)
+        a = data.get('a') or da
+        
+        if a < da:
+            raise serializers.ValidationError(
+                "Il mese finale deve essere uguale o successivo a quello iniziale."
+            )
+        
+        numero_mesi = (a.year - da.year) * 12 + a.month - da.month + 1
+        if numero_mesi > self.MAX_MESI:
+            raise serializers.ValidationError(
+                f"Il calendario può coprire al massimo {self.MAX_MESI} mesi."
+            )
+        
+        data['da'] = da
+        data['a'] = a
+        return data
+
+
+class PeriodoSerializer(serializers.Serializer):
+    """Serializer per un periodo di soggiorno futuro."""
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+    
+    def validate(self, data):
+        """Validazioni del periodo richiesto."""
+        from django.utils import timezone
+        
+        if data['check_out'] <= data['check_in']:
+            raise serializers.ValidationError(
+                "La data di check-out deve essere successiva al check-in."
+            )
+        
+        if data['check_in'] < timezone.now().date():
+            raise serializers.ValidationError(
+                "La data di check-in non può essere nel passato."
+            )
+        
+        return data
+
+
+class DisponibilitaBatchSerializer(PeriodoSerializer):
+    """
+    Serializer per una singola richiesta del preventivo multiplo.
+    L'esistenza dell'alloggio viene verificata in blocco dalla view.
+    """
+    MAX_RICHIESTE = 100
+    
+    alloggio_id = serializers.IntegerField()
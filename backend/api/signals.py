@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import incrementa_versione_catalogo
+from .disponibilita import invalida_occupazione
+from .immagini import rilascia_file_foto
+from .models import Alloggio, FotoAlloggio, Prenotazione
+
+
+@receiver(post_save, sender=Prenotazione)
+@receiver(post_delete, sender=Prenotazione)
+def aggiorna_occupazione(sender, instance, **kwargs):
+    """
+    Invalida la bitmap di occupazione dell'alloggio quando una prenotazione
+    viene creata, modificata (anche solo nello stato) o eliminata.
+
+    L'invalidazione viene ripetuta al commit, così una bitmap ricostruita
+    da un'altra richiesta prima del commit non resta in cache.
+    """
+    alloggio_id = instance.alloggio_id
+    invalida_occupazione(alloggio_id)
+    transaction.on_commit(lambda: invalida_occupazione(alloggio_id))
+
+
+@receiver(post_save, sender=Alloggio)
+@receiver(post_delete, sender=Alloggio)
+@receiver(post_save, sender=FotoAlloggio)
+@receiver(post_delete, sender=FotoAlloggio)
+def aggiorna_versione_catalogo(sender, instance, **kwargs):
+    """
+    Invalida le risposte del catalogo in cache a ogni modifica di alloggi
+    o foto, comprese quelle fatte dall'admin (list_editable, inline).
+    """
+    incrementa_versione_catalogo()
+    transaction.on_commit(incrementa_versione_catalogo)
+
+
+@receiver(post_delete, sender=FotoAlloggio)
+def rilascia_file(sender, instance, **kwargs):
+    """
+    Rilascia i file della foto eliminata, anche quando l'eliminazione
+    avviene a cascata con il suo alloggio.
+    """
+    rilascia_file_foto(instance)
@@ -0,0 +1,90 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image
+
+from .immagini import elabora_immagine, rilascia_file_foto
+from .importazione import aggiorna_copia_locale
+from .models import FotoAlloggio
+
+logger = logging.getLogger(__name__)
+
+# Oltre questo tempo una foto IN_ELABORAZIONE è considerata abbandonata da un
+# worker terminato e può essere ripresa dal task riconsegnato
+TIMEOUT_ELABORAZIONE = 60 * 15
+
+
+@shared_task
+def elabora_foto(foto_id):
+    """
+    Elabora in background l'immagine di una foto appena caricata.
+
+    La foto passa da IN_ATTESA a IN_ELABORAZIONE con un update condizionale,
+    così un task duplicato non la elabora due volte. Una foto rimasta
+    IN_ELABORAZIONE oltre TIMEOUT_ELABORAZIONE (worker terminato prima di
+    confermare il task) viene ripresa dal task riconsegnato. Al termine è
+    PRONTA, oppure ERRORE con il motivo in errore_elaborazione.
+    """
+    adesso = timezone.now()
+    presa = FotoAlloggio.objects.filter(
+        Q(stato=FotoAlloggio.STATO_IN_ATTESA)
+        | Q(stato=FotoAlloggio.STATO_IN_ELABORAZIONE,
+            updated_at__lt=adesso - timedelta(seconds=TIMEOUT_ELABORAZIONE)),
+        pk=foto_id,
+    ).update(stato=FotoAlloggio.STATO_IN_ELABORAZIONE, updated_at=adesso)
+    if not presa:
+        return
+
+    foto = FotoAlloggio.objects.get(pk=foto_id)
+    try:
+        elabora_immagine(foto)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Elaborazione della foto %s non riuscita: %s", foto_id, e)
+        foto.stato = FotoAlloggio.STATO_ERRORE
+        foto.errore_elaborazione = str(e)
+    except Exception as e:
+        # Errori inattesi (memoria, storage, database): la foto non deve
+        # restare IN_ELABORAZIONE
+        logger.exception("Errore inatteso nell'elaborazione della foto %s", foto_id)
+        foto.stato = FotoAlloggio.STATO_ERRORE
+        foto.errore_elaborazione = str(e) or e.__class__.__name__
+    else:
+        foto.stato = FotoAlloggio.STATO_PRONTA
+        foto.errore_elaborazione = ''
+
+    try:
+        foto.save(update_fields=[
+            'immagine', 'larghezza_originale', 'altezza_originale', 'larghezza', 'altezza',
+            'segnaposto', 'formati', 'varianti', 'stato', 'errore_elaborazione', 'updated_at',
+        ])
+    except DatabaseError:
+        # Foto eliminata durante l'elaborazione: i file appena salvati non
+        # sono riferiti da nessuno
+        logger.info("Foto %s eliminata durante l'elaborazione", foto_id)
+        rilascia_file_foto(foto)
+
+
+# Durata massima del lock che evita due copie contemporanee della stessa foto
+TIMEOUT_LOCK_COPIA = 60 * 10
+
+
+@shared_task
+def copia_foto_remota(foto_id, forza=False):
+    """
+    Crea o aggiorna in background la copia locale di una foto remota
+    (vedi api.importazione.aggiorna_copia_locale). Una copia già in corso
+    per la stessa foto rende il task un no-op.
+    """
+    lock = f'copia-foto:{foto_id}'
+    if not cache.add(lock, True, TIMEOUT_LOCK_COPIA):
+        return None
+    try:
+        foto = FotoAlloggio.objects.select_related('alloggio').exclude(url='').filter(pk=foto_id).first()
+        return aggiorna_copia_locale(foto, forza) if foto else None
+    finally:
+        cache.delete(lock)
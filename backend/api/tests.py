@@ -1,3 +1,1757 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageFile, JpegImagePlugin
+from rest_framework.test import APITestCase
+
+from .disponibilita import (
+    ORIZZONTE_OCCUPAZIONE,
+    finestre_libere_vicine,
+    notti_libere,
+    verifica_disponibilita,
+)
+from .cache import cache_condivisa
+from .filters import AlloggioFilter, PrenotazioneFilter
+from .immagini import FORMATI_ALTERNATIVI, VARIANTI, formato_preferito, percorsi_foto, prepara_immagine
+from .importazione import TTL_VERIFICA_ERRORE, ErroreDownload, importa_foto, scarica_immagine, verifica_url
+from .models import Alloggio, ContenutoImmagine, FotoAlloggio, Prenotazione
+from .serializers import CaricamentoMultiploSerializer
+from .tasks import TIMEOUT_ELABORAZIONE, copia_foto_remota, elabora_foto
+
+
+def crea_alloggio(nome, **kwargs):
+    """Crea un alloggio di test con valori di default sensati."""
+    dati = {
+        'posizione': 'Roma',
+        'prezzo_notte': Decimal('100.00'),
+        'numero_ospiti_max': 4,
+    }
+    dati.update(kwargs)
+    return Alloggio.objects.create(nome=nome, **dati)
+
+
+def crea_prenotazione(alloggio, check_in, check_out, **kwargs):
+    """Crea una prenotazione di test per l'alloggio indicato."""
+    dati = {
+        'numero_ospiti': 2,
+        'ospite_nome': 'Mario Rossi',
+        'ospite_email': 'mario@example.com',
+    }
+    dati.update(kwargs)
+    return Prenotazione.objects.create(
+        alloggio=alloggio, check_in=check_in, check_out=check_out, **dati
+    )
+
+
+def crea_file_immagine(nome='foto.jpg', dimensioni=(2400, 1600), formato='JPEG', colore=(200, 80, 40)):
+    """Crea un file immagine caricabile, generato in memoria."""
+    output = BytesIO()
+    modalita = 'RGBA' if formato == 'PNG' else 'RGB'
+    Image.new(modalita, dimensioni, colore).save(output, format=formato)
+    return SimpleUploadedFile(nome, output.getvalue(), content_type=f'image/{formato.lower()}')
+
+
+class MediaTemporaneaMixin:
+    """Salva i file caricati dai test in una MEDIA_ROOT temporanea."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        impostazioni = override_settings(MEDIA_ROOT=media_root)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+
+    def carica_foto(self, alloggio, immagine=None, **kwargs):
+        """Crea una foto caricata ed esegue l'elaborazione accodata al commit."""
+        with self.captureOnCommitCallbacks(execute=True):
+            foto = FotoAlloggio.objects.create(
+                alloggio=alloggio, immagine=immagine or crea_file_immagine(), **kwargs
+            )
+        foto.refresh_from_db()
+        return foto
+
+
+class CacheCondivisaMixin:
+    """
+    Fa considerare condivisa la LocMemCache dei test, come Redis in
+    produzione: con un solo processo non c'è differenza.
+    """
+    moduli_cache = ('api.cache', 'api.views', 'api.disponibilita')
+
+    def setUp(self):
+        super().setUp()
+        self.condivisa = [
+            mock.patch(f'{modulo}.cache_condivisa', return_value=True) for modulo in self.moduli_cache
+        ]
+        for patcher in self.condivisa:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def cache_locale(self):
+        """Torna al comportamento reale: cache propria di ogni processo."""
+        for patcher in self.condivisa:
+            patcher.stop()
+
+
+class RicercaAlloggiLiberiTest(APITestCase):
+    """Test della ricerca per periodo su /api/alloggi/."""
+
+    def setUp(self):
+        self.oggi = timezone.now().date()
+        self.check_in = self.oggi + timedelta(days=10)
+        self.check_out = self.oggi + timedelta(days=14)
+
+    def cerca(self, **params):
+        response = self.client.get('/api/alloggi/', params)
+        self.assertEqual(response.status_code, 200)
+        return {a['nome'] for a in response.data['results']}
+
+    def test_esclude_alloggi_occupati_e_troppo_piccoli(self):
+        libero = crea_alloggio('Libero')
+        occupato = crea_alloggio('Occupato')
+        cancellato = crea_alloggio('Cancellato')
+        crea_alloggio('Piccolo', numero_ospiti_max=2)
+        crea_alloggio('Sospeso', disponibile=False)
+
+        crea_prenotazione(occupato, self.check_in + timedelta(days=2), self.check_out + timedelta(days=2))
+        crea_prenotazione(cancellato, self.check_in, self.check_out, stato='CANCELLATA')
+        # Prenotazione adiacente: il check-out coincide con il nuovo check-in
+        crea_prenotazione(libero, self.check_in - timedelta(days=3), self.check_in)
+
+        nomi = self.cerca(check_in=self.check_in, check_out=self.check_out, ospiti=3)
+        self.assertEqual(nomi, {'Libero', 'Cancellato'})
+
+    def test_parametri_non_validi(self):
+        response = self.client.get('/api/alloggi/', {'check_in': self.check_in})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/api/alloggi/', {
+            'check_in': self.check_out, 'check_out': self.check_in,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_numero_query_costante(self):
+        def query_ricerca():
+            with CaptureQueriesContext(connection) as ctx:
+                list(Alloggio.objects.liberi(self.check_in, self.check_out).per_ospiti(2))
+            return len(ctx.captured_queries)
+
+        for i in range(3):
+            alloggio = crea_alloggio(f'Alloggio {i}')
+            crea_prenotazione(alloggio, self.check_in, self.check_out)
+        iniziali = query_ricerca()
+
+        for i in range(3, 30):
+            alloggio = crea_alloggio(f'Alloggio {i}')
+            crea_prenotazione(alloggio, self.check_out, self.check_out + timedelta(days=2))
+
+        self.assertEqual(iniziali, 1)
+        self.assertEqual(query_ricerca(), iniziali)
+
+
+class CalendarioAlloggioTest(APITestCase):
+    """Test del calendario di occupazione /api/alloggi/{id}/calendario/."""
+
+    def setUp(self):
+        self.alloggio = crea_alloggio('Calendario')
+        oggi = timezone.now().date()
+        # Primo giorno di un mese futuro, per avere date sempre valide
+        self.mese = (oggi.replace(day=1) + timedelta(days=63)).replace(day=1)
+
+    def calendario(self, **params):
+        return self.client.get(f'/api/alloggi/{self.alloggio.id}/calendario/', params)
+
+    def test_fonde_intervalli_adiacenti(self):
+        giorno = lambda n: self.mese + timedelta(days=n - 1)
+        crea_prenotazione(self.alloggio, giorno(2), giorno(5))
+        crea_prenotazione(self.alloggio, giorno(5), giorno(7))
+        crea_prenotazione(self.alloggio, giorno(7), giorno(8))
+        crea_prenotazione(self.alloggio, giorno(10), giorno(12), stato='CANCELLATA')
+
+        with self.assertNumQueries(3):
+            response = self.calendario(**{'from': self.mese.strftime('%Y-%m')})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['intervalli_occupati'], [
+            {'check_in': giorno(2), 'check_out': giorno(8)},
+        ])
+        mese = response.data['mesi'][0]
+        self.assertEqual(mese['occupate'][:9], '011111100')
+        self.assertEqual(mese['notti_libere'], mese['giorni'] - 6)
+
+    def test_prenotazione_a_cavallo_di_due_mesi(self):
+        crea_prenotazione(self.alloggio, self.mese - timedelta(days=2), self.mese + timedelta(days=2))
+
+        response = self.calendario(**{
+            'from': self.mese.strftime('%Y-%m'),
+            'to': (self.mese + timedelta(days=40)).strftime('%Y-%m'),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['mesi']), 2)
+        self.assertEqual(response.data['intervalli_occupati'], [
+            {'check_in': self.mese, 'check_out': self.mese + timedelta(days=2)},
+        ])
+        self.assertTrue(response.data['mesi'][0]['occupate'].startswith('110'))
+        self.assertNotIn('1', response.data['mesi'][1]['occupate'])
+
+    def test_parametri_non_validi(self):
+        self.assertEqual(self.calendario(**{'from': '2026-13'}).status_code, 400)
+        self.assertEqual(self.calendario(**{'from': '2026-05', 'to': '2026-04'}).status_code, 400)
+        self.assertEqual(self.calendario(**{'from': '2026-01', 'to': '2028-01'}).status_code, 400)
+
+
+class VincoloSovrapposizioniTest(APITestCase):
+    """Test del vincolo di esclusione sulle prenotazioni sovrapposte."""
+
+    def setUp(self):
+        self.alloggio = crea_alloggio('Vincolo')
+        oggi = timezone.now().date()
+        self.check_in = oggi + timedelta(days=5)
+        self.check_out = oggi + timedelta(days=9)
+        crea_prenotazione(self.alloggio, self.check_in, self.check_out)
+
+    def test_database_rifiuta_sovrapposizioni(self):
+        sovrapposta = Prenotazione(
+            alloggio=self.alloggio,
+            check_in=self.check_in + timedelta(days=1),
+            check_out=self.check_out + timedelta(days=1),
+            numero_ospiti=2, ospite_nome='Anna Bianchi', ospite_email='anna@example.com',
+            numero_notti=4, prezzo_totale=Decimal('400.00'),
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Prenotazione.objects.bulk_create([sovrapposta])
+
+    def test_stati_non_attivi_e_date_adiacenti_ammessi(self):
+        crea_prenotazione(self.alloggio, self.check_in, self.check_out, stato='CANCELLATA')
+        crea_prenotazione(self.alloggio, self.check_out, self.check_out + timedelta(days=2))
+        self.assertEqual(self.alloggio.prenotazioni.count(), 3)
+
+    def test_save_concorrente_diventa_errore_di_validazione(self):
+        # Simula una richiesta concorrente che ha superato la validazione applicativa
+        with mock.patch.object(Prenotazione, 'validate_constraints'):
+            with self.assertRaises(ValidationError) as ctx:
+                crea_prenotazione(self.alloggio, self.check_in, self.check_out)
+        self.assertEqual(ctx.exception.messages, [Prenotazione.MESSAGGIO_SOVRAPPOSIZIONE])
+
+    def test_post_concorrente_ritorna_400(self):
+        with mock.patch.object(Prenotazione, 'check_disponibilita', return_value=True), \
+                mock.patch.object(Prenotazione, 'validate_constraints'):
+            response = self.client.post('/api/prenotazioni/', {
+                'alloggio': self.alloggio.id,
+                'check_in': self.check_in,
+                'check_out': self.check_out,
+                'numero_ospiti': 2,
+                'ospite_nome': 'anna bianchi',
+                'ospite_email': 'anna@example.com',
+            })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Ci sono già prenotazioni confermate in conflitto', str(response.data))
+
+    def test_ricerca_sovrapposizioni_usa_indice_gist(self):
+        queryset = Prenotazione.sovrapposte(self.check_in, self.check_out).filter(alloggio=self.alloggio)
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                piano = queryset.explain()
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('prenotazione_no_sovrapposizioni', piano)
+
+    def test_migrazione_elenca_sovrapposizioni_esistenti(self):
+        migrazione = importlib.import_module('api.migrations.0004_prenotazione_vincoli')
+        with connection.schema_editor() as schema_editor:
+            migrazione.verifica_dati_esistenti(None, schema_editor)
+
+            # Dati scritti prima del vincolo (rimosso solo in questa transazione)
+            schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            schema_editor.execute('ALTER TABLE prenotazioni DROP CONSTRAINT prenotazione_no_sovrapposizioni')
+            sovrapposta = Prenotazione.objects.bulk_create([Prenotazione(
+                alloggio=self.alloggio,
+                check_in=self.check_in + timedelta(days=1),
+                check_out=self.check_out,
+                numero_ospiti=2, ospite_nome='Anna Bianchi', ospite_email='anna@example.com',
+                numero_notti=3, prezzo_totale=Decimal('300.00'),
+            )])[0]
+            with self.assertRaises(RuntimeError) as ctx:
+                migrazione.verifica_dati_esistenti(None, schema_editor)
+        prima = self.alloggio.prenotazioni.exclude(pk=sovrapposta.pk).get()
+        self.assertIn(
+            f'alloggio {self.alloggio.pk}: prenotazioni {prima.pk} e {sovrapposta.pk}', str(ctx.exception)
+        )
+
+
+class BitmapOccupazioneTest(CacheCondivisaMixin, APITestCase):
+    """Test della bitmap di occupazione in cache."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Bitmap')
+        oggi = timezone.localdate()
+        self.check_in = oggi + timedelta(days=20)
+        self.check_out = oggi + timedelta(days=25)
+
+    def test_verifica_in_memoria_dopo_la_prima_costruzione(self):
+        crea_prenotazione(self.alloggio, self.check_in, self.check_out)
+
+        with self.assertNumQueries(1):
+            self.assertFalse(verifica_disponibilita(self.alloggio, self.check_in, self.check_out))
+        with self.assertNumQueries(0):
+            self.assertFalse(verifica_disponibilita(
+                self.alloggio, self.check_out - timedelta(days=1), self.check_out + timedelta(days=3)
+            ))
+            self.assertTrue(verifica_disponibilita(
+                self.alloggio, self.check_out, self.check_out + timedelta(days=3)
+            ))
+
+    def test_invalidazione_su_nuova_prenotazione_e_cambio_stato(self):
+        self.assertTrue(notti_libere(self.alloggio.id, self.check_in, self.check_out))
+
+        prenotazione = crea_prenotazione(self.alloggio, self.check_in, self.check_out)
+        self.assertFalse(notti_libere(self.alloggio.id, self.check_in, self.check_out))
+
+        prenotazione.stato = 'CANCELLATA'
+        prenotazione.save()
+        self.assertTrue(notti_libere(self.alloggio.id, self.check_in, self.check_out))
+
+    def test_fuori_orizzonte_ricade_sul_database(self):
+        lontano = timezone.localdate() + timedelta(days=ORIZZONTE_OCCUPAZIONE + 10)
+        self.assertIsNone(notti_libere(self.alloggio.id, lontano, lontano + timedelta(days=2)))
+        self.assertTrue(verifica_disponibilita(self.alloggio, lontano, lontano + timedelta(days=2)))
+
+    def test_cache_locale_ricade_sul_database(self):
+        self.cache_locale()
+        self.assertFalse(cache_condivisa())
+        self.assertIsNone(notti_libere(self.alloggio.id, self.check_in, self.check_out))
+        # Prenotazione salvata da un altro processo: nessuna bitmap da invalidare qui
+        with mock.patch('api.signals.invalida_occupazione'):
+            crea_prenotazione(self.alloggio, self.check_in, self.check_out)
+        with self.assertNumQueries(1):
+            self.assertFalse(verifica_disponibilita(self.alloggio, self.check_in, self.check_out))
+
+
+class DisponibilitaBatchTest(APITestCase):
+    """Test del preventivo multiplo /api/disponibilita/batch/."""
+
+    def setUp(self):
+        oggi = timezone.now().date()
+        self.check_in = oggi + timedelta(days=30)
+        self.check_out = oggi + timedelta(days=33)
+
+    def richieste(self, alloggi):
+        return [
+            {'alloggio_id': a.id, 'check_in': str(self.check_in), 'check_out': str(self.check_out)}
+            for a in alloggi
+        ]
+
+    def test_disponibilita_e_prezzo_per_ogni_richiesta(self):
+        libero = crea_alloggio('Libero', prezzo_notte=Decimal('80.00'))
+        occupato = crea_alloggio('Occupato')
+        crea_prenotazione(occupato, self.check_in + timedelta(days=1), self.check_out)
+
+        richieste = self.richieste([libero, occupato])
+        richieste.append({'alloggio_id': 999999, 'check_in': str(self.check_in), 'check_out': str(self.check_out)})
+        response = self.client.post('/api/disponibilita/batch/', richieste, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        risultati = response.data['risultati']
+        self.assertTrue(risultati[0]['disponibile'])
+        self.assertEqual(risultati[0]['prezzo_totale'], Decimal('240.00'))
+        self.assertFalse(risultati[1]['disponibile'])
+        self.assertFalse(risultati[2]['disponibile'])
+        self.assertIn('errore', risultati[2])
+
+    def test_numero_query_costante(self):
+        alloggi = [crea_alloggio(f'Batch {i}') for i in range(25)]
+        for alloggio in alloggi[::2]:
+            crea_prenotazione(alloggio, self.check_in, self.check_out)
+
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/disponibilita/batch/', self.richieste(alloggi[:3]), format='json')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/disponibilita/batch/', self.richieste(alloggi), format='json')
+        self.assertEqual(
+            [r['disponibile'] for r in response.data['risultati']],
+            [i % 2 == 1 for i in range(25)],
+        )
+
+    def test_richieste_non_valide(self):
+        response = self.client.post('/api/disponibilita/batch/', [], format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/disponibilita/batch/', [
+            {'alloggio_id': 1, 'check_in': str(self.check_out), 'check_out': str(self.check_in)},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DisponibilitaAlloggioTest(APITestCase):
+    """Test dell'action /api/alloggi/{id}/disponibilita/."""
+
+    def setUp(self):
+        self.alloggio = crea_alloggio('Preventivo', prezzo_notte=Decimal('90.00'))
+        oggi = timezone.now().date()
+        self.check_in = oggi + timedelta(days=40)
+        self.check_out = oggi + timedelta(days=43)
+
+    def disponibilita(self, **params):
+        return self.client.get(f'/api/alloggi/{self.alloggio.id}/disponibilita/', params)
+
+    def test_preventivo_in_una_sola_query(self):
+        with self.assertNumQueries(1):
+            response = self.disponibilita(check_in=self.check_in, check_out=self.check_out)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['disponibile'])
+        self.assertEqual(response.data['periodo']['numero_notti'], 3)
+        self.assertEqual(response.data['calcolo']['prezzo_totale'], Decimal('270.00'))
+        self.assertIn('max-age=', response['Cache-Control'])
+
+    def test_alloggio_occupato(self):
+        crea_prenotazione(self.alloggio, self.check_in - timedelta(days=1), self.check_in + timedelta(days=1))
+        response = self.disponibilita(check_in=self.check_in, check_out=self.check_out)
+        self.assertFalse(response.data['disponibile'])
+
+    def test_errori(self):
+        self.assertEqual(self.disponibilita(check_in=self.check_in).status_code, 400)
+        response = self.client.get('/api/alloggi/999999/disponibilita/', {
+            'check_in': self.check_in, 'check_out': self.check_out,
+        })
+        self.assertEqual(response.status_code, 404)
+
+
+class SuggerimentiTest(APITestCase):
+    """Test dei suggerimenti quando le date richieste non sono disponibili."""
+
+    def setUp(self):
+        self.oggi = timezone.localdate()
+        self.alloggio = crea_alloggio('Richiesto', prezzo_notte=Decimal('100.00'))
+        self.giorno = lambda n: self.oggi + timedelta(days=n)
+
+    def test_finestre_libere_prima_e_dopo(self):
+        # Occupato dal giorno 10 al 14 e dal 16 al 20: il buco 14-16 è troppo corto
+        crea_prenotazione(self.alloggio, self.giorno(10), self.giorno(14))
+        crea_prenotazione(self.alloggio, self.giorno(16), self.giorno(20))
+        crea_prenotazione(self.alloggio, self.giorno(5), self.giorno(8), stato='RIFIUTATA')
+
+        with self.assertNumQueries(1):
+            prima, dopo = finestre_libere_vicine(self.alloggio, self.giorno(12), self.giorno(15))
+
+        self.assertEqual(prima, (self.giorno(7), self.giorno(10)))
+        self.assertEqual(dopo, (self.giorno(20), self.giorno(23)))
+
+    def test_finestra_precedente_non_nel_passato(self):
+        crea_prenotazione(self.alloggio, self.giorno(1), self.giorno(30))
+        prima, dopo = finestre_libere_vicine(self.alloggio, self.giorno(2), self.giorno(6))
+        self.assertIsNone(prima)
+        self.assertEqual(dopo, (self.giorno(30), self.giorno(34)))
+
+    def test_risposta_con_alloggi_alternativi(self):
+        simile = crea_alloggio('Simile', prezzo_notte=Decimal('110.00'))
+        crea_alloggio('Troppo caro', prezzo_notte=Decimal('300.00'))
+        crea_alloggio('Troppo piccolo', prezzo_notte=Decimal('100.00'), numero_ospiti_max=2)
+        crea_prenotazione(self.alloggio, self.giorno(10), self.giorno(14))
+
+        response = self.client.get(f'/api/alloggi/{self.alloggio.id}/disponibilita/', {
+            'check_in': self.giorno(11), 'check_out': self.giorno(13),
+        })
+
+        self.assertFalse(response.data['disponibile'])
+        suggerimenti = response.data['suggerimenti']
+        self.assertEqual(suggerimenti['date_successive']['check_in'], self.giorno(14))
+        self.assertEqual([a['id'] for a in suggerimenti['alloggi_alternativi']], [simile.id])
+        self.assertEqual(suggerimenti['alloggi_alternativi'][0]['prezzo_totale'], Decimal('220.00'))
+
+
+class ListaAlloggiQueryTest(CacheCondivisaMixin, APITestCase):
+    """Test del numero di query della lista alloggi."""
+
+    def crea_catalogo(self, numero, inizio=0):
+        for i in range(inizio, inizio + numero):
+            alloggio = crea_alloggio(f'Catalogo {i:02d}')
+            for ordine in (2, 0, 1):
+                FotoAlloggio.objects.create(
+                    alloggio=alloggio, url=f'https://example.com/{i}/{ordine}.jpg', ordine=ordine
+                )
+
+    def test_budget_query_fisso_per_pagina(self):
+        self.crea_catalogo(3)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/alloggi/')
+        self.assertEqual(len(response.data['results']), 3)
+
+        self.crea_catalogo(20, inizio=3)
+        # COUNT per la paginazione, pagina di alloggi, prefetch delle foto
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/alloggi/')
+        self.assertEqual(len(response.data['results']), 20)
+
+        primo = response.data['results'][0]
+        self.assertEqual(primo['numero_foto'], 3)
+        self.assertEqual(primo['immagine_principale'], 'https://example.com/0/0.jpg')
+
+    def test_foto_principale_cercata_una_volta_per_alloggio(self):
+        self.crea_catalogo(4)
+        originale = Alloggio.get_foto_principale
+        with mock.patch.object(Alloggio, 'get_foto_principale', autospec=True, side_effect=originale) as cerca:
+            response = self.client.get('/api/alloggi/')
+        self.assertEqual(cerca.call_count, 4)
+        self.assertEqual(
+            [r['immagine_principale'] for r in response.data['results']],
+            [f'https://example.com/{i}/0.jpg' for i in range(4)],
+        )
+
+
+class CacheCatalogoTest(CacheCondivisaMixin, APITestCase):
+    """Test della cache versionata delle risposte del catalogo."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('In cache')
+
+    def test_hit_senza_query(self):
+        prima = self.client.get('/api/alloggi/')
+        with self.assertNumQueries(0):
+            seconda = self.client.get('/api/alloggi/')
+        self.assertEqual(prima.content, seconda.content)
+
+        self.client.get(f'/api/alloggi/{self.alloggio.id}/')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/alloggi/{self.alloggio.id}/')
+        self.assertEqual(response.json()['nome'], 'In cache')
+
+    def test_modifiche_a_catalogo_e_foto_invalidano(self):
+        self.client.get('/api/alloggi/')
+
+        # Come un salvataggio da list_editable dell'admin
+        self.alloggio.prezzo_notte = Decimal('150.00')
+        self.alloggio.save()
+        response = self.client.get('/api/alloggi/')
+        self.assertEqual(response.json()['results'][0]['prezzo_notte'], '150.00')
+
+        FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/nuova.jpg')
+        response = self.client.get('/api/alloggi/')
+        self.assertEqual(response.json()['results'][0]['numero_foto'], 1)
+
+    def test_cache_locale_non_usata(self):
+        self.cache_locale()
+        self.client.get('/api/alloggi/')
+        # update() non invia segnali: come una modifica gestita da un altro
+        # worker, la versione del catalogo di questo processo non cambia
+        Alloggio.objects.filter(pk=self.alloggio.pk).update(nome='Rinominato')
+        self.assertEqual(self.client.get('/api/alloggi/').json()['results'][0]['nome'], 'Rinominato')
+
+    def test_ricerca_per_periodo_non_in_cache(self):
+        check_in = timezone.now().date() + timedelta(days=10)
+        params = {'check_in': check_in, 'check_out': check_in + timedelta(days=2)}
+        self.assertEqual(self.client.get('/api/alloggi/', params).json()['count'], 1)
+
+        crea_prenotazione(self.alloggio, params['check_in'], params['check_out'])
+        self.assertEqual(self.client.get('/api/alloggi/', params).json()['count'], 0)
+
+
+class GetCondizionaleTest(CacheCondivisaMixin, APITestCase):
+    """Test di ETag, Last-Modified e risposte 304."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Condizionale')
+        check_in = timezone.now().date() + timedelta(days=10)
+        self.prenotazione = crea_prenotazione(self.alloggio, check_in, check_in + timedelta(days=2))
+
+    def test_catalogo_304_senza_query(self):
+        response = self.client.get('/api/alloggi/')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/alloggi/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response['ETag']
+        FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/foto.jpg')
+        response = self.client.get('/api/alloggi/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_catalogo_con_cache_locale_validato_sul_database(self):
+        self.cache_locale()
+        url = f'/api/alloggi/{self.alloggio.pk}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # update() non invia segnali: come una modifica gestita da un altro worker
+        Alloggio.objects.filter(pk=self.alloggio.pk).update(nome='Rinominato', updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['nome'], 'Rinominato')
+
+        etag = response['ETag']
+        FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/foto.jpg')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_prenotazioni_304_con_una_query(self):
+        url = '/api/prenotazioni/?paginazione=pagine'
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Pagine diverse hanno validatori diversi
+        self.assertNotEqual(self.client.get(url + '&stato=PENDENTE')['ETag'], etag)
+
+        self.prenotazione.note_interne = 'Arrivo in tarda serata'
+        self.prenotazione.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_modifiche_alle_righe_collegate_cambiano_etag(self):
+        url = f'/api/prenotazioni/{self.prenotazione.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.alloggio.nome = 'Condizionale rinnovato'
+        self.alloggio.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['alloggio_dettagli']['nome'], 'Condizionale rinnovato')
+
+        etag = response['ETag']
+        foto = FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/foto.jpg')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        foto.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_prenotazioni_non_conservate_dalle_cache_condivise(self):
+        response = self.client.get(f'/api/prenotazioni/{self.prenotazione.id}/')
+        self.assertEqual(set(response['Cache-Control'].replace(' ', '').split(',')), {'private', 'no-cache'})
+        with CaptureQueriesContext(connection) as query:
+            self.client.get('/api/prenotazioni/?paginazione=pagine')
+        self.assertNotIn('foto_alloggi', query.captured_queries[0]['sql'])
+        self.assertEqual(self.client.get('/api/alloggi/')['Cache-Control'], 'no-cache')
+
+    def test_dettaglio_if_modified_since(self):
+        url = f'/api/prenotazioni/{self.prenotazione.id}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+
+class PaginazioneCursoreTest(APITestCase):
+    """Test della paginazione keyset di /api/prenotazioni/."""
+
+    def setUp(self):
+        oggi = timezone.now().date()
+        alloggio = crea_alloggio('Storico')
+        self.prenotazioni = [
+            crea_prenotazione(alloggio, oggi + timedelta(days=2 * i + 1), oggi + timedelta(days=2 * i + 2))
+            for i in range(7)
+        ]
+
+    def test_scorre_tutte_le_pagine_senza_count(self):
+        url = '/api/prenotazioni/?page_size=3'
+        visti = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+            visti.extend(p['id'] for p in response.data['results']['results'])
+            url = response.data['next']
+
+        attesi = [p.id for p in sorted(self.prenotazioni, key=lambda p: (-p.created_at.timestamp(), p.id))]
+        self.assertEqual(visti, attesi)
+
+    def test_paginazione_a_pagine_su_richiesta(self):
+        response = self.client.get('/api/prenotazioni/', {'paginazione': 'pagine'})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(response.data['results']['current_page'], 1)
+
+        response = self.client.get('/api/prenotazioni/', {'page': 1})
+        self.assertEqual(response.data['results']['num_pages'], 1)
+
+    def test_ordinamento_servito_dall_indice(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                piano = Prenotazione.objects.order_by('-created_at', 'id')[:20].explain()
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('prenotazione_created_id_idx', piano)
+
+
+class RicercaOspiteTest(APITestCase):
+    """Test della ricerca per ospite su /api/prenotazioni/."""
+
+    def setUp(self):
+        oggi = timezone.now().date()
+        self.villa = crea_alloggio('Villa Aurora')
+        baita = crea_alloggio('Baita Alpina')
+        ospiti = [
+            ('Mario Rossi', 'mario.rossi@example.com'),
+            ('Maria Rossetti', 'm.rossetti@example.com'),
+            ('Giulia Bianchi', 'giulia@esempio.it'),
+        ]
+        for i, (nome, email) in enumerate(ospiti):
+            crea_prenotazione(
+                baita, oggi + timedelta(days=2 * i + 1), oggi + timedelta(days=2 * i + 2),
+                ospite_nome=nome, ospite_email=email,
+            )
+        crea_prenotazione(
+            self.villa, oggi + timedelta(days=1), oggi + timedelta(days=3),
+            ospite_nome='Luca Verdi', ospite_email='luca@example.com',
+        )
+
+    def nomi(self, **params):
+        response = self.client.get('/api/prenotazioni/', params)
+        self.assertEqual(response.status_code, 200)
+        return [p['ospite_nome'] for p in response.data['results']['results']]
+
+    def test_contenimento_su_nome_ed_email(self):
+        self.assertCountEqual(self.nomi(ospite='ROSS'), ['Mario Rossi', 'Maria Rossetti'])
+        self.assertEqual(self.nomi(ospite='esempio'), ['Giulia Bianchi'])
+
+    def test_similarita_ordinata_e_tollerante_ai_refusi(self):
+        risultati = self.nomi(ospite='mario rosi', modalita='simile')
+        self.assertEqual(risultati[0], 'Mario Rossi')
+        self.assertNotIn('Giulia Bianchi', risultati)
+
+    def test_search_su_ospite_e_alloggio(self):
+        self.assertEqual(self.nomi(search='aurora'), ['Luca Verdi'])
+        self.assertEqual(self.nomi(search='giulia'), ['Giulia Bianchi'])
+        self.assertEqual(self.nomi(search='rossi mario'), ['Mario Rossi'])
+
+    def test_ricerca_servita_dagli_indici_trigram(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                piano = Prenotazione.objects.cerca_ospite('ross').order_by().explain()
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('prenotazione_nome_trgm_idx', piano)
+        self.assertIn('prenotazione_email_trgm_idx', piano)
+
+
+class RicercaTestoAlloggiTest(APITestCase):
+    """Test della ricerca full-text ?q= su /api/alloggi/."""
+
+    def setUp(self):
+        cache.clear()
+        crea_alloggio(
+            'Villa sul Lago', posizione='Como',
+            descrizione='Casa indipendente con giardino.', servizi=['Wi-Fi', 'Piscina'],
+        )
+        crea_alloggio(
+            'Appartamento Centro', posizione='Milano',
+            descrizione='Vicino alla villa comunale e ai negozi.',
+        )
+        crea_alloggio('Baita Alpina', posizione='Cortina', descrizione='Camino e sauna.')
+
+    def cerca(self, testo):
+        response = self.client.get('/api/alloggi/', {'q': testo})
+        self.assertEqual(response.status_code, 200)
+        return [a['nome'] for a in response.data['results']]
+
+    def test_stemming_italiano_e_servizi(self):
+        self.assertEqual(self.cerca('piscine'), ['Villa sul Lago'])
+        self.assertEqual(self.cerca('negozio milano'), ['Appartamento Centro'])
+        self.assertEqual(self.cerca('sauna -cortina'), [])
+
+    def test_ordine_per_rilevanza(self):
+        # La corrispondenza nel nome pesa più di quella nella descrizione
+        self.assertEqual(self.cerca('villa'), ['Villa sul Lago', 'Appartamento Centro'])
+
+    def test_vettore_aggiornato_dal_trigger(self):
+        baita = Alloggio.objects.get(nome='Baita Alpina')
+        baita.servizi = ['Parcheggio']
+        baita.save()
+        self.assertEqual(self.cerca('parcheggio'), ['Baita Alpina'])
+
+        Alloggio.objects.filter(pk=baita.pk).update(descrizione='Vista sulle Dolomiti')
+        self.assertEqual(
+            list(Alloggio.objects.cerca('dolomiti').values_list('nome', flat=True)),
+            ['Baita Alpina'],
+        )
+
+    def test_ricerca_servita_dall_indice_gin(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                piano = Alloggio.objects.cerca('villa').explain()
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('alloggio_ricerca_idx', piano)
+
+
+class FiltroServiziTest(APITestCase):
+    """Test del filtro ?servizi= e delle facette su /api/alloggi/."""
+
+    def setUp(self):
+        cache.clear()
+        crea_alloggio('Villa', servizi=['Wi-Fi', 'Piscina', 'Parcheggio'])
+        crea_alloggio('Loft', servizi=['Wi-Fi', 'Parcheggio'])
+        crea_alloggio('Rifugio', servizi=['Camino'])
+
+    def test_contenimento_di_tutti_i_servizi(self):
+        response = self.client.get('/api/alloggi/', {'servizi': 'Wi-Fi, Piscina'})
+        self.assertEqual([a['nome'] for a in response.data['results']], ['Villa'])
+
+        response = self.client.get('/api/alloggi/', {'servizi': 'Parcheggio'})
+        self.assertEqual([a['nome'] for a in response.data['results']], ['Loft', 'Villa'])
+
+    def test_facette_in_una_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/alloggi/', {'servizi': 'Wi-Fi', 'facette': 'true'})
+        self.assertEqual(
+            response.data['facette_servizi'],
+            {'Parcheggio': 2, 'Wi-Fi': 2, 'Piscina': 1},
+        )
+        self.assertEqual(sum('jsonb_array_elements_text' in q['sql'] for q in ctx.captured_queries), 1)
+        self.assertNotIn('facette_servizi', self.client.get('/api/alloggi/').data)
+
+    def test_filtro_servito_dall_indice_gin(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                piano = Alloggio.objects.con_servizi(['Wi-Fi']).order_by().explain()
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertIn('alloggio_servizi_idx', piano)
+
+
+class FiltriDichiarativiTest(APITestCase):
+    """Test dei FilterSet di alloggi e prenotazioni."""
+
+    def setUp(self):
+        cache.clear()
+        self.oggi = timezone.now().date()
+        self.economico = crea_alloggio('Economico', prezzo_notte=Decimal('60.00'), numero_ospiti_max=2)
+        self.grande = crea_alloggio(
+            'Grande', prezzo_notte=Decimal('180.00'), numero_ospiti_max=8,
+            numero_camere=4, numero_bagni=2,
+        )
+        crea_prenotazione(self.economico, self.oggi + timedelta(days=5), self.oggi + timedelta(days=7))
+        crea_prenotazione(
+            self.grande, self.oggi + timedelta(days=20), self.oggi + timedelta(days=25),
+            stato='CONFERMATA', ospite_nome='Anna Neri',
+        )
+
+    def test_filtri_alloggi(self):
+        def nomi(**params):
+            response = self.client.get('/api/alloggi/', params)
+            self.assertEqual(response.status_code, 200)
+            return [a['nome'] for a in response.data['results']]
+
+        self.assertEqual(nomi(prezzo_max=100), ['Economico'])
+        self.assertEqual(nomi(prezzo_min=100, ospiti=6, camere_min=3, bagni_min=2), ['Grande'])
+        self.assertEqual(nomi(ordering='-prezzo_notte'), ['Grande', 'Economico'])
+        self.assertEqual(self.client.get('/api/alloggi/', {'ospiti': 50}).status_code, 400)
+
+    def test_filtro_disponibile_accetta_i_valori_di_prima(self):
+        crea_alloggio('Sospeso', disponibile=False)
+
+        def nomi(valore):
+            response = self.client.get('/api/alloggi/', {'disponibile': valore})
+            self.assertEqual(response.status_code, 200)
+            return sorted(a['nome'] for a in response.data['results'])
+
+        self.assertEqual(nomi('true'), ['Economico', 'Grande'])
+        self.assertEqual(nomi('TRUE'), ['Economico', 'Grande'])
+        # Ogni valore diverso da 'true' indica gli alloggi non disponibili
+        for valore in ('false', '1', 'si', 'qualsiasi'):
+            self.assertEqual(nomi(valore), ['Sospeso'])
+
+    def test_filtri_prenotazioni(self):
+        def ospiti(**params):
+            params['paginazione'] = 'pagine'
+            response = self.client.get('/api/prenotazioni/', params)
+            self.assertEqual(response.status_code, 200)
+            return [p['ospite_nome'] for p in response.data['results']['results']]
+
+        self.assertEqual(ospiti(stato='CONFERMATA'), ['Anna Neri'])
+        self.assertCountEqual(ospiti(stato='PENDENTE,CONFERMATA'), ['Mario Rossi', 'Anna Neri'])
+        self.assertEqual(ospiti(data_da=self.oggi + timedelta(days=10)), ['Anna Neri'])
+        self.assertEqual(ospiti(alloggio=self.economico.pk, data_a=self.oggi + timedelta(days=7)), ['Mario Rossi'])
+        self.assertEqual(ospiti(ordering='check_in'), ['Mario Rossi', 'Anna Neri'])
+
+    def test_combinazioni_comuni_senza_scansione_sequenziale(self):
+        combinazioni = [
+            (AlloggioFilter, {'prezzo_min': '50', 'prezzo_max': '150'}),
+            (AlloggioFilter, {'prezzo_max': '150', 'ospiti': '4'}),
+            (AlloggioFilter, {'ospiti': '4', 'camere_min': '2', 'bagni_min': '1'}),
+            (PrenotazioneFilter, {'stato': 'CONFERMATA'}),
+            (PrenotazioneFilter, {'stato': 'PENDENTE,CONFERMATA', 'data_da': str(self.oggi)}),
+            (PrenotazioneFilter, {'alloggio': str(self.grande.pk), 'stato': 'CONFERMATA'}),
+            (PrenotazioneFilter, {'data_da': str(self.oggi), 'data_a': str(self.oggi + timedelta(days=30))}),
+            (PrenotazioneFilter, {'ospite': 'ross'}),
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                for filterset_class, params in combinazioni:
+                    filterset = filterset_class(params, queryset=filterset_class.Meta.model.objects.all())
+                    self.assertTrue(filterset.is_valid(), filterset.errors)
+                    piano = filterset.qs.order_by().explain()
+                    with self.subTest(params=params):
+                        self.assertNotIn('Seq Scan', piano)
+            finally:
+                cursor.execute('RESET enable_seqscan')
+
+
+class VariantiFotoTest(MediaTemporaneaMixin, APITestCase):
+    """Test delle varianti ridimensionate delle foto."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Con foto')
+
+    def test_varianti_generate_al_caricamento(self):
+        foto = self.carica_foto(self.alloggio)
+
+        foto.refresh_from_db()
+        self.assertEqual(set(foto.varianti), {'300x200', '800w', '1920w'})
+        dimensioni = {nome: (info['larghezza'], info['altezza']) for nome, info in foto.varianti.items()}
+        self.assertEqual(dimensioni['300x200'], (300, 200))
+        self.assertEqual(dimensioni['800w'], (800, 533))
+        for nome in foto.varianti:
+            self.assertTrue(default_storage.exists(foto.percorsi_formati(nome)['jpeg']))
+        # L'immagine principale è già ridotta a 1620x1080: la 1920w coincide
+        # con essa e non ha un file proprio
+        self.assertEqual(foto.varianti['1920w'], {'principale': True, 'larghezza': 1620, 'altezza': 1080})
+        self.assertEqual(foto.url_variante('1920w'), foto.immagine.url)
+
+        dati = self.client.get('/api/alloggi/').data['results'][0]
+        self.assertTrue(dati['miniatura'].endswith(foto.url_variante('300x200')))
+        self.assertEqual(dati['srcset'], (
+            f"http://testserver{foto.url_variante('800w')} 800w, "
+            f"http://testserver{foto.immagine.url} 1620w"
+        ))
+
+    def test_srcset_con_larghezze_reali(self):
+        foto = self.carica_foto(self.alloggio, immagine=crea_file_immagine(dimensioni=(700, 500)))
+        self.assertTrue(all(info.get('principale') for nome, info in foto.varianti.items() if nome != '300x200'))
+        self.assertEqual(
+            self.client.get('/api/alloggi/').data['results'][0]['srcset'],
+            f"http://testserver{foto.immagine.url} 700w",
+        )
+
+        # Varianti non ancora generate: descrittore dalla larghezza della foto
+        FotoAlloggio.objects.filter(pk=foto.pk).update(varianti={})
+        srcset = self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]['srcset']
+        self.assertEqual(srcset, f'http://testserver/api/fotoalloggi/{foto.pk}/varianti/800w/ 700w')
+
+    def test_generazione_al_primo_accesso(self):
+        foto = self.carica_foto(self.alloggio)
+        FotoAlloggio.objects.filter(pk=foto.pk).update(varianti={})
+
+        dati = self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]
+        self.assertTrue(dati['miniatura_url'].endswith(f'/api/fotoalloggi/{foto.pk}/varianti/300x200/'))
+
+        response = self.client.get(dati['miniatura_url'])
+        self.assertEqual(response.status_code, 302)
+        foto.refresh_from_db()
+        self.assertEqual(list(foto.varianti), ['300x200'])
+        self.assertEqual(response['Location'], foto.url_variante('300x200'))
+        self.assertEqual(self.client.get(f'/api/fotoalloggi/{foto.pk}/varianti/99x99/').status_code, 404)
+
+    def test_foto_remote_senza_varianti(self):
+        foto = FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/a.jpg')
+        self.assertEqual(foto.get_thumbnail_url(), 'https://example.com/a.jpg')
+        dati = self.client.get('/api/alloggi/').data['results'][0]
+        self.assertEqual(dati['miniatura'], 'https://example.com/a.jpg')
+        self.assertEqual(dati['srcset'], '')
+
+
+class FormatiImmaginiTest(MediaTemporaneaMixin, APITestCase):
+    """Test dei formati WebP/AVIF e della negoziazione sull'Accept."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Formati')
+        self.foto = self.carica_foto(self.alloggio)
+        self.url = f'/api/fotoalloggi/{self.foto.pk}/varianti'
+
+    def test_formati_alternativi_generati_al_caricamento(self):
+        self.assertIn('webp', FORMATI_ALTERNATIVI)
+        self.foto.refresh_from_db()
+        self.assertEqual(set(self.foto.formati), set(FORMATI_ALTERNATIVI))
+        for nome in ('300x200', '800w', '1920w'):
+            for percorso in self.foto.percorsi_formati(nome).values():
+                self.assertTrue(default_storage.exists(percorso))
+
+        sorgenti = self.client.get('/api/alloggi/').data['results'][0]['sorgenti']
+        webp = next(s for s in sorgenti if s['type'] == 'image/webp')
+        self.assertRegex(webp['srcset'], r'\.webp 800w, \S+\.webp 1620w$')
+        self.assertTrue(webp['srcset'].endswith(f"{self.foto.percorsi_formati('1920w')['webp']} 1620w"))
+        self.assertTrue(webp['miniatura'].endswith(self.foto.percorsi_formati('300x200')['webp']))
+
+    def test_negoziazione_sull_accept(self):
+        percorsi = self.foto.percorsi_formati('800w')
+        response = self.client.get(f'{self.url}/800w/', HTTP_ACCEPT='image/avif,image/webp,*/*;q=0.8')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(percorsi[FORMATI_ALTERNATIVI[0]]))
+        self.assertIn('Accept', response['Vary'])
+
+        self.assertTrue(self.client.get(f'{self.url}/800w/')['Location'].endswith(percorsi['jpeg']))
+        self.assertTrue(self.client.get(f'{self.url}/originale/', HTTP_ACCEPT='image/webp')['Location'].endswith('.webp'))
+
+    @override_settings(IMMAGINI_X_ACCEL_PREFIX='/media-negoziata/')
+    def test_consegna_tramite_nginx(self):
+        response = self.client.get(f'{self.url}/300x200/', HTTP_ACCEPT='image/webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/media-negoziata/' + self.foto.percorsi_formati('300x200')['webp'],
+        )
+
+    def test_formati_mancanti_generati_al_primo_accesso(self):
+        # Foto caricata prima dei formati alternativi
+        percorsi = list(self.foto.formati.values())
+        for info in self.foto.varianti.values():
+            percorsi.extend(info.get('formati', {}).values())
+        with self.captureOnCommitCallbacks(execute=True):
+            ContenutoImmagine.objects.rilascia(percorsi)
+        varianti = {
+            nome: info if info.get('principale') else {**info, 'formati': {}}
+            for nome, info in self.foto.varianti.items()
+        }
+        FotoAlloggio.objects.filter(pk=self.foto.pk).update(varianti=varianti, formati={})
+
+        self.assertEqual(self.client.get('/api/alloggi/').data['results'][0]['sorgenti'], [])
+        response = self.client.get(f'{self.url}/800w/', HTTP_ACCEPT='image/webp')
+        self.foto.refresh_from_db()
+        self.assertTrue(response['Location'].endswith(self.foto.percorsi_formati('800w')['webp']))
+        self.assertTrue(default_storage.exists(self.foto.percorsi_formati('800w')['webp']))
+        self.assertEqual(self.foto.varianti['300x200']['formati'], {})
+
+    def test_formato_preferito(self):
+        self.assertEqual(formato_preferito('image/webp,image/*', {'jpeg', 'webp'}), 'webp')
+        self.assertEqual(formato_preferito('image/webp;q=0, image/*', {'jpeg', 'webp'}), 'jpeg')
+        self.assertEqual(formato_preferito('image/webp', {'jpeg'}), 'jpeg')
+        self.assertEqual(formato_preferito(None, {'jpeg', 'webp'}), 'jpeg')
+
+
+class ElaborazioneAsincronaTest(MediaTemporaneaMixin, APITestCase):
+    """Test dell'elaborazione in background delle foto caricate."""
+
+    def setUp(self):
+        super().setUp()
+        self.alloggio = crea_alloggio('Asincrono')
+        self.client.force_authenticate(get_user_model().objects.create_user('staff'))
+
+    def carica(self, **kwargs):
+        return self.client.post('/api/fotoalloggi/', {
+            'alloggio': self.alloggio.pk,
+            'immagine': crea_file_immagine('salotto.png', formato='PNG'),
+            **kwargs,
+        }, format='multipart')
+
+    def test_upload_risponde_202_e_elabora_al_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.carica()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['stato'], 'IN_ATTESA')
+        foto = FotoAlloggio.objects.get(pk=response.data['id'])
+        self.assertTrue(foto.immagine.name.endswith('.png'))
+        self.assertEqual(self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]['srcset'], '')
+
+        for callback in callbacks:
+            callback()
+        dettaglio = self.client.get(response['Location']).data
+        self.assertEqual(dettaglio['stato'], 'PRONTA')
+        self.assertTrue(dettaglio['immagine'].endswith('.jpg'))
+        self.assertEqual((dettaglio['larghezza_originale'], dettaglio['altezza_originale']), (2400, 1600))
+        self.assertFalse(default_storage.exists(foto.immagine.name))
+        self.assertNotEqual(self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]['srcset'], '')
+
+    def test_errore_di_elaborazione_registrato(self):
+        with mock.patch('api.tasks.elabora_immagine', side_effect=OSError('file troncato')):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.carica()
+        dettaglio = self.client.get(response['Location']).data
+        self.assertEqual(dettaglio['stato'], 'ERRORE')
+        self.assertEqual(dettaglio['errore_elaborazione'], 'file troncato')
+
+    def test_errore_inatteso_registrato(self):
+        with mock.patch('api.tasks.elabora_immagine', side_effect=RuntimeError('storage non raggiungibile')):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.carica()
+        foto = FotoAlloggio.objects.get(pk=response.data['id'])
+        self.assertEqual((foto.stato, foto.errore_elaborazione), ('ERRORE', 'storage non raggiungibile'))
+
+    def test_task_riconsegnato_dopo_crash_del_worker(self):
+        with self.captureOnCommitCallbacks():
+            foto = FotoAlloggio.objects.create(alloggio=self.alloggio, immagine=crea_file_immagine())
+        # Il worker muore a metà elaborazione, senza confermare il task
+        with mock.patch('api.tasks.elabora_immagine', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                elabora_foto(foto.pk)
+        foto.refresh_from_db()
+        self.assertEqual(foto.stato, 'IN_ELABORAZIONE')
+
+        # Riconsegna prima del timeout: l'elaborazione potrebbe essere ancora in corso
+        elabora_foto(foto.pk)
+        foto.refresh_from_db()
+        self.assertEqual(foto.stato, 'IN_ELABORAZIONE')
+
+        FotoAlloggio.objects.filter(pk=foto.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=TIMEOUT_ELABORAZIONE + 1)
+        )
+        elabora_foto(foto.pk)
+        foto.refresh_from_db()
+        self.assertEqual(foto.stato, 'PRONTA')
+        self.assertTrue(default_storage.exists(foto.immagine.name))
+
+    def test_immagine_sostituita_rielaborata(self):
+        foto = self.carica_foto(self.alloggio)
+        precedenti = [foto.immagine.name, *percorsi_foto(foto)]
+        segnaposto = foto.segnaposto
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.patch(f'/api/fotoalloggi/{foto.pk}/', {
+                'immagine': crea_file_immagine('nuova.jpg', dimensioni=(1200, 1600), colore=(10, 120, 200)),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        foto.refresh_from_db()
+        self.assertEqual((foto.stato, foto.varianti, foto.formati, foto.segnaposto), ('IN_ATTESA', {}, {}, ''))
+        self.assertEqual(self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]['srcset'], '')
+
+        for callback in callbacks:
+            callback()
+        foto.refresh_from_db()
+        self.assertEqual(foto.stato, 'PRONTA')
+        self.assertEqual((foto.larghezza, foto.altezza), (810, 1080))
+        self.assertNotEqual(foto.segnaposto, segnaposto)
+        # I file della foto precedente sono rilasciati
+        self.assertFalse(ContenutoImmagine.objects.filter(percorso__in=precedenti).exists())
+        for percorso in precedenti:
+            self.assertFalse(default_storage.exists(percorso))
+
+    def test_task_idempotente(self):
+        foto = self.carica_foto(self.alloggio)
+        immagine = foto.immagine.name
+        elabora_foto(foto.pk)
+        foto.refresh_from_db()
+        self.assertEqual((foto.stato, foto.immagine.name), ('PRONTA', immagine))
+
+
+class DecodificaRidottaTest(MediaTemporaneaMixin, APITestCase):
+    """Test della decodifica a memoria limitata delle immagini caricate."""
+
+    def setUp(self):
+        super().setUp()
+        self.alloggio = crea_alloggio('Decodifica')
+        self.client.force_authenticate(get_user_model().objects.create_user('staff'))
+
+    def test_jpeg_decodificato_in_draft(self):
+        riquadri = []
+        draft = JpegImagePlugin.JpegImageFile.draft
+
+        def registra_draft(img, *args):
+            risultato = draft(img, *args)
+            riquadri.append(risultato and risultato[1])
+            return risultato
+
+        with mock.patch.object(JpegImagePlugin.JpegImageFile, 'draft', registra_draft):
+            img, originali = prepara_immagine(crea_file_immagine(dimensioni=(8000, 5000)))
+        self.assertEqual(originali, (8000, 5000))
+        self.assertEqual((img.size, img.mode), ((1728, 1080), 'RGB'))
+        # Il decoder ha lavorato a metà risoluzione, non su 40 megapixel
+        self.assertEqual(riquadri[0], (0, 0, 4000, 2500))
+
+    def test_immagine_entro_i_limiti_non_ridotta(self):
+        img, originali = prepara_immagine(crea_file_immagine(dimensioni=(800, 600), formato='PNG'))
+        self.assertEqual((img.size, originali, img.mode), ((800, 600), (800, 600), 'RGB'))
+
+    def test_orientamento_exif_applicato(self):
+        output = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Ruotata di 90° in senso orario
+        Image.new('RGB', (4000, 3000), (200, 80, 40)).save(output, format='JPEG', exif=exif)
+        foto = self.carica_foto(self.alloggio, SimpleUploadedFile('ruotata.jpg', output.getvalue()))
+        self.assertEqual((foto.larghezza_originale, foto.altezza_originale), (3000, 4000))
+        # Orientata come le varianti, ed entro il riquadro dopo la rotazione
+        self.assertEqual((foto.larghezza, foto.altezza), (810, 1080))
+        self.assertEqual(foto.varianti['800w']['altezza'], 1067)
+        with foto.immagine.open('rb') as file, Image.open(file) as salvata:
+            self.assertEqual(salvata.size, (810, 1080))
+            self.assertNotEqual(salvata.getexif().get(0x0112), 6)
+
+    def test_upload_oltre_limite_pixel_rifiutato(self):
+        with mock.patch('api.immagini.PIXEL_MASSIMI', 1_000_000):
+            response = self.client.post('/api/fotoalloggi/', {
+                'alloggio': self.alloggio.pk,
+                'immagine': crea_file_immagine(dimensioni=(1600, 1000)),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('immagine', response.data)
+        self.assertFalse(FotoAlloggio.objects.exists())
+
+    def test_limite_pixel_verificato_prima_della_decodifica(self):
+        immagine = crea_file_immagine(dimensioni=(1600, 1000))
+        with mock.patch('api.immagini.PIXEL_MASSIMI', 1_000_000), \
+                mock.patch.object(ImageFile.ImageFile, 'load', side_effect=AssertionError('decodificata')):
+            foto = self.carica_foto(self.alloggio, immagine)
+        self.assertEqual(foto.stato, 'ERRORE')
+        self.assertIn('troppo grande', foto.errore_elaborazione)
+
+
+class ContenutiImmaginiTest(MediaTemporaneaMixin, APITestCase):
+    """Test dello storage indirizzato per contenuto delle foto elaborate."""
+
+    def setUp(self):
+        super().setUp()
+        self.alloggi = [crea_alloggio('Primo'), crea_alloggio('Secondo')]
+
+    def test_percorso_dato_dall_hash_del_contenuto(self):
+        foto = self.carica_foto(self.alloggi[0])
+        self.assertRegex(foto.immagine.name, r'^contenuti/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.jpg$')
+        with default_storage.open(foto.immagine.name) as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        self.assertIn(digest, foto.immagine.name)
+        for percorso in percorsi_foto(foto):
+            self.assertTrue(percorso.startswith('contenuti/'))
+
+    def test_foto_identiche_condividono_i_file(self):
+        prima = self.carica_foto(self.alloggi[0])
+        seconda = self.carica_foto(self.alloggi[1])
+        self.assertEqual(prima.immagine.name, seconda.immagine.name)
+        self.assertEqual(prima.varianti, seconda.varianti)
+        percorsi = Counter([prima.immagine.name, *percorsi_foto(prima)])
+        riferimenti = dict(ContenutoImmagine.objects.values_list('percorso', 'riferimenti'))
+        self.assertEqual(riferimenti, {percorso: 2 * n for percorso, n in percorsi.items()})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            prima.delete()
+        self.assertTrue(default_storage.exists(seconda.immagine.name))
+        self.assertEqual(ContenutoImmagine.objects.get(percorso=seconda.immagine.name).riferimenti, 1)
+
+        # Anche l'eliminazione a cascata con l'alloggio rilascia i file
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alloggi[1].delete()
+        self.assertFalse(ContenutoImmagine.objects.exists())
+        for percorso in percorsi:
+            self.assertFalse(default_storage.exists(percorso))
+
+    def test_upload_in_errore_eliminato_direttamente(self):
+        with mock.patch('api.tasks.elabora_immagine', side_effect=OSError('file troncato')):
+            foto = self.carica_foto(self.alloggi[0])
+        caricata = foto.immagine.name
+        self.assertTrue(default_storage.exists(caricata))
+        with self.captureOnCommitCallbacks(execute=True):
+            foto.delete()
+        self.assertFalse(default_storage.exists(caricata))
+
+
+class ServerImmagini(ThreadingHTTPServer):
+    """Server HTTP locale che fa le veci degli host remoti nei test."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), GestoreImmagini)
+        self.richieste = Counter()
+        self.versioni = {}
+        self.in_corso = 0
+        self.massimo_in_corso = 0
+        self.lock = threading.Lock()
+
+    def url(self, percorso):
+        return f'http://127.0.0.1:{self.server_port}{percorso}'
+
+
+class GestoreImmagini(BaseHTTPRequestHandler):
+    """
+    /foto/<n>.jpg   JPEG di colore diverso per ogni n
+    /lenta/<n>.jpg  come /foto/, dopo una pausa
+    /remota/<x>.jpg JPEG con ETag e Last-Modified della versione in
+                    server.versioni (default 1), 304 se non modificato
+    /grande.jpg     corpo di 2MB senza Content-Length
+    /pagina         HTML
+    altri percorsi  404
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.richieste[f'{self.command} {self.path}'] += 1
+            server.in_corso += 1
+            server.massimo_in_corso = max(server.massimo_in_corso, server.in_corso)
+        try:
+            self.rispondi()
+        finally:
+            with server.lock:
+                server.in_corso -= 1
+
+    def rispondi(self):
+        if self.path.startswith('/remota/'):
+            versione = self.server.versioni.get(self.path, 1)
+            etag = f'"v{versione}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            corpo = crea_file_immagine(dimensioni=(160, 100), colore=(versione * 50 % 256, 20, 20)).read()
+            self.invia(200, 'image/jpeg', corpo, {
+                'ETag': etag, 'Last-Modified': f'Mon, 0{versione} Jun 2026 10:00:00 GMT',
+            })
+        elif self.path.startswith(('/foto/', '/lenta/')):
+            if self.path.startswith('/lenta/'):
+                time.sleep(0.2)
+            n = int(self.path.rsplit('/', 1)[1].split('.')[0])
+            corpo = crea_file_immagine(dimensioni=(120, 80), colore=(n * 40 % 256, 90, 30)).read()
+            self.invia(200, 'image/jpeg', corpo)
+        elif self.path == '/grande.jpg':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.end_headers()
+            for _ in range(32 if self.command == 'GET' else 0):
+                self.wfile.write(b'\xff' * 65536)
+        elif self.path == '/pagina':
+            self.invia(200, 'text/html; charset=utf-8', b'<html></html>')
+        else:
+            self.invia(404, 'text/plain', b'non trovato')
+
+    def invia(self, codice, content_type, corpo, intestazioni=None):
+        self.send_response(codice)
+        for nome, valore in (intestazioni or {}).items():
+            self.send_header(nome, valore)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        if self.command == 'GET':
+            self.wfile.write(corpo)
+
+
+class ServerImmaginiMixin:
+    """Avvia un ServerImmagini per la classe di test."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ServerImmagini()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.richieste.clear()
+        self.server.versioni.clear()
+        self.server.massimo_in_corso = 0
+
+
+class ImportazioneFotoTest(ServerImmaginiMixin, MediaTemporaneaMixin, APITestCase):
+    """Test dell'importazione delle foto da URL remoti."""
+
+    def setUp(self):
+        super().setUp()
+        self.alloggio = crea_alloggio('Importazione')
+        self.client.force_authenticate(get_user_model().objects.create_user('staff'))
+
+    def test_upload_da_url_scarica_una_volta(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/fotoalloggi/', {
+                'alloggio': self.alloggio.pk,
+                'url_download': self.server.url('/foto/1.jpg'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.server.richieste['GET /foto/1.jpg'], 1)
+        foto = FotoAlloggio.objects.get(pk=response.data['id'])
+        self.assertEqual((foto.stato, foto.larghezza_originale), ('PRONTA', 120))
+
+        response = self.client.post('/api/fotoalloggi/', {
+            'alloggio': self.alloggio.pk, 'url_download': self.server.url('/pagina'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('url_download', response.data)
+
+    def test_importazione_multipla(self):
+        FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/a.jpg', ordine=4)
+        urls = [
+            self.server.url('/foto/1.jpg'),
+            self.server.url('/mancante.jpg'),
+            self.server.url('/foto/2.jpg'),
+            self.server.url('/pagina'),
+            self.server.url('/foto/3.jpg'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/fotoalloggi/importa/', {
+                'alloggio': self.alloggio.pk, 'urls': urls, 'tipo': 'camera',
+            }, format='json')
+        self.assertEqual(response.status_code, 202)
+        risultati = response.data['risultati']
+        self.assertEqual([r['url'] for r in risultati], urls)
+        self.assertEqual(['id' in r for r in risultati], [True, False, True, False, True])
+        self.assertIn('404', risultati[1]['errore'])
+        self.assertEqual(risultati[3]['errore'], "L'URL non punta a un'immagine valida.")
+        self.assertTrue(all(self.server.richieste[p] == 1 for p in self.server.richieste))
+
+        importate = FotoAlloggio.objects.filter(pk__in=[r['id'] for r in risultati if 'id' in r])
+        self.assertEqual(sorted(importate.values_list('ordine', flat=True)), [5, 6, 7])
+        self.assertEqual(set(importate.values_list('stato', 'tipo')), {('PRONTA', 'camera')})
+
+    def test_importazione_senza_foto_valide(self):
+        response = self.client.post('/api/fotoalloggi/importa/', {
+            'alloggio': self.alloggio.pk, 'urls': [self.server.url('/mancante.jpg')],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FotoAlloggio.objects.exists())
+
+    def test_importazione_blocca_l_alloggio_per_l_ordine(self):
+        with CaptureQueriesContext(connection) as query:
+            risultati = importa_foto(self.alloggio, [self.server.url('/foto/1.jpg')])
+        self.assertIn('id', risultati[0])
+        bloccate = [q['sql'] for q in query.captured_queries if 'FOR UPDATE' in q['sql']]
+        self.assertEqual(len(bloccate), 1)
+        self.assertIn('"alloggi"', bloccate[0])
+
+    def test_file_chiusi_se_l_importazione_si_interrompe(self):
+        scaricati = []
+
+        def scarica(*args, **kwargs):
+            file = scarica_immagine(*args, **kwargs)
+            scaricati.append(file)
+            return file
+
+        urls = [self.server.url(f'/foto/{n}.jpg') for n in range(3)]
+        with mock.patch('api.importazione.scarica_immagine', side_effect=scarica), \
+                mock.patch('api.importazione.blocca_ordine', side_effect=RuntimeError('interrotta')):
+            with self.assertRaisesMessage(RuntimeError, 'interrotta'):
+                importa_foto(self.alloggio, urls)
+        self.assertEqual(len(scaricati), 3)
+        self.assertTrue(all(file.closed for file in scaricati))
+        self.assertFalse(FotoAlloggio.objects.exists())
+
+    def test_download_concorrenti_limitati(self):
+        urls = [self.server.url(f'/lenta/{n}.jpg') for n in range(6)]
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('importa_foto', self.alloggio.pk, *urls, concorrenza=2, stdout=out)
+        self.assertEqual(self.server.massimo_in_corso, 2)
+        self.assertEqual(self.alloggio.foto.count(), 6)
+        self.assertIn('6 foto importate su 6 URL', out.getvalue())
+
+    def test_limite_di_dimensione(self):
+        with self.assertRaisesMessage(ErroreDownload, 'troppo grande'):
+            scarica_immagine(self.server.url('/grande.jpg'), limite=1024 * 1024)
+        with self.assertRaisesMessage(ErroreDownload, 'troppo grande'):
+            scarica_immagine(self.server.url('/foto/1.jpg'), limite=100)
+        with scarica_immagine(self.server.url('/foto/1.jpg')) as file:
+            self.assertEqual(file.name, '1.jpg')
+            self.assertEqual(Image.open(file).size, (120, 80))
+
+
+class VerificaUrlTest(ServerImmaginiMixin, APITestCase):
+    """Test della cache delle verifiche degli URL delle foto remote."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Remote')
+        self.foto = FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/a.jpg')
+        self.client.force_authenticate(get_user_model().objects.create_user('staff'))
+
+    def aggiorna_url(self, url):
+        return self.client.patch(f'/api/fotoalloggi/{self.foto.pk}/', {'url': url}, format='multipart')
+
+    def url_irraggiungibile(self):
+        with socket.socket() as libero:
+            libero.bind(('127.0.0.1', 0))
+            return f'http://127.0.0.1:{libero.getsockname()[1]}/foto'
+
+    def test_verifica_condivisa_per_url_normalizzato(self):
+        url = self.server.url('/foto/1')
+        esito = verifica_url(url)
+        self.assertEqual((esito['status'], esito['content_type']), (200, 'image/jpeg'))
+        self.assertGreater(esito['dimensione'], 0)
+        self.assertEqual(verifica_url(url.replace('http://', 'HTTP://') + '#galleria'), esito)
+        self.assertEqual(self.server.richieste['HEAD /foto/1'], 1)
+
+    def test_validazione_del_serializer(self):
+        self.assertEqual(self.aggiorna_url(self.server.url('/foto/2')).status_code, 200)
+
+        response = self.aggiorna_url(self.server.url('/pagina'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("immagine valida", str(response.data))
+
+        for _ in range(2):
+            response = self.aggiorna_url(self.server.url('/mancante'))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('HTTP 404', str(response.data))
+        # Esito negativo in cache: l'host è interrogato una volta sola
+        self.assertEqual(self.server.richieste['HEAD /mancante'], 1)
+
+        # Un host irraggiungibile non blocca il salvataggio
+        self.assertEqual(self.aggiorna_url(self.url_irraggiungibile()).status_code, 200)
+
+    def test_esiti_negativi_scadono_prima(self):
+        verifica_url(self.server.url('/foto/3'))
+        verifica_url(self.server.url('/mancante'))
+        dopo = time.time() + TTL_VERIFICA_ERRORE + 1
+        with mock.patch('time.time', return_value=dopo):
+            verifica_url(self.server.url('/foto/3'))
+            verifica_url(self.server.url('/mancante'))
+        self.assertEqual(self.server.richieste['HEAD /foto/3'], 1)
+        self.assertEqual(self.server.richieste['HEAD /mancante'], 2)
+
+    def test_comando_di_verifica(self):
+        verifica_url(self.server.url('/foto/1'))
+        for url in (self.server.url('/foto/1'), self.server.url('/pagina'), self.server.url('/mancante')):
+            FotoAlloggio.objects.create(alloggio=self.alloggio, url=url)
+        FotoAlloggio.objects.filter(pk=self.foto.pk).update(url=self.url_irraggiungibile())
+
+        out = StringIO()
+        call_command('verifica_url_foto', concorrenza=4, stdout=out)
+        self.assertIn('4 foto verificate: 2 non valide, 1 irraggiungibili.', out.getvalue())
+        # Il comando ignora la cache e la aggiorna
+        self.assertEqual(self.server.richieste['HEAD /foto/1'], 2)
+
+
+@override_settings(IMMAGINI_COPIA_REMOTE=True)
+class CopiaLocaleTest(ServerImmaginiMixin, MediaTemporaneaMixin, APITestCase):
+    """Test della copia locale delle foto remote."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Copia locale')
+        self.url = self.server.url('/remota/a.jpg')
+
+    def crea_foto_remota(self, url=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            foto = FotoAlloggio.objects.create(alloggio=self.alloggio, url=url or self.url)
+        foto.refresh_from_db()
+        return foto
+
+    def test_copia_creata_al_salvataggio(self):
+        foto = self.crea_foto_remota()
+        self.assertTrue(foto.is_copia_locale())
+        self.assertEqual((foto.copia_di, foto.copia_etag, foto.stato), (self.url, '"v1"', 'PRONTA'))
+        self.assertEqual(foto.larghezza_originale, 160)
+        self.assertEqual(set(foto.varianti), set(VARIANTI))
+        self.assertTrue(foto.get_image_url().startswith('/media/contenuti/'))
+
+        dati = self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]
+        self.assertTrue(dati['image_url'].endswith(foto.immagine.url))
+        self.assertNotEqual(dati['srcset'], '')
+
+    def test_aggiornamento_condizionale(self):
+        foto = self.crea_foto_remota()
+        verificata = foto.copia_aggiornata_il
+
+        self.assertEqual(copia_foto_remota(foto.pk), 'non modificata')
+        aggiornata = FotoAlloggio.objects.get(pk=foto.pk)
+        self.assertEqual(aggiornata.immagine.name, foto.immagine.name)
+        self.assertGreater(aggiornata.copia_aggiornata_il, verificata)
+        self.assertEqual(self.server.richieste['GET /remota/a.jpg'], 2)
+
+        self.server.versioni['/remota/a.jpg'] = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(copia_foto_remota(foto.pk), 'aggiornata')
+        aggiornata.refresh_from_db()
+        self.assertNotEqual(aggiornata.immagine.name, foto.immagine.name)
+        self.assertEqual(aggiornata.copia_etag, '"v2"')
+        self.assertFalse(default_storage.exists(foto.immagine.name))
+        self.assertFalse(ContenutoImmagine.objects.filter(percorso=foto.immagine.name).exists())
+
+    def test_cambio_url_scarta_la_copia(self):
+        foto = self.crea_foto_remota()
+        precedente = foto.immagine.name
+        self.server.versioni['/remota/b.jpg'] = 3
+        foto.url = self.server.url('/remota/b.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            foto.save()
+        foto.refresh_from_db()
+        self.assertEqual(foto.copia_di, self.server.url('/remota/b.jpg'))
+        self.assertNotEqual(foto.immagine.name, precedente)
+        self.assertFalse(default_storage.exists(precedente))
+
+    def test_download_non_valido_lascia_la_foto_remota(self):
+        foto = self.crea_foto_remota(self.server.url('/pagina'))
+        self.assertFalse(foto.immagine)
+        self.assertEqual((foto.stato, foto.get_image_url()), ('PRONTA', self.server.url('/pagina')))
+        self.assertFalse(ContenutoImmagine.objects.exists())
+
+    def test_copia_accodata_solo_se_l_url_cambia(self):
+        foto = self.crea_foto_remota(self.server.url('/pagina'))
+        self.assertEqual(self.server.richieste['GET /pagina'], 1)
+
+        foto = FotoAlloggio.objects.get(pk=foto.pk)
+        foto.ordine, foto.descrizione = 3, 'Ingresso'
+        with self.captureOnCommitCallbacks(execute=True):
+            foto.save()
+        self.assertEqual(self.server.richieste['GET /pagina'], 1)
+
+        foto.url = self.url
+        with self.captureOnCommitCallbacks(execute=True):
+            foto.save()
+        self.assertTrue(FotoAlloggio.objects.get(pk=foto.pk).is_copia_locale())
+
+    def test_modifica_della_foto_copiata(self):
+        foto = self.crea_foto_remota()
+        self.client.force_authenticate(get_user_model().objects.create_user('staff'))
+        response = self.client.patch(f'/api/fotoalloggi/{foto.pk}/', {'descrizione': 'Vista'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(FotoAlloggio.objects.get(pk=foto.pk).is_copia_locale())
+
+    @override_settings(IMMAGINI_COPIA_REMOTE=False)
+    def test_comando_di_aggiornamento(self):
+        self.crea_foto_remota()
+        self.crea_foto_remota(self.server.url('/mancante.jpg'))
+        self.assertEqual(sum(self.server.richieste.values()), 0)
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('aggiorna_copie_remote', sincrono=True, stdout=out)
+        self.assertIn('Copie locali: 1 aggiornata, 1 non riuscita.', out.getvalue())
+        out = StringIO()
+        call_command('aggiorna_copie_remote', sincrono=True, stdout=out)
+        self.assertIn('1 non modificata, 1 non riuscita', out.getvalue())
+
+
+class SegnapostoTest(MediaTemporaneaMixin, APITestCase):
+    """Test dei segnaposto (LQIP) calcolati all'elaborazione."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.alloggio = crea_alloggio('Segnaposto')
+
+    def test_segnaposto_e_dimensioni_all_elaborazione(self):
+        foto = self.carica_foto(self.alloggio)
+        self.assertEqual((foto.larghezza, foto.altezza), (1620, 1080))
+        self.assertRegex(foto.segnaposto, r'^data:image/(webp|jpeg);base64,[A-Za-z0-9+/=]+$')
+        self.assertLess(len(foto.segnaposto), 400)
+
+        dati = self.client.get('/api/alloggi/').data['results'][0]
+        self.assertEqual(dati['segnaposto'], {'data_uri': foto.segnaposto, 'larghezza': 1620, 'altezza': 1080})
+        dati = self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto'][0]
+        self.assertEqual((dati['segnaposto'], dati['larghezza'], dati['altezza']), (foto.segnaposto, 1620, 1080))
+
+    def test_foto_remota_senza_segnaposto(self):
+        FotoAlloggio.objects.create(alloggio=self.alloggio, url='https://example.com/a.jpg')
+        self.assertIsNone(self.client.get('/api/alloggi/').data['results'][0]['segnaposto'])
+
+
+class SegnapostoBackfillTest(MediaTemporaneaMixin, TransactionTestCase):
+    """
+    Test del backfill dei segnaposto: il comando chiude le connessioni al
+    database prima del fork, cosa che nella transazione di un TestCase
+    interromperebbe il test.
+    """
+
+    def test_backfill_con_pool_di_processi(self):
+        alloggio = crea_alloggio('Backfill')
+        # Fuori da una transazione l'elaborazione (eager) avviene subito
+        foto = [FotoAlloggio.objects.create(alloggio=alloggio, immagine=crea_file_immagine(), ordine=n)
+                for n in range(3)]
+        FotoAlloggio.objects.update(larghezza=None, altezza=None, segnaposto='')
+        prima = timezone.now()
+        out = StringIO()
+        call_command('genera_segnaposto', processi=2, stdout=out)
+        self.assertIn('3 foto aggiornate, 0 errori.', out.getvalue())
+        for aggiornata in FotoAlloggio.objects.filter(pk__in=[f.pk for f in foto]):
+            self.assertEqual((aggiornata.larghezza, aggiornata.altezza), (1620, 1080))
+            self.assertTrue(aggiornata.segnaposto.startswith('data:image/'))
+            # I validatori HTTP delle risposte con la foto cambiano
+            self.assertGreaterEqual(aggiornata.updated_at, prima)
+
+
+class CaricamentoMultiploTest(MediaTemporaneaMixin, APITestCase):
+    """Test del caricamento di più foto con una sola richiesta."""
+
+    def setUp(self):
+        super().setUp()
+        self.alloggio = crea_alloggio('Multiplo')
+        self.client.force_authenticate(get_user_model().objects.create_user('staff'))
+
+    def carica(self, immagini, **kwargs):
+        return self.client.post('/api/fotoalloggi/caricamento-multiplo/', {
+            'alloggio': self.alloggio.pk,
+            'immagini': immagini,
+            **kwargs,
+        }, format='multipart')
+
+    def test_esito_per_file_e_ordine_in_coda(self):
+        self.carica_foto(self.alloggio, ordine=4)
+        immagini = [
+            crea_file_immagine('camera.jpg'),
+            SimpleUploadedFile('rotta.jpg', b'non un\'immagine', content_type='image/jpeg'),
+            crea_file_immagine('bagno.png', formato='PNG'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.carica(immagini, tipo='camera')
+        self.assertEqual(response.status_code, 202)
+        risultati = response.data['risultati']
+        self.assertEqual([r['file'] for r in risultati], ['camera.jpg', 'rotta.jpg', 'bagno.png'])
+        self.assertIn('errori', risultati[1])
+        self.assertEqual([risultati[0]['ordine'], risultati[2]['ordine']], [5, 6])
+        self.assertEqual(risultati[0]['stato'], 'IN_ATTESA')
+
+        create = FotoAlloggio.objects.filter(pk__in=[risultati[0]['id'], risultati[2]['id']])
+        self.assertEqual(create.count(), 2)
+        for foto in create:
+            self.assertEqual((foto.stato, foto.tipo), ('PRONTA', 'camera'))
+            self.assertTrue(foto.immagine.name.endswith('.jpg'))
+            self.assertTrue(default_storage.exists(foto.immagine.name))
+        self.assertEqual(len(self.client.get(f'/api/alloggi/{self.alloggio.pk}/').data['foto']), 3)
+
+    def test_nessun_file_valido(self):
+        response = self.carica([SimpleUploadedFile('testo.jpg', b'testo', content_type='image/jpeg')])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errori', response.data['risultati'][0])
+        self.assertFalse(FotoAlloggio.objects.exists())
+
+    def test_troppi_file(self):
+        limite = CaricamentoMultiploSerializer.MAX_FILE
+        immagini = [crea_file_immagine(f'{n}.jpg', dimensioni=(10, 10)) for n in range(limite + 1)]
+        response = self.carica(immagini)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('immagini', response.data)
+        self.assertFalse(FotoAlloggio.objects.exists())
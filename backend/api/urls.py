@@ -14,6 +14,9 @@ urlpatterns = [
     # Endpoint di stato per health check
     path('status/', views.status_view, name='api_status'),
     
+    # Endpoint per la verifica di disponibilità e prezzo di più alloggi
+    path('disponibilita/batch/', views.disponibilita_batch, name='disponibilita_batch'),
+    
     # Endpoint specifico per verifica disponibilità generale
     path('disponibilita/', views.disponibilita_generale, name='disponibilita_generale'),
     
@@ -24,18 +27,20 @@ urlpatterns = [
 # Le seguenti route sono ora disponibili automaticamente tramite il router:
 #
 # ALLOGGI:
-# GET    /api/alloggi/                     - Lista alloggi
+# GET    /api/alloggi/                     - Lista alloggi (?check_in=&check_out=&ospiti= per la ricerca)
 # POST   /api/alloggi/                     - Crea nuovo alloggio
 # GET    /api/alloggi/{id}/                - Dettagli alloggio
 # PUT    /api/alloggi/{id}/                - Aggiorna alloggio (completo)
 # PATCH  /api/alloggi/{id}/                - Aggiorna alloggio (parziale)
 # DELETE /api/alloggi/{id}/                - Elimina alloggio
 # GET    /api/alloggi/{id}/disponibilita/  - Verifica disponibilità alloggio
+# GET    /api/alloggi/{id}/calendario/     - Calendario notti occupate (?from=YYYY-MM&to=YYYY-MM)
 #
 # FOTO:
 # GET    /api/fotoalloggi/                 - Lista foto
 # POST   /api/fotoalloggi/                 - Upload nuova foto
 # GET    /api/fotoalloggi/{id}/            - Dettagli foto
+# GET    /api/fotoalloggi/{id}/varianti/{nome}/ - Variante nel formato migliore per l'Accept (generata al primo accesso)
 # PUT    /api/fotoalloggi/{id}/            - Aggiorna foto
 # DELETE /api/fotoalloggi/{id}/            - Elimina foto
 #
@@ -51,4 +56,5 @@ urlpatterns = [
 #
 # ALTRI:
 # GET    /api/status/                      - Status API e database
-# GET    /api/disponibilita/               - Verifica disponibilità generale
\ No newline at end of file
+# GET    /api/disponibilita/               - Verifica disponibilità generale
+# POST   /api/disponibilita/batch/         - Disponibilità e prezzo per più alloggi/periodi
\ No newline at end of file
@@ -5,30 +5,57 @@ import os
 import socket
 
 from django.db import connection  # Importa connection per il controllo DB
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.views.decorators.csrf import csrf_exempt  # Importa csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action, api_view
-from rest_framework.parsers import FormParser, MultiPartParser  # Per upload file
+from rest_framework.generics import get_object_or_404
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser  # Per upload file
 from rest_framework.permissions import AllowAny, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils.decorators import method_decorator
 
+from .cache import (
+    CatalogoCacheMixin,
+    GetCondizionaleMixin,
+    cache_condivisa,
+    ultima_modifica_catalogo,
+    versione_catalogo,
+)
+from .disponibilita import calendario_mensile, preventivi, suggerimenti
+from .filters import AlloggioFilter, OrdinamentoFilter, PrenotazioneFilter, RicercaTrigrammiFilter
+from .immagini import FORMATI, VARIANTI, formato_preferito
+from .importazione import crea_foto_caricate, importa_foto
 from .models import Alloggio, FotoAlloggio, Prenotazione
+from .pagination import PrenotazioneCursorPagination
 from .serializers import (
     AlloggioCreateUpdateSerializer,
     AlloggioDetailSerializer,
     AlloggioListSerializer,
+    CalendarioSerializer,
+    CaricamentoMultiploSerializer,
+    DisponibilitaBatchSerializer,
     DisponibilitaSerializer,
     FotoAlloggioSerializer,
     FotoAlloggioUploadSerializer,
+    ImmagineCaricataSerializer,
+    ImportazioneFotoSerializer,
     PrenotazioneListSerializer,
     PrenotazioneDetailSerializer,
     PrenotazioneCreateSerializer,
     PrenotazioneUpdateSerializer,
+    PeriodoSerializer,
+    RicercaAlloggiSerializer,
 )
 
 
@@ -104,7 +131,7 @@ def api_root(request):
     })
 
 
-class AlloggioViewSet(viewsets.ModelViewSet):
+class AlloggioViewSet(GetCondizionaleMixin, CatalogoCacheMixin, viewsets.ModelViewSet):
     """
     ViewSet per gestire le operazioni CRUD sugli alloggi.
 
@@ -118,6 +145,35 @@ class AlloggioViewSet(viewsets.ModelViewSet):
     queryset = Alloggio.objects.prefetch_related('foto').all()
     permission_classes = [AllowAny]
 
+    # ?disponibile=, ?prezzo_min=, ?prezzo_max=, ?ospiti=, ?camere_min=,
+    # ?bagni_min= e ?ordering=; periodo, testo e servizi in filtra_ricerca
+    filter_backends = [DjangoFilterBackend, OrdinamentoFilter]
+    filterset_class = AlloggioFilter
+    ordering_fields = ['nome', 'prezzo_notte', 'numero_ospiti_max', 'created_at']
+    ordering = ['nome']
+
+    # La ricerca per periodo dipende dalle prenotazioni, non solo dal catalogo
+    parametri_non_cacheabili = ('check_in', 'check_out')
+
+    # Secondi per cui la risposta di disponibilità è riutilizzabile dalle cache
+    MAX_AGE_DISPONIBILITA = 60
+
+    # Foto incluse nelle risposte, per i validatori calcolati sul database
+    relazioni_validatori = ('foto',)
+
+    def validatori(self, request):
+        """
+        I validatori del catalogo derivano dalla sua versione in cache, che
+        cambia anche per le modifiche alle foto: nessuna query necessaria.
+        Se la cache non è condivisa la versione è propria di ogni processo e
+        i validatori sono calcolati sul database.
+        """
+        if any(p in request.query_params for p in self.parametri_non_cacheabili):
+            return None
+        if not cache_condivisa():
+            return super().validatori(request)
+        return str(versione_catalogo()), ultima_modifica_catalogo()
+
     def get_serializer_class(self):
         """Usa serializer diversi per lista, dettaglio e creazione/aggiornamento."""
         if self.action == 'list':
@@ -129,19 +185,155 @@ class AlloggioViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """
         Filtra gli alloggi in base ai parametri della query.
-        Permette di filtrare per disponibilità.
+        Nella lista permette di cercare gli alloggi liberi in un periodo,
+        per testo libero e per servizi; gli altri filtri sono in AlloggioFilter:
+        GET /alloggi/?check_in=YYYY-MM-DD&check_out=YYYY-MM-DD&ospiti=N
+        GET /alloggi/?q=villa piscina
+        GET /alloggi/?servizi=Wi-Fi,Piscina&facette=true
         """
         queryset = super().get_queryset()
 
-        # Filtra per disponibilità se richiesto
-        disponibile = self.request.query_params.get('disponibile', None)
-        if disponibile is not None:
-            queryset = queryset.filter(disponibile=disponibile.lower() == 'true')
+        if self.action == 'list':
+            queryset = self.filtra_ricerca(queryset)
+
+        return queryset
+
+    def filtra_ricerca(self, queryset):
+        """
+        Applica i filtri di ricerca per periodo, testo e servizi.
+        Con ?q= i risultati sono in ordine di rilevanza.
+        """
+        params = self.request.query_params
+        campi = ('check_in', 'check_out', 'q', 'servizi')
+        if not any(params.get(p) for p in campi):
+            return queryset
+
+        ricerca = RicercaAlloggiSerializer(data={
+            p: params[p] for p in campi if params.get(p)
+        })
+        ricerca.is_valid(raise_exception=True)
+        dati = ricerca.validated_data
+
+        if 'check_in' in dati:
+            queryset = queryset.liberi(dati['check_in'], dati['check_out'])
+        if 'q' in dati:
+            queryset = queryset.cerca(dati['q'])
+        if dati.get('servizi'):
+            queryset = queryset.con_servizi(dati['servizi'])
 
         return queryset
 
+    def get_paginated_response(self, data):
+        """Con ?facette=true aggiunge i conteggi per servizio dei risultati filtrati."""
+        response = super().get_paginated_response(data)
+        if self.request.query_params.get('facette', '').lower() == 'true':
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facette_servizi'] = queryset.facette_servizi()
+        return response
+
+    @action(detail=True, methods=['get'])
+    def calendario(self, request, pk=None):
+        """
+        Endpoint per il calendario di occupazione di un alloggio.
+        GET /alloggi/{id}/calendario/?from=YYYY-MM&to=YYYY-MM
+        """
+        alloggio = self.get_object()
+
+        serializer = CalendarioSerializer(data={
+            campo: request.query_params[param]
+            for campo, param in (('da', 'from'), ('a', 'to'))
+            if request.query_params.get(param)
+        })
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        calendario = calendario_mensile(
+            alloggio,
+            serializer.validated_data['da'],
+            serializer.validated_data['a'],
+        )
+        return Response({'alloggio': alloggio.id, **calendario})
+
+    @action(detail=True, methods=['get'])
+    def disponibilita(self, request, pk=None):
+        """
+        Endpoint per verificare la disponibilità di un alloggio.
+        GET /alloggi/{id}/disponibilita/?check_in=YYYY-MM-DD&check_out=YYYY-MM-DD
+
+        L'alloggio e la presenza di prenotazioni sovrapposte vengono letti
+        con una sola query.
+        """
+        # Ottieni i parametri dalla query string
+        check_in = request.query_params.get('check_in')
+        check_out = request.query_params.get('check_out')
+
+        if not check_in or not check_out:
+            return Response(
+                {'error': 'Parametri check_in e check_out sono obbligatori.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = PeriodoSerializer(data={'check_in': check_in, 'check_out': check_out})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        check_in = serializer.validated_data['check_in']
+        check_out = serializer.validated_data['check_out']
+
+        occupato = Prenotazione.sovrapposte(check_in, check_out).filter(
+            alloggio=models.OuterRef('pk')
+        )
+        alloggio = get_object_or_404(
+            Alloggio.objects.annotate(occupato=models.Exists(occupato)),
+            pk=pk
+        )
+        self.check_object_permissions(request, alloggio)
+
+        numero_notti = (check_out - check_in).days
+        prezzo_totale = alloggio.prezzo_notte * numero_notti
+        disponibile = alloggio.is_available() and not alloggio.occupato
+
+        dati = {
+            'disponibile': disponibile,
+            'alloggio': {
+                'id': alloggio.id,
+                'nome': alloggio.nome,
+                'prezzo_notte': alloggio.prezzo_notte,
+            },
+            'periodo': {
+                'check_in': check_in,
+                'check_out': check_out,
+                'numero_notti': numero_notti,
+            },
+            'calcolo': {
+                'prezzo_totale': prezzo_totale,
+                'prezzo_per_notte': alloggio.prezzo_notte,
+            }
+        }
+        if not disponibile:
+            dati['suggerimenti'] = suggerimenti(alloggio, check_in, check_out)
+
+        response = Response(dati)
+        # Il preventivo può essere riusato per poco tempo da browser e proxy
+        patch_cache_control(response, public=True, max_age=self.MAX_AGE_DISPONIBILITA)
+        return response
+
+
+class NegoziazioneImmagini(BaseContentNegotiation):
+    """
+    Negoziazione per le viste che rispondono con immagini: il formato è
+    scelto dalla vista sull'Accept, quindi DRF non deve rifiutare con 406
+    i client che non accettano JSON.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
 
-class FotoAlloggioViewSet(viewsets.ModelViewSet):
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class FotoAlloggioViewSet(GetCondizionaleMixin, viewsets.ModelViewSet):
     """
     ViewSet per gestire le operazioni CRUD sulle foto degli alloggi.
     Permette l'upload di immagini e l'associazione con un alloggio esistente.
@@ -158,10 +350,129 @@ class FotoAlloggioViewSet(viewsets.ModelViewSet):
             return FotoAlloggioUploadSerializer
         return FotoAlloggioSerializer
 
+    def create(self, request, *args, **kwargs):
+        """
+        Carica una foto. Le immagini sono elaborate in background: finché
+        non sono pronte la risposta è 202 con lo stato dell'elaborazione,
+        da seguire su GET /fotoalloggi/{id}/.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+
+        foto = serializer.instance
+        foto.refresh_from_db()
+        dati = FotoAlloggioSerializer(foto, context=self.get_serializer_context()).data
+        return Response(
+            dati,
+            status=status.HTTP_201_CREATED if foto.is_pronta() else status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('fotoalloggio-detail', args=[foto.pk], request=request)},
+        )
+
     def perform_create(self, serializer):
         """Salva l'immagine e associala all'alloggio."""
         serializer.save()
 
+    @action(detail=False, methods=['post'], url_path='caricamento-multiplo')
+    def caricamento_multiplo(self, request):
+        """
+        Carica più foto in un alloggio con una sola richiesta.
+        POST /fotoalloggi/caricamento-multiplo/ (multipart: alloggio, immagini, tipo)
+
+        Ogni file è validato singolarmente; quelli validi diventano foto in
+        coda alle esistenti, create insieme ed elaborate in parallelo dai
+        worker. La risposta riporta l'esito di ogni file: 201 se le foto
+        create sono già pronte, 202 se in elaborazione, 400 se nessun file
+        è valido.
+        """
+        serializer = CaricamentoMultiploSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dati = serializer.validated_data
+
+        risultati, valide = [], []
+        for file in dati['immagini']:
+            immagine = ImmagineCaricataSerializer(data={'immagine': file})
+            if immagine.is_valid():
+                valide.append(immagine.validated_data['immagine'])
+                risultati.append({'file': file.name})
+            else:
+                risultati.append({'file': file.name, 'errori': immagine.errors['immagine']})
+        if not valide:
+            return Response(
+                {'alloggio': dati['alloggio'].pk, 'risultati': risultati},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        create = crea_foto_caricate(dati['alloggio'], valide, tipo=dati['tipo'])
+        # Senza worker (eager) l'elaborazione è già avvenuta al commit
+        stati = dict(FotoAlloggio.objects.filter(pk__in=[f.pk for f in create]).values_list('id', 'stato'))
+        foto = iter(create)
+        for risultato in risultati:
+            if 'errori' not in risultato:
+                singola = next(foto)
+                risultato.update(id=singola.pk, ordine=singola.ordine, stato=stati[singola.pk])
+        pronte = all(stato == FotoAlloggio.STATO_PRONTA for stato in stati.values())
+        return Response(
+            {'alloggio': dati['alloggio'].pk, 'risultati': risultati},
+            status=status.HTTP_201_CREATED if pronte else status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser])
+    def importa(self, request):
+        """
+        Importa più foto da URL in un alloggio.
+        POST /fotoalloggi/importa/ {"alloggio": id, "urls": [...], "tipo": "camera"}
+
+        Le immagini sono scaricate in parallelo e accodate all'elaborazione,
+        in coda alle foto esistenti. La risposta riporta l'esito di ogni URL;
+        è 202 se almeno una foto è stata creata, altrimenti 400.
+        """
+        serializer = ImportazioneFotoSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dati = serializer.validated_data
+
+        risultati = importa_foto(dati['alloggio'], dati['urls'], tipo=dati['tipo'])
+        creata = any('id' in risultato for risultato in risultati)
+        return Response(
+            {'alloggio': dati['alloggio'].pk, 'risultati': risultati},
+            status=status.HTTP_202_ACCEPTED if creata else status.HTTP_400_BAD_REQUEST,
+        )
+
+    @action(
+        detail=True, methods=['get'], url_path=r'varianti/(?P<nome>[^/]+)',
+        content_negotiation_class=NegoziazioneImmagini,
+    )
+    def variante(self, request, pk=None, nome=None):
+        """
+        Serve la variante nel formato migliore accettato dal client (AVIF,
+        WebP o JPEG), generandola al primo accesso.
+        GET /fotoalloggi/{id}/varianti/{nome}/ (300x200, 800w, 1920w, originale)
+
+        Con IMMAGINI_X_ACCEL_PREFIX il file è consegnato da nginx tramite
+        X-Accel-Redirect, altrimenti con un redirect al suo URL.
+        """
+        if nome != 'originale' and nome not in VARIANTI:
+            raise Http404
+        foto = self.get_object()
+        if not foto.immagine:
+            return HttpResponseRedirect(foto.get_image_url())
+        if not foto.is_pronta():
+            raise Http404("Immagine in elaborazione.")
+
+        nome = None if nome == 'originale' else nome
+        foto.completa_variante(nome)
+        percorsi = foto.percorsi_formati(nome)
+        formato = formato_preferito(request.headers.get('Accept'), percorsi)
+
+        prefisso = settings.IMMAGINI_X_ACCEL_PREFIX
+        if prefisso:
+            response = HttpResponse(content_type=FORMATI[formato][2])
+            response['X-Accel-Redirect'] = prefisso + percorsi[formato]
+        else:
+            response = HttpResponseRedirect(default_storage.url(percorsi[formato]))
+        patch_vary_headers(response, ['Accept'])
+        return response
+
     def list(self, request, *args, **kwargs):
         """Override per aggiungere paginazione anche per le foto."""
         queryset = self.filter_queryset(self.get_queryset())
@@ -188,7 +499,7 @@ class FotoAlloggioViewSet(viewsets.ModelViewSet):
 @method_decorator(csrf_exempt, name='create')
 @method_decorator(csrf_exempt, name='update')
 @method_decorator(csrf_exempt, name='partial_update')
-class PrenotazioneViewSet(viewsets.ModelViewSet):
+class PrenotazioneViewSet(GetCondizionaleMixin, viewsets.ModelViewSet):
     """
     ViewSet per gestire le operazioni CRUD sulle prenotazioni.
     
@@ -198,16 +509,59 @@ class PrenotazioneViewSet(viewsets.ModelViewSet):
     - GET /prenotazioni/{id}/ - Dettagli di una prenotazione
     - PUT/PATCH /prenotazioni/{id}/ - Aggiorna una prenotazione
     - DELETE /prenotazioni/{id}/ - Cancella una prenotazione
+
+    La lista usa la paginazione a cursore; la paginazione a pagine resta
+    disponibile con ?paginazione=pagine o passando ?page=N.
+
+    Ricerca ospite: ?ospite= filtra per nome/email contenuti, con
+    ?modalita=simile restituisce i risultati per similarità decrescente
+    (tollerante ai refusi). ?search= cerca su search_fields.
     """
     
-    queryset = Prenotazione.objects.all()
+    queryset = Prenotazione.objects.select_related('alloggio')
     permission_classes = [AllowAny]
+    # Nomi ed email degli ospiti: solo la cache del browser può conservarle
+    cache_control = {'private': True, 'no_cache': True}
     
     # Filtri per le query
-    filterset_fields = ['alloggio', 'stato', 'check_in', 'check_out']
+    filter_backends = [DjangoFilterBackend, RicercaTrigrammiFilter, OrdinamentoFilter]
+    filterset_class = PrenotazioneFilter
     search_fields = ['ospite_nome', 'ospite_email', 'alloggio__nome']
     ordering_fields = ['check_in', 'check_out', 'created_at', 'prezzo_totale']
-    ordering = ['-created_at']
+    # Coincide con la paginazione a cursore e con prenotazione_created_id_idx
+    ordering = ['-created_at', 'id']
+    
+    @property
+    def pagination_class(self):
+        """
+        Sceglie la paginazione a pagine solo se richiesta esplicitamente o se
+        i risultati sono ordinati per similarità, ordine che il cursore su
+        created_at non può seguire.
+        """
+        params = self.request.query_params
+        if params.get('paginazione') == 'pagine' or 'page' in params:
+            return PageNumberPagination
+        if params.get('ospite') and params.get('modalita') == 'simile':
+            return PageNumberPagination
+        return PrenotazioneCursorPagination
+    
+    def validatori(self, request):
+        """
+        Nella paginazione a cursore la lista non ha validatori: calcolarli
+        richiederebbe un'aggregazione sull'intera tabella ad ogni pagina.
+        """
+        if self.action == 'list' and self.pagination_class is PrenotazioneCursorPagination:
+            return None
+        return super().validatori(request)
+    
+    def get_relazioni_validatori(self):
+        """
+        La lista include il nome dell'alloggio, il dettaglio anche la sua foto
+        principale: la join sulle foto riguarda così un solo alloggio.
+        """
+        if self.action == 'retrieve':
+            return ('alloggio', 'alloggio__foto')
+        return ('alloggio',)
     
     def get_serializer_class(self):
         """Restituisce il serializer appropriato in base all'azione."""
@@ -220,39 +574,6 @@ class PrenotazioneViewSet(viewsets.ModelViewSet):
         else:  # retrieve
             return PrenotazioneDetailSerializer
     
-    def get_queryset(self):
-        """Filtra le prenotazioni in base ai parametri della query."""
-        queryset = super().get_queryset()
-        
-        # Filtro per alloggio
-        alloggio_id = self.request.query_params.get('alloggio', None)
-        if alloggio_id:
-            queryset = queryset.filter(alloggio_id=alloggio_id)
-        
-        # Filtro per stato
-        stato = self.request.query_params.get('stato', None)
-        if stato:
-            queryset = queryset.filter(stato=stato)
-        
-        # Filtro per date
-        data_da = self.request.query_params.get('data_da', None)
-        data_a = self.request.query_params.get('data_a', None)
-        
-        if data_da:
-            queryset = queryset.filter(check_in__gte=data_da)
-        if data_a:
-            queryset = queryset.filter(check_out__lte=data_a)
-        
-        # Filtro per ospite
-        ospite = self.request.query_params.get('ospite', None)
-        if ospite:
-            queryset = queryset.filter(
-                models.Q(ospite_nome__icontains=ospite) |
-                models.Q(ospite_email__icontains=ospite)
-            )
-        
-        return queryset.select_related('alloggio')
-    
     def perform_create(self, serializer):
         """Salva la nuova prenotazione."""
         prenotazione = serializer.save()
@@ -336,6 +657,13 @@ class PrenotazioneViewSet(viewsets.ModelViewSet):
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
+            if isinstance(self.paginator, PrenotazioneCursorPagination):
+                # Nessun conteggio: le pagine si scorrono con i link next/previous
+                return self.get_paginated_response({
+                    'page_size': self.paginator.page_size,
+                    'results': serializer.data,
+                    'timestamp': datetime.datetime.now().isoformat()
+                })
             return self.get_paginated_response({
                 'count': self.paginator.page.paginator.count,
                 'num_pages': self.paginator.page.paginator.num_pages,
@@ -353,30 +681,26 @@ class PrenotazioneViewSet(viewsets.ModelViewSet):
         })
 
 
-# Aggiungi l'action di disponibilità alla classe AlloggioViewSet esistente
-# (questa va aggiunta DENTRO la classe AlloggioViewSet esistente)
-
-@action(detail=True, methods=['get'])
-def disponibilita(self, request, pk=None):
+@api_view(['GET'])
+@csrf_exempt
+def disponibilita_generale(request):
     """
-    Endpoint per verificare la disponibilità di un alloggio.
-    GET /alloggi/{id}/disponibilita/?check_in=YYYY-MM-DD&check_out=YYYY-MM-DD
+    Endpoint per verificare la disponibilità generale.
+    GET /api/disponibilita/?alloggio_id=1&check_in=YYYY-MM-DD&check_out=YYYY-MM-DD
     """
-    alloggio = self.get_object()
-    
-    # Ottieni i parametri dalla query string
+    alloggio_id = request.query_params.get('alloggio_id')
     check_in = request.query_params.get('check_in')
     check_out = request.query_params.get('check_out')
     
-    if not check_in or not check_out:
+    if not all([alloggio_id, check_in, check_out]):
         return Response(
-            {'error': 'Parametri check_in e check_out sono obbligatori.'},
+            {'error': 'Parametri alloggio_id, check_in e check_out sono obbligatori.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Valida i dati usando il serializer
+    # Valida i dati
     serializer = DisponibilitaSerializer(data={
-        'alloggio_id': alloggio.id,
+        'alloggio_id': alloggio_id,
         'check_in': check_in,
         'check_out': check_out
     })
@@ -387,61 +711,42 @@ def disponibilita(self, request, pk=None):
     # Verifica disponibilità
     disponibile = serializer.get_disponibilita()
     
-    # Calcola informazioni aggiuntive
-    numero_notti = (serializer.validated_data['check_out'] - 
-                   serializer.validated_data['check_in']).days
-    prezzo_totale = alloggio.prezzo_notte * numero_notti
-    
-    return Response({
+    dati = {
         'disponibile': disponibile,
-        'alloggio': {
-            'id': alloggio.id,
-            'nome': alloggio.nome,
-            'prezzo_notte': alloggio.prezzo_notte,
-        },
-        'periodo': {
-            'check_in': check_in,
-            'check_out': check_out,
-            'numero_notti': numero_notti,
-        },
-        'calcolo': {
-            'prezzo_totale': prezzo_totale,
-            'prezzo_per_notte': alloggio.prezzo_notte,
-        }
-    })
+        'message': 'Disponibile' if disponibile else 'Non disponibile per le date selezionate'
+    }
+    if not disponibile:
+        dati['suggerimenti'] = suggerimenti(
+            serializer.validated_data['alloggio'],
+            serializer.validated_data['check_in'],
+            serializer.validated_data['check_out'],
+        )
+    
+    return Response(dati)
 
 
-@api_view(['GET'])
+@api_view(['POST'])
 @csrf_exempt
-def disponibilita_generale(request):
+def disponibilita_batch(request):
     """
-    Endpoint per verificare la disponibilità generale.
-    GET /api/disponibilita/?alloggio_id=1&check_in=YYYY-MM-DD&check_out=YYYY-MM-DD
+    Endpoint per verificare disponibilità e prezzo di più alloggi/periodi.
+    POST /api/disponibilita/batch/
+    Body: [{"alloggio_id": 1, "check_in": "YYYY-MM-DD", "check_out": "YYYY-MM-DD"}, ...]
     """
-    alloggio_id = request.query_params.get('alloggio_id')
-    check_in = request.query_params.get('check_in')
-    check_out = request.query_params.get('check_out')
-    
-    if not all([alloggio_id, check_in, check_out]):
+    if not isinstance(request.data, list) or not request.data:
         return Response(
-            {'error': 'Parametri alloggio_id, check_in e check_out sono obbligatori.'},
+            {'error': 'Il corpo della richiesta deve essere una lista non vuota.'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Valida i dati
-    serializer = DisponibilitaSerializer(data={
-        'alloggio_id': alloggio_id,
-        'check_in': check_in,
-        'check_out': check_out
-    })
+    if len(request.data) > DisponibilitaBatchSerializer.MAX_RICHIESTE:
+        return Response(
+            {'error': f'Massimo {DisponibilitaBatchSerializer.MAX_RICHIESTE} richieste per chiamata.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
+    serializer = DisponibilitaBatchSerializer(data=request.data, many=True)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    # Verifica disponibilità
-    disponibile = serializer.get_disponibilita()
-    
-    return Response({
-        'disponibile': disponibile,
-        'message': 'Disponibile' if disponibile else 'Non disponibile per le date selezionate'
-    })
\ No newline at end of file
+    return Response({'risultati': preventivi(serializer.validated_data)})
@@ -0,0 +1,4 @@
+# Carica l'app Celery all'avvio di Django, così @shared_task la usa
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
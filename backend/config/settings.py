@@ -14,7 +14,9 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',        
+    'django_filters',
     'corsheaders',           
     'drf_spectacular',       
     'api.apps.ApiConfig',  
@@ -46,6 +48,39 @@ DATABASES = {
     }
 }
 
+# Cache condivisa su Redis quando disponibile, altrimenti in memoria locale
+REDIS_HOST = os.environ.get('REDIS_HOST')
+if REDIS_HOST:
+    REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', '')
+    REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/1",
+        }
+    }
+    CELERY_BROKER_URL = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0"
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Elaborazione in background (Celery) con broker Redis; senza Redis i task
+# sono eseguiti in modo sincrono nel processo (sviluppo locale e test)
+CELERY_TASK_ALWAYS_EAGER = os.environ.get(
+    'CELERY_TASK_ALWAYS_EAGER', 'False' if REDIS_HOST else 'True'
+) == 'True'
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_IGNORE_RESULT = True
+# Task lunghi (immagini): un task alla volta per processo, confermato a fine lavoro
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Processi del worker: di default uno per core, così le foto di un
+# caricamento multiplo sono elaborate in parallelo
+CELERY_WORKER_CONCURRENCY = int(os.environ['CELERY_CONCURRENCY']) if os.environ.get('CELERY_CONCURRENCY') else None
+
 LANGUAGE_CODE = 'it-it'
 TIME_ZONE = 'Europe/Rome'
 USE_I18N = True
@@ -56,6 +91,14 @@ STATIC_ROOT = '/app/staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Location interna di nginx da cui consegnare le immagini negoziate
+# (X-Accel-Redirect); vuoto = redirect al file sotto MEDIA_URL
+IMMAGINI_X_ACCEL_PREFIX = os.environ.get('IMMAGINI_X_ACCEL_PREFIX', '')
+
+# Copia locale delle foto indicate solo con un URL esterno: scaricate in
+# background ed elaborate come gli upload (vedi api.importazione)
+IMMAGINI_COPIA_REMOTE = os.environ.get('IMMAGINI_COPIA_REMOTE', 'False') == 'True'
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -71,6 +114,9 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+    ],
 }
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
@@ -112,4 +158,7 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+    ],
 }
\ No newline at end of file